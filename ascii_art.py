@@ -0,0 +1,57 @@
+from functools import lru_cache
+
+
+DEFAULT_CHARSET = '@%#*+=-:. '  # используется, пока пользователь не прислал свой набор символов
+TELEGRAM_TEXT_LIMIT = 4096
+CODE_BLOCK_OVERHEAD = len("```\n") + len("\n```")  # обрамление арта в ascii_and_send
+CHAR_ASPECT = 0.55  # буквы выше, чем шире
+
+
+@lru_cache(maxsize=128)
+def ascii_lut(charset):
+    """ Строит таблицу из 256 элементов: уровень серого -> символ набора charset. Таблица кэшируется для каждого
+    набора символов. Для набора из одних ASCII-символов возвращается bytes (для bytes.translate),
+    для остальных - кортеж строк (для str.translate)."""
+
+    charset = charset or DEFAULT_CHARSET
+    table = [charset[level * len(charset) // 256] for level in range(256)]
+    if charset.isascii():
+        return ''.join(table).encode('ascii')
+    return tuple(table)
+
+
+def pixels_to_ascii(image, charset):
+    """ Конвертирует пиксели изображения в градациях серого в строку ASCII-символов одним проходом
+    через таблицу ascii_lut, без посимвольной конкатенации."""
+
+    raw = image.convert('L').tobytes()
+    lut = ascii_lut(charset)
+    if isinstance(lut, bytes):
+        return raw.translate(lut).decode('ascii')
+    return raw.decode('latin-1').translate(lut)
+
+
+def fit_width(width, height, columns, max_chars):
+    """ Возвращает наибольшее число столбцов, не превышающее columns, при котором весь арт вместе с переводами
+    строк помещается в max_chars символов, и соответствующее ему число строк."""
+
+    aspect_ratio = height / float(width) * CHAR_ASPECT
+    while columns > 1:
+        rows = max(1, int(aspect_ratio * columns))
+        if rows * (columns + 1) <= max_chars:
+            return columns, rows
+        # подбираем ширину по площади, а не уменьшаем по одному столбцу
+        columns = min(columns - 1, int((max_chars / aspect_ratio) ** 0.5))
+    return 1, max(1, min(int(aspect_ratio), max_chars // 2))
+
+
+def image_to_ascii(image, charset, columns=40, max_chars=TELEGRAM_TEXT_LIMIT - CODE_BLOCK_OVERHEAD):
+    """ Преобразует изображение в ASCII-арт шириной до columns символов. Если арт не помещается в max_chars
+    символов (по умолчанию - в одно сообщение Telegram), ширина уменьшается так, чтобы поместилось
+    все изображение целиком. Строки собираются одним join."""
+
+    columns, rows = fit_width(image.width, image.height, columns, max_chars)
+    # reducing_gap: сначала быстрое целочисленное уменьшение (Image.reduce), затем точное - почти без потери качества
+    img_resized = image.convert('L').resize((columns, rows), reducing_gap=3.0)
+    img_str = pixels_to_ascii(img_resized, charset)
+    return ''.join(img_str[i:i + columns] + '\n' for i in range(0, len(img_str), columns))
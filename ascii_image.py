@@ -0,0 +1,105 @@
+""" ASCII-арт картинкой: сетка символов рисуется в PNG, поэтому ширина не ограничена длиной сообщения Telegram
+и арт не зависит от шрифта телефона.
+
+Каждый символ набора растеризуется один раз в ячейку фиксированного размера; атлас (glyph_atlas) кэшируется
+для каждого набора символов. Картинка собирается построчно: строка пикселей ряда ячеек - это склейка
+соответствующих строк глифов (bytes.join по индексам символов), без вызова draw.text на каждую ячейку.
+В цветном режиме глифы окрашиваются цветом своего участка исходника на черном фоне.
+
+Шрифт задается ASCII_FONT (путь к TTF или имя, которое найдет FreeType) и ASCII_FONT_SIZE; если шрифт не найден,
+используется встроенный шрифт Pillow.
+"""
+import math
+import os
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from ascii_art import DEFAULT_CHARSET
+
+
+ASCII_FONT = os.environ.get('ASCII_FONT', 'DejaVuSansMono.ttf')
+ASCII_FONT_SIZE = int(os.environ.get('ASCII_FONT_SIZE', 12))
+
+
+@lru_cache(maxsize=None)
+def load_font(path=ASCII_FONT, size=ASCII_FONT_SIZE):
+    """ Загружает TTF-шрифт path размера size (один раз для каждой пары), а если его нет - встроенный шрифт
+    Pillow того же размера. """
+
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+class GlyphAtlas:
+    """ Растеризованные символы набора: cell - размер ячейки (ширина, высота), rows[y][i] - y-я строка пикселей
+    i-го символа (cell[0] байт яркости глифа, 0 - фон, 255 - сам символ). """
+
+    __slots__ = ('cell', 'rows')
+
+    def __init__(self, cell, rows):
+        self.cell = cell
+        self.rows = rows
+
+
+@lru_cache(maxsize=32)
+def glyph_atlas(charset, font_path=ASCII_FONT, font_size=ASCII_FONT_SIZE):
+    """ Атлас глифов набора charset: все символы рисуются по центру ячеек одного размера (по самому широкому
+    символу и полной высоте строки шрифта). """
+
+    font = load_font(font_path, font_size)
+    ascent, descent = font.getmetrics()
+    width = max(1, max(math.ceil(font.getlength(char)) for char in charset))
+    height = ascent + descent
+    strip = Image.new('L', (width * len(charset), height))
+    draw = ImageDraw.Draw(strip)
+    for index, char in enumerate(charset):
+        draw.text((index * width + (width - font.getlength(char)) / 2, 0), char, fill=255, font=font)
+    data = strip.tobytes()
+    stride = strip.width
+    rows = tuple([data[y * stride + index * width:y * stride + (index + 1) * width] for index in range(len(charset))]
+                 for y in range(height))
+    return GlyphAtlas((width, height), rows)
+
+
+@lru_cache(maxsize=128)
+def index_lut(length):
+    """ Таблица для bytes.translate: уровень серого -> номер символа в наборе из length символов (как ascii_lut). """
+
+    return bytes(level * length // 256 for level in range(256))
+
+
+def grid_size(width, height, columns, cell):
+    """ Число столбцов и строк сетки: пропорции картинки сохраняются с учетом пропорций ячейки. """
+
+    return columns, max(1, round(height / width * columns * cell[0] / cell[1]))
+
+
+def render_ascii(image, charset='', columns=200, color=False):
+    """ Рисует ASCII-арт изображения шириной columns символов и возвращает картинку: черные символы на белом
+    ('L') или, при color=True, символы цвета исходника на черном ('RGB'). На темном фоне плотные символы должны
+    стоять в светлых местах, поэтому в цветном режиме набор символов переворачивается."""
+
+    # переводы строк и другие управляющие символы нельзя нарисовать в ячейке
+    charset = ''.join(char for char in charset if char.isprintable()) or DEFAULT_CHARSET
+    if color:
+        charset = charset[::-1]
+    atlas = glyph_atlas(charset)
+    columns, rows = grid_size(image.width, image.height, columns, atlas.cell)
+    # reducing_gap: сначала быстрое целочисленное уменьшение, затем точное (как в ascii_art.image_to_ascii)
+    small = image.convert('RGB' if color else 'L').resize((columns, rows), reducing_gap=3.0)
+    indices = small.convert('L').tobytes().translate(index_lut(len(charset)))
+
+    lines = []
+    for start in range(0, len(indices), columns):
+        cells = indices[start:start + columns]
+        for glyph_rows in atlas.rows:
+            lines.append(b''.join(map(glyph_rows.__getitem__, cells)))
+    size = (columns * atlas.cell[0], rows * atlas.cell[1])
+    mask = Image.frombytes('L', size, b''.join(lines))
+    if not color:
+        return mask.point(lambda value: 255 - value)
+    colors = small.resize(size, Image.Resampling.NEAREST)
+    return Image.composite(colors, Image.new('RGB', size), mask)
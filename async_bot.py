@@ -0,0 +1,461 @@
+""" Асинхронный вариант бота на AsyncTeleBot. Запуск: python async_bot.py
+
+Команды и кнопки те же, что в bot.py, и используют общее с ним состояние из bot_common.py (хранилище сессий,
+кэш скачанных фото, исполнитель преобразований); сам bot.py не импортируется. Обращения к хранилищам, которые
+могут читать и писать SQLite или файлы (сессии, result_cache, media_assets), выполняются вне цикла событий
+(asyncio.to_thread). Каждое нажатие кнопки обрабатывается как конвейер из трех стадий: асинхронное скачивание,
+преобразование в пуле (CPU-работа не блокирует цикл событий) и асинхронная отправка. У каждой стадии свой лимит
+одновременных задач, поэтому медленная отправка одной фотографии не задерживает остальные чаты.
+"""
+import asyncio
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot import types
+from telebot.asyncio_helper import ApiTelegramException
+
+import metrics
+from decoding import ImageTooLarge
+from encoders import is_sticker
+
+from bot_common import (ALBUM_WAIT, BUSY_TEXT, DOCUMENT_MAX_BYTES, DOCUMENT_MIME_TYPES, DOCUMENT_TOO_BIG_TEXT,
+                        DUPLICATE_TEXT, EMPTY_PIPELINE_TEXT, IMAGE_TOO_LARGE_TEXT, JOB_CALLBACKS, MAX_ASCII_WIDTH,
+                        MIN_ASCII_WIDTH, NOT_IMAGE_TEXT, NO_PHOTO_TEXT, QUEUED_TEXT, QUEUE_FULL_TEXT, TELEGRAM_API_URL,
+                        TIMEOUT_TEXT, VIDEO_UNAVAILABLE_TEXT, album_text, colormap_reply, compliments, deal_entry,
+                        download_cache, get_mirror_keyboard, get_options_keyboard, get_pipeline_keyboard, job_key, jobs,
+                        jokes, media_assets, operation_params, operation_result_key, photo_for_operation, pipeline_text,
+                        result_cache, save_mirror_direction, send_queue, sessions, stats_text, store_album,
+                        transform_backend, update_pipeline, update_session)
+from photo_sizes import document_sizes, photo_sizes
+from scheduler import AsyncJobScheduler, QueueFull
+from transform_backend import BackendBusy, TransformTimeout
+
+
+TOKEN = os.environ['TOKEN']
+# размер общего пула HTTP-соединений aiohttp, через который идут все запросы к Telegram
+asyncio_helper.REQUEST_LIMIT = int(os.environ.get('ASYNC_HTTP_CONNECTIONS', 50))
+# отправки проходят через ту же очередь с лимитами Telegram, что и в bot.py
+asyncio_helper._process_request = send_queue.wrap_async(asyncio_helper._process_request)
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL + '/bot{0}/{1}'
+    asyncio_helper.FILE_URL = TELEGRAM_API_URL + '/file/bot{0}/{1}'
+
+bot = AsyncTeleBot(TOKEN)
+
+# лимиты одновременных задач для каждой стадии конвейера
+download_slots = asyncio.Semaphore(int(os.environ.get('ASYNC_DOWNLOADS', 16)))
+transform_slots = asyncio.Semaphore(int(os.environ.get('ASYNC_TRANSFORMS', transform_backend.workers)))
+upload_slots = asyncio.Semaphore(int(os.environ.get('ASYNC_UPLOADS', 8)))
+
+# конвейеры обработки выполняются по кругу между чатами с теми же лимитами на чат, что и в bot.py
+job_scheduler = AsyncJobScheduler(workers=int(os.environ.get('ASYNC_JOBS', 16)),
+                                  chat_limit=int(os.environ.get('JOB_CHAT_LIMIT', 1)),
+                                  chat_queue=int(os.environ.get('JOB_CHAT_QUEUE', 5)),
+                                  max_queue=int(os.environ.get('JOB_MAX_QUEUE', 100)))
+
+pending_albums = {}  # media_group_id -> {'message': первое сообщение, 'photos': [(message_id, sizes)], 'task': Task}
+
+# потоки, в которых ждем transform_backend.run (в режиме inline в них же идут и сами вычисления)
+transform_threads = ThreadPoolExecutor(max_workers=int(os.environ.get('ASYNC_TRANSFORMS', transform_backend.workers)),
+                                       thread_name_prefix='async-transform')
+
+
+@bot.message_handler(commands=['start', 'help'])
+async def send_welcome(message):
+    """ Обработчик сообщений, реагирует на команды /start и /help, отправляя приветственное сообщение. """
+
+    await bot.reply_to(message, "Send me an image, and I'll provide options for you!")
+
+
+@bot.message_handler(commands=['joke'])
+async def send_random_joke(message):
+    """ Обработчик сообщений, реагирует на команду /joke, отправляя следующую шутку из колоды чата
+    (см. bot_common.deal_entry)."""
+
+    await bot.reply_to(message, await asyncio.to_thread(deal_entry, message.chat.id, 'jokes', jokes))
+
+
+@bot.message_handler(commands=['compliment'])
+async def send_random_compliment(message):
+    """ Обработчик сообщений, реагирует на команду /compliment, отправляя следующий комплимент из колоды чата. """
+
+    await bot.reply_to(message, await asyncio.to_thread(deal_entry, message.chat.id, 'compliments', compliments))
+
+
+@bot.message_handler(commands=['rnd'])
+async def toss_a_coin(message):
+    """ Обработчик сообщений, реагирует на команду /rnd, отправляя одно из двух видео с записью процесса подбрасывания
+    монеты. Результат, ОРЕЛ или РЕШКА зависит от сгенерированного числа 1 или 0."""
+
+    rnd = random.randint(0, len(media_assets.paths) - 1)
+    await send_video_asset(message.chat.id, f'coin_{rnd}')
+
+
+async def send_video_asset(chat_id, name):
+    """ Отправляет видео из media_assets по сохраненному file_id; загружает файл, только если file_id еще нет
+    или Telegram его отверг."""
+
+    file_id = media_assets.file_id(name)
+    if file_id is not None:
+        try:
+            await bot.send_video(chat_id, file_id)
+            return
+        except ApiTelegramException:
+            await asyncio.to_thread(media_assets.forget, name)
+    try:
+        video = media_assets.open(name)
+    except OSError:
+        await bot.send_message(chat_id, VIDEO_UNAVAILABLE_TEXT)
+        return
+    with video:
+        async with upload_slots:
+            sent = await bot.send_video(chat_id, video, timeout=10)
+    await asyncio.to_thread(media_assets.remember, name, sent.video.file_id)
+
+
+@bot.message_handler(content_types=['photo'])
+async def handle_photo(message):
+    """ Обработчик сообщений, реагирует на изображения, отправляемые пользователем. Предлагает
+    выбрать варианты обработки; для альбома - одну клавиатуру на все фото."""
+
+    sizes = tuple(photo_sizes(message.photo))
+    if message.media_group_id:
+        collect_album_photo(message, sizes)
+        return
+    # сессия сохраняется до ответа: нажатие кнопки под ответом должно застать фото в сессии
+    await asyncio.to_thread(update_session, message.chat.id, sizes=sizes, album=())
+    await bot.reply_to(message, "I got your photo! Please choose what you'd like to do with it.",
+                       reply_markup=get_options_keyboard())
+
+
+@bot.message_handler(content_types=['document'])
+async def handle_document(message):
+    """ Обработчик изображений, присланных документом (см. bot.handle_document). """
+
+    document = message.document
+    if document.mime_type not in DOCUMENT_MIME_TYPES:
+        await bot.reply_to(message, NOT_IMAGE_TEXT)
+        return
+    if document.file_size and document.file_size > DOCUMENT_MAX_BYTES:
+        await bot.reply_to(message, DOCUMENT_TOO_BIG_TEXT.format(DOCUMENT_MAX_BYTES // (1024 * 1024)))
+        return
+    await asyncio.to_thread(update_session, message.chat.id, sizes=tuple(document_sizes(document)), album=())
+    await bot.reply_to(message, "I got your image! Please choose what you'd like to do with it.",
+                       reply_markup=get_options_keyboard())
+
+
+def collect_album_photo(message, sizes):
+    """ Добавляет фото к альбому с тем же media_group_id и откладывает ответ на ALBUM_WAIT секунд после
+    последнего фото альбома."""
+
+    album = pending_albums.setdefault(message.media_group_id, {'message': message, 'photos': [], 'task': None})
+    album['photos'].append((message.message_id, sizes))
+    if album['task'] is not None:
+        album['task'].cancel()
+    album['task'] = asyncio.create_task(finish_album(message.media_group_id))
+
+
+async def finish_album(media_group_id):
+    """ Сохраняет собранный альбом в сессии и предлагает одну клавиатуру для всех его фото. """
+
+    await asyncio.sleep(ALBUM_WAIT)
+    album = pending_albums.pop(media_group_id)
+    await asyncio.to_thread(store_album, album['message'].chat.id, album['photos'])
+    await bot.reply_to(album['message'], album_text(len(album['photos'])), reply_markup=get_options_keyboard())
+
+
+@bot.message_handler(commands=['width'])
+async def save_ascii_width(message):
+    """ Обработчик сообщений, реагирует на команду /width N, задавая ширину ASCII-арта в символах. """
+
+    argument = message.text.split(maxsplit=1)[1:]
+    if not argument or not argument[0].isdigit() or not MIN_ASCII_WIDTH <= int(argument[0]) <= MAX_ASCII_WIDTH:
+        await bot.reply_to(message,
+                           f'Укажите ширину от {MIN_ASCII_WIDTH} до {MAX_ASCII_WIDTH} символов, например: /width 80')
+        return
+    await asyncio.to_thread(update_session, message.chat.id, ascii_width=int(argument[0]))
+    await bot.reply_to(message, f'Ширина ASCII-арта: {argument[0]} символов.')
+
+
+@bot.message_handler(commands=['colormap'])
+async def save_colormap(message):
+    """ Обработчик сообщений, реагирует на команду /colormap NAME, выбирая цветовую карту для тепловой карты. """
+
+    await bot.reply_to(message, await asyncio.to_thread(colormap_reply, message.chat.id, message.text))
+
+
+@bot.message_handler(commands=['stats'])
+async def send_stats(message):
+    """ Обработчик сообщений, реагирует на команду /stats, сообщая долю попаданий в кэши бота. """
+
+    await bot.reply_to(message, stats_text())
+
+
+@bot.message_handler(content_types=['text'])
+async def save_ascii_chars(message):
+    """ Обработчик сообщений, принимает уникальный набор символов ASCII, введенный пользователем."""
+
+    await asyncio.to_thread(update_session, message.chat.id, charset=message.text)
+    await bot.reply_to(message, 'Ваши данные успешно сохранены!')
+
+
+@bot.callback_query_handler(func=lambda call: True)
+async def callback_query(call: types.CallbackQuery):
+    """ Обработчик нажатий кнопок: замеряет время ответа (стадия callback) и передает нажатие answer_callback.
+    Повторные нажатия склеиваются так же, как в bot.callback_query. """
+
+    with metrics.timed(call.data.split(':', 1)[0], 'callback'):
+        key = await asyncio.to_thread(job_key, call.message.chat.id, call.data)
+        if key is not None and not jobs.begin(key, JOB_CALLBACKS[call.data]):
+            await bot.answer_callback_query(call.id, DUPLICATE_TEXT)
+            return
+        try:
+            await answer_callback(call, key)
+        except BaseException:
+            if key is not None:
+                jobs.finish(key)
+            raise
+
+
+async def answer_callback(call: types.CallbackQuery, key=None):
+    """ Определяет действия в ответ на выбор пользователя и ставит конвейер обработки в очередь планировщика
+    (key - ключ склейки нажатий, см. bot_common.job_key). """
+
+    chat_id = call.message.chat.id
+    if call.data == "pixelate":
+        await bot.answer_callback_query(call.id, "Pixelating your image...")
+        await schedule_transform(chat_id, 'pixelate', key)
+    elif call.data == "ascii":
+        await bot.answer_callback_query(call.id, "Converting your image to ASCII art...")
+        await schedule_transform(chat_id, 'ascii', key)
+    elif call.data in ("ascii_image", "ascii_color"):
+        await bot.answer_callback_query(call.id, "Drawing your image as ASCII art...")
+        await schedule_transform(chat_id, call.data, key)
+    elif call.data == "negative":
+        await bot.answer_callback_query(call.id, "Creating a negative your image...")
+        await schedule_transform(chat_id, 'negative', key)
+    elif call.data == "heatmap":
+        await bot.answer_callback_query(call.id, "Creating a heatmap your image...")
+        await schedule_transform(chat_id, 'heatmap', key)
+    elif call.data == "resize":
+        await bot.answer_callback_query(call.id, "Resizing an your image...")
+        await schedule_transform(chat_id, 'resize', key)
+    elif call.data in ("mirror", "horizontal", "vertical"):
+        await bot.answer_callback_query(call.id, "Выберите горизонтально или вертикально отзеркалить...")
+        await bot.delete_message(chat_id, call.message.message_id)
+        await bot.send_message(chat_id=chat_id, text="Отразить горизонтально или вертикально:",
+                               reply_markup=get_mirror_keyboard())
+        if call.data != "mirror":
+            await asyncio.to_thread(save_mirror_direction, chat_id, call.data == "horizontal")
+            await schedule_transform(chat_id, 'mirror', key)
+    elif call.data == "chain":
+        await bot.answer_callback_query(call.id, "Соберите цепочку преобразований...")
+        session = await asyncio.to_thread(sessions.get, chat_id)
+        await bot.send_message(chat_id, pipeline_text(session.pipeline), reply_markup=get_pipeline_keyboard())
+    elif call.data.startswith("chain:") or call.data == "chain_clear":
+        steps = await asyncio.to_thread(update_pipeline, chat_id, call.data)
+        await bot.answer_callback_query(call.id, f"Шагов в цепочке: {len(steps)}")
+        await bot.edit_message_text(pipeline_text(steps), chat_id, call.message.message_id,
+                                    reply_markup=get_pipeline_keyboard())
+    elif call.data == "chain_apply":
+        await bot.answer_callback_query(call.id, "Applying the chain to your image...")
+        await schedule_transform(chat_id, 'pipeline', key)
+
+
+async def download_photo(sizes, operation, params):
+    """ Стадия скачивания: возвращает байты нужного варианта фотографии из кэша или скачивает их из Telegram. """
+
+    file_id, file_unique_id = photo_for_operation(sizes, operation, params)
+    data = await asyncio.to_thread(download_cache.get, file_unique_id)
+    if data is None:
+        async with download_slots:
+            with metrics.timed(operation, 'get_file'):
+                file_info = await bot.get_file(file_id)
+            with metrics.timed(operation, 'download_file'):
+                data = await bot.download_file(file_info.file_path)
+        await asyncio.to_thread(download_cache.put, file_unique_id, data)
+    return data
+
+
+async def transform_photo(chat_id, operation, data, params):
+    """ Стадия преобразования: выполняет transform_backend.run вне цикла событий. Если исполнитель перегружен,
+    не уложился во время или изображение слишком большое, сообщает об этом пользователю и возвращает None."""
+
+    loop = asyncio.get_running_loop()
+    async with transform_slots:
+        try:
+            return await loop.run_in_executor(transform_threads, transform_backend.run, operation, data, params)
+        except BackendBusy:
+            await bot.send_message(chat_id, BUSY_TEXT)
+        except TransformTimeout:
+            await bot.send_message(chat_id, TIMEOUT_TEXT)
+        except ImageTooLarge:
+            await bot.send_message(chat_id, IMAGE_TOO_LARGE_TEXT)
+    return None
+
+
+async def schedule_transform(chat_id, operation, key=None):
+    """ Ставит process_and_send в очередь планировщика и сообщает позицию, если задача начнется не сразу
+    (см. bot.schedule_transform). """
+
+    async def job():
+        try:
+            await process_and_send(chat_id, operation)
+        finally:
+            if key is not None:
+                jobs.finish(key)
+
+    try:
+        position = await job_scheduler.submit(chat_id, operation, job)
+    except QueueFull:
+        if key is not None:
+            jobs.finish(key)
+        await bot.send_message(chat_id, QUEUE_FULL_TEXT)
+        return
+    if position:
+        await bot.send_message(chat_id, QUEUED_TEXT.format(position))
+
+
+async def process_and_send(chat_id, operation):
+    """ Конвейер обработки одного нажатия: скачивание -> преобразование -> отправка результата. Повторный запрос
+    той же операции над тем же фото отвечается из result_cache. Длительности стадий записываются в metrics."""
+
+    with metrics.IN_FLIGHT.track(operation), metrics.timed(operation, 'total'):
+        session = await asyncio.to_thread(sessions.get, chat_id)
+        if not session.sizes:
+            await bot.send_message(chat_id, NO_PHOTO_TEXT)
+            return
+        if operation == 'pipeline' and not session.pipeline:
+            await bot.send_message(chat_id, EMPTY_PIPELINE_TEXT)
+            return
+        if session.album:
+            await send_album(chat_id, session, operation)
+            return
+        params = operation_params(session, operation)
+        key = operation_result_key(session.sizes, operation, params)
+        with metrics.timed(operation, 'cache'):
+            if await send_cached_result(chat_id, key):
+                return
+        data = await download_photo(session.sizes, operation, params)
+        result = await transform_photo(chat_id, operation, data, params)
+        if result is None:
+            return
+        async with upload_slots:
+            with metrics.timed(operation, 'send'):
+                await send_new_result(chat_id, operation, key, result)
+
+
+async def album_photo_result(session, sizes, operation, use_cache):
+    """ Возвращает (ключ, вид, значение) результата для одного фото альбома: из result_cache или после
+    скачивания и преобразования ('new'). Ошибки исполнителя пробрасываются в send_album."""
+
+    params = operation_params(session, operation, sizes)
+    key = operation_result_key(sizes, operation, params)
+    cached = await asyncio.to_thread(result_cache.get, key) if use_cache else None
+    if cached is not None:
+        return (key,) + cached
+    data = await download_photo(sizes, operation, params)
+    loop = asyncio.get_running_loop()
+    async with transform_slots:
+        result = await loop.run_in_executor(transform_threads, transform_backend.run, operation, data, params)
+    return key, 'new', result
+
+
+async def send_album(chat_id, session, operation):
+    """ Обрабатывает все фото альбома параллельно и отправляет результаты одним send_media_group
+    (ASCII-арты и стикеры - отдельными сообщениями). Если Telegram отверг file_id из кэша, фото обрабатываются
+    заново."""
+
+    for use_cache in (True, False):
+        try:
+            results = await asyncio.gather(*[album_photo_result(session, sizes, operation, use_cache)
+                                             for sizes in session.album])
+        except BackendBusy:
+            await bot.send_message(chat_id, BUSY_TEXT)
+            return
+        except TransformTimeout:
+            await bot.send_message(chat_id, TIMEOUT_TEXT)
+            return
+
+        async with upload_slots:
+            if operation == 'ascii' or is_sticker(operation):
+                for sizes, (key, kind, value) in zip(session.album, results):
+                    if kind != 'new':
+                        try:
+                            await send_stored_result(chat_id, kind, value)
+                            continue
+                        except ApiTelegramException:
+                            await asyncio.to_thread(result_cache.discard, key)
+                            key, kind, value = await album_photo_result(session, sizes, operation, False)
+                    await send_new_result(chat_id, operation, key, value)
+                return
+
+            media = [types.InputMediaPhoto(value) for _, _, value in results]
+            try:
+                with metrics.timed(operation, 'send'):
+                    sent = await bot.send_media_group(chat_id, media)
+            except ApiTelegramException:
+                if not use_cache:
+                    raise
+                for key, kind, _ in results:
+                    if kind == 'photo':
+                        await asyncio.to_thread(result_cache.discard, key)
+                continue
+        for (key, kind, _), message in zip(results, sent):
+            if kind == 'new':
+                await asyncio.to_thread(result_cache.put, key, 'photo', message.photo[-1].file_id)
+        return
+
+
+async def send_ascii(chat_id, art):
+    """ Отправляет ASCII-арт моноширинным блоком. """
+
+    await bot.send_message(chat_id, f"```\n{art}\n```", parse_mode="MarkdownV2")
+
+
+async def send_stored_result(chat_id, kind, value):
+    """ Отправляет результат из result_cache: фото и стикер - по file_id, ASCII-арт - текстом. """
+
+    if kind == 'photo':
+        await bot.send_photo(chat_id, value)
+    elif kind == 'sticker':
+        await bot.send_sticker(chat_id, value)
+    else:
+        await send_ascii(chat_id, value)
+
+
+async def send_new_result(chat_id, operation, key, result):
+    """ Отправляет только что полученный результат (ASCII-арт, стикер или фото) и запоминает его в result_cache. """
+
+    if operation == 'ascii':
+        await send_ascii(chat_id, result)
+        await asyncio.to_thread(result_cache.put, key, 'text', result)
+    elif is_sticker(operation):
+        sent = await bot.send_sticker(chat_id, result)
+        await asyncio.to_thread(result_cache.put, key, 'sticker', sent.sticker.file_id)
+    else:
+        sent = await bot.send_photo(chat_id, result)
+        await asyncio.to_thread(result_cache.put, key, 'photo', sent.photo[-1].file_id)
+
+
+async def send_cached_result(chat_id, key):
+    """ Отправляет ранее полученный результат по file_id или текстом. Возвращает False, если результата нет в кэше
+    или Telegram отверг сохраненный file_id."""
+
+    cached = await asyncio.to_thread(result_cache.get, key)
+    if cached is None:
+        return False
+    try:
+        await send_stored_result(chat_id, *cached)
+    except ApiTelegramException:
+        await asyncio.to_thread(result_cache.discard, key)
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    metrics.start_server_from_env()
+    asyncio.run(bot.polling(non_stop=True))
@@ -0,0 +1,152 @@
+""" Пакетная обработка изображений без бота: любая операция или цепочка преобразований над всеми изображениями
+каталога в пуле процессов (по умолчанию - по числу ядер). Запуск:
+
+    python batch.py pixelate photos/ --output out/ [--workers 8] [--pixel-size 20]
+    python batch.py pipeline photos/ --steps resize,negative --output out/
+    python batch.py ascii photos/ --width 60           # ASCII-арт печатается в stdout
+
+Операции и их параметры те же, что у кнопок бота (см. transforms.run_transform), формат результата - тот же,
+что отправляет бот (см. encoders.py): pixelate и ASCII-арт картинкой - PNG, resize - стикер WebP, остальное -
+JPEG, ascii - текст. Процессы пула сами читают исходники и пишут результаты, а родительский процесс получает
+только имена и длительности, поэтому память не растет с числом файлов. Каждый результат выводится сразу, как
+только готов (порядок - по мере готовности), в конце - сводка с пропускной способностью. Файлы, которые не
+удалось прочитать, обработать или записать, перечисляются в stderr, и код возврата тогда 1.
+"""
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from photo_sizes import ASCII_IMAGE_WIDTH, ASCII_WIDTH, PIXEL_SIZE
+
+
+OPERATIONS = ('pixelate', 'ascii', 'ascii_image', 'ascii_color', 'negative', 'heatmap', 'mirror', 'resize',
+              'pipeline')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+def operation_params(args):
+    """ Параметры run_transform для операции из аргументов командной строки (как bot_common.operation_params). """
+
+    operation = args.operation
+    if operation == 'pixelate':
+        return {'pixel_size': args.pixel_size}
+    if operation == 'ascii':
+        return {'charset': args.charset, 'new_width': args.width or ASCII_WIDTH}
+    if operation in ('ascii_image', 'ascii_color'):
+        return {'charset': args.charset, 'new_width': args.width or ASCII_IMAGE_WIDTH}
+    if operation == 'mirror':
+        return {'horizontal': not args.vertical}
+    colormap = {'colormap': args.colormap} if args.colormap else {}
+    if operation == 'heatmap':
+        return colormap
+    if operation == 'pipeline':
+        return {'steps': args.steps, 'pixel_size': args.pixel_size, **colormap}
+    return {}
+
+
+def output_path(path, operation, output_dir):
+    """ Куда записать результат обработки path: имя исходника с суффиксом операции и расширением формата. """
+
+    from encoders import encoder_policy
+
+    extension = '.txt' if operation == 'ascii' else FORMAT_EXTENSIONS[encoder_policy(operation)['format']]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir, f'{name}.{operation}{extension}')
+
+
+def process_file(task):
+    """ Задача процесса пула: обрабатывает один файл. Возвращает (путь, куда записан результат или None,
+    ASCII-арт для вывода или None, длительности стадий, ошибка или None). """
+
+    from transforms import run_transform
+
+    path, operation, params, output_dir = task
+    timings = {}
+    try:
+        with open(path, 'rb') as source:
+            data = source.read()
+        result = run_transform(operation, data, params, timings)
+    except Exception as error:
+        return path, None, None, timings, f'{type(error).__name__}: {error}'
+    if output_dir is None:
+        return path, None, result, timings, None
+    destination = output_path(path, operation, output_dir)
+    try:
+        with open(destination, 'w', encoding='utf-8') if operation == 'ascii' else open(destination, 'wb') as output:
+            output.write(result)
+    except OSError as error:
+        # диск заполнен, нет прав и т. п.: это ошибка одного файла, остальные обрабатываются дальше
+        return path, None, None, timings, f'{type(error).__name__}: {error}'
+    return path, destination, None, timings, None
+
+
+def list_images(inputs):
+    """ Изображения из перечисленных файлов и каталогов (без подкаталогов) в порядке имен. """
+
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, name) for name in sorted(os.listdir(item))
+                         if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.append(item)
+    return paths
+
+
+def main():
+    from pipeline import MAX_STEPS, STEPS
+    from point_ops import COLORMAPS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('operation', choices=OPERATIONS)
+    parser.add_argument('inputs', nargs='+', help='каталоги и файлы изображений')
+    parser.add_argument('--output', help='каталог для результатов (для ascii можно не задавать - вывод в stdout)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='процессов в пуле')
+    parser.add_argument('--pixel-size', type=int, default=PIXEL_SIZE)
+    parser.add_argument('--width', type=int, help='ширина ASCII-арта в символах')
+    parser.add_argument('--charset', default='', help='набор символов ASCII-арта')
+    parser.add_argument('--colormap', choices=sorted(COLORMAPS))
+    parser.add_argument('--vertical', action='store_true', help='mirror: отражать сверху вниз')
+    parser.add_argument('--steps', type=lambda value: value.split(','), default=[],
+                        help=f'шаги pipeline через запятую: {", ".join(STEPS)}')
+    args = parser.parse_args()
+
+    if args.operation == 'pipeline' and (not args.steps or len(args.steps) > MAX_STEPS or
+                                         not set(args.steps) <= set(STEPS)):
+        parser.error(f'--steps: от 1 до {MAX_STEPS} шагов из {", ".join(STEPS)}')
+    if args.output is None and args.operation != 'ascii':
+        parser.error('--output обязателен для всех операций, кроме ascii')
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    params = operation_params(args)
+    tasks = [(path, args.operation, params, args.output) for path in list_images(args.inputs)]
+    started = time.perf_counter()
+    stages = {}
+    failed = []
+    with Pool(max(1, min(args.workers, len(tasks) or 1))) as pool:
+        for path, destination, art, timings, error in pool.imap_unordered(process_file, tasks):
+            for stage, seconds in timings.items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+            if error:
+                failed.append(path)
+                print(f'{path}: {error}', file=sys.stderr, flush=True)
+            elif art is not None:
+                print(f'{path}:\n{art}\n', flush=True)
+            else:
+                print(f"{path} -> {destination} ({sum(timings.values()) * 1000:.0f} ms)", flush=True)
+    elapsed = time.perf_counter() - started
+
+    done = len(tasks) - len(failed)
+    summary = ', '.join(f'{stage} {seconds:.2f} s' for stage, seconds in stages.items())
+    print(f'{done} of {len(tasks)} images in {elapsed:.2f} s ({done / elapsed if elapsed else 0:.1f} images/s)'
+          f'{"; CPU time by stage: " + summary if summary else ""}', file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
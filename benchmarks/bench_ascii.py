@@ -0,0 +1,98 @@
+""" Сравнивает скорость прежнего посимвольного построения ASCII-арта и табличного движка ascii_art
+на изображениях из каталога photos/. Запуск из корня репозитория:
+
+    python -m benchmarks.bench_ascii [--widths 40 80 160] [--repeat 5]
+
+Столбцы map - только отображение пикселей в символы (pixels_to_ascii) на уже уменьшенном изображении,
+столбцы total - весь image_to_ascii, включая уменьшение. Время - лучшее из repeat попыток, в миллисекундах.
+"""
+import argparse
+import os
+import time
+
+from PIL import Image
+
+import ascii_art
+
+
+PHOTOS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'photos')
+CHARSET = '@%#*+=-:. '
+
+
+def legacy_pixels_to_ascii(image, charset):
+    """ Прежняя реализация pixels_to_ascii из bot.py: конкатенация строки по одному пикселю. """
+
+    characters = ""
+    for pixel in image.getdata():
+        characters += charset[pixel * len(charset) // 256]
+    return characters
+
+
+def legacy_image_to_ascii(image, charset, new_width):
+    """ Прежняя реализация image_to_ascii из bot.py: конкатенация результата по одной строке. """
+
+    image = image.convert('L')
+    width, height = image.size
+    aspect_ratio = height / float(width)
+    new_height = int(aspect_ratio * new_width * 0.55)
+    img_resized = image.resize((new_width, new_height))
+
+    characters = legacy_pixels_to_ascii(img_resized, charset)
+
+    max_characters = 4000 - (new_width + 1)
+    max_rows = max_characters // (new_width + 1)
+    result = ""
+    for i in range(0, min(max_rows * new_width, len(characters)), new_width):
+        result += characters[i:i + new_width] + "\n"
+    return result
+
+
+def best_time(function, repeat):
+    """ Минимальное время выполнения function() из repeat попыток, в миллисекундах. """
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--widths', type=int, nargs='+', default=[40, 80, 160])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    images = []
+    for name in sorted(os.listdir(PHOTOS_DIR)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with Image.open(os.path.join(PHOTOS_DIR, name)) as image:
+                images.append((name, image.convert('RGB')))
+
+    # строки без ограничения длины, чтобы обе реализации обрабатывали одинаковое число пикселей
+    unlimited = 10 ** 9
+    print(f"{'image':<12} {'width':>5} {'map legacy':>11} {'map lut':>9} {'speedup':>8}"
+          f" {'total legacy':>13} {'total lut':>10} {'speedup':>8}")
+    for width in args.widths:
+        totals = [0.0, 0.0, 0.0, 0.0]
+        for name, image in images:
+            gray = image.convert('L')
+            small = gray.resize((width, int(gray.height / gray.width * width * ascii_art.CHAR_ASPECT)))
+            row = (best_time(lambda: legacy_pixels_to_ascii(small, CHARSET), args.repeat),
+                   best_time(lambda: ascii_art.pixels_to_ascii(small, CHARSET), args.repeat),
+                   best_time(lambda: legacy_image_to_ascii(gray, CHARSET, width), args.repeat),
+                   best_time(lambda: ascii_art.image_to_ascii(gray, CHARSET, width, max_chars=unlimited),
+                             args.repeat))
+            totals = [total + value for total, value in zip(totals, row)]
+            print_row(name, width, row)
+        print_row('total', width, totals)
+
+
+def print_row(name, width, row):
+    map_legacy, map_lut, total_legacy, total_lut = row
+    print(f'{name:<12} {width:>5} {map_legacy:>11.3f} {map_lut:>9.3f} {map_legacy / map_lut:>7.1f}x'
+          f' {total_legacy:>13.2f} {total_lut:>10.2f} {total_legacy / total_lut:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+""" Измеряет стоимость преобразований из transforms.py, а также декодирования и кодирования JPEG, на изображениях
+из каталога photos/ в нескольких масштабах. Запуск из корня репозитория:
+
+    python -m benchmarks.bench_transforms [--scales 1 0.5 0.25] [--repeat 5] [--output results.json]
+                                          [--compare baseline.json] [--threshold 0.2]
+
+Для каждой операции и масштаба выводятся p50 и p95 времени одного вызова в миллисекундах (по всем изображениям
+и попыткам), пропускная способность в мегапикселях в секунду и пиковый RSS процесса после операции.
+Результаты сохраняются в JSON (--output); с --compare результаты сравниваются с ранее сохраненным файлом,
+и операции, у которых p50 вырос больше чем на threshold, считаются регрессией (код возврата 1).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import PIL
+from PIL import Image
+
+import encoders
+import transforms
+
+
+PHOTOS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'photos')
+CHARSET = '@%#*+=-:. '
+
+# операция -> функция от (изображение, закодированные байты); байты нужны только декодированию
+OPERATIONS = {
+    'decode': lambda image, data: Image.open(io.BytesIO(data)).load(),
+    # JPEG кодируется так же, как результат, который отправляет бот (negative - операция с JPEG_POLICY)
+    'encode_jpeg': lambda image, data: encoders.encode_result(image, 'negative'),
+    'pixelate_image': lambda image, data: transforms.pixelate_image(image, 20),
+    'image_to_ascii': lambda image, data: transforms.image_to_ascii(image, CHARSET, 80),
+    'pixels_to_ascii': lambda image, data: transforms.pixels_to_ascii(image.convert('L'), CHARSET),
+    'ascii_to_image': lambda image, data: transforms.ascii_to_image(image, CHARSET, 200),
+    'ascii_to_image_color': lambda image, data: transforms.ascii_to_image(image, CHARSET, 200, True),
+    'invert_colors': lambda image, data: transforms.invert_colors(image),
+    'mirror_image': lambda image, data: transforms.mirror_image(image),
+    'convert_to_heatmap': lambda image, data: transforms.convert_to_heatmap(image),
+    'resize_for_sticker': lambda image, data: transforms.resize_for_sticker(image),
+}
+
+
+def load_images(scale):
+    """ Возвращает [(имя, RGB-изображение, байты в исходном формате)] для всех фото, уменьшенных в scale раз. """
+
+    images = []
+    for name in sorted(os.listdir(PHOTOS_DIR)):
+        if not name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        with Image.open(os.path.join(PHOTOS_DIR, name)) as image:
+            image_format = image.format
+            image = image.convert('RGB')
+        if scale != 1:
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+        output = io.BytesIO()
+        image.save(output, format=image_format)
+        images.append((name, image, output.getvalue()))
+    return images
+
+
+def percentile(values, fraction):
+    """ Перцентиль отсортированного списка values (ближайший ранг). """
+
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def peak_rss_kb():
+    """ Пиковый объем резидентной памяти процесса в килобайтах (в macOS ru_maxrss дан в байтах). """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(function, images, repeat):
+    """ Вызывает function для каждого изображения repeat раз и возвращает сводку по времени одного вызова. """
+
+    timings = []
+    pixels = 0
+    for _, image, data in images:
+        function(image, data)  # прогрев: ленивые таблицы, кэши Pillow
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function(image, data)
+            timings.append(time.perf_counter() - started)
+            pixels += image.width * image.height
+    timings.sort()
+    total = sum(timings)
+    return {
+        'calls': len(timings),
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'mean_ms': total / len(timings) * 1000,
+        'calls_per_s': len(timings) / total if total else 0.0,
+        'mpix_per_s': pixels / total / 1e6 if total else 0.0,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(PHOTOS_DIR)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """ Печатает изменение p50 относительно baseline и возвращает список регрессий (операция, масштаб, рост). """
+
+    regressions = []
+    old = {(row['operation'], row['scale']): row for row in baseline['results']}
+    print(f"\n{'operation':<20} {'scale':>6} {'p50 old':>9} {'p50 new':>9} {'change':>8}")
+    for row in results:
+        previous = old.get((row['operation'], row['scale']))
+        if previous is None or not previous['p50_ms']:
+            continue
+        change = row['p50_ms'] / previous['p50_ms'] - 1
+        mark = ' REGRESSION' if change > threshold else ''
+        print(f"{row['operation']:<20} {row['scale']:>6} {previous['p50_ms']:>9.2f} {row['p50_ms']:>9.2f}"
+              f" {change:>+7.0%}{mark}")
+        if change > threshold:
+            regressions.append((row['operation'], row['scale'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 0.5, 0.25])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--operations', nargs='+', choices=sorted(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--compare', help='JSON с результатами предыдущего запуска')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост p50 (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'operation':<20} {'scale':>6} {'p50 ms':>9} {'p95 ms':>9} {'calls/s':>9} {'Mpix/s':>8}"
+          f" {'peak RSS MB':>12}")
+    for scale in args.scales:
+        images = load_images(scale)
+        for operation in args.operations:
+            row = dict(operation=operation, scale=scale, **measure(OPERATIONS[operation], images, args.repeat))
+            results.append(row)
+            print(f"{operation:<20} {scale:>6} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f}"
+                  f" {row['calls_per_s']:>9.1f} {row['mpix_per_s']:>8.1f} {row['peak_rss_kb'] / 1024:>12.1f}")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+        'images': len(images),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline:
+            if compare(results, json.load(baseline), args.threshold):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+""" Локальная замена Telegram Bot API для нагрузочных тестов: бот работает с ней как с api.telegram.org
+(TELEGRAM_API_URL, см. bot_common.py), а в настоящий Telegram не уходит ни одного запроса. Отдельный запуск:
+
+    python -m benchmarks.fake_telegram [--port 8081] [--latency 0.05] [--jitter 0.02] [--rate-limit 0.01]
+
+Сервер поддерживает методы, которыми пользуется бот: getUpdates (long polling), getFile и скачивание файлов,
+sendMessage, sendPhoto, sendSticker, sendVideo, sendMediaGroup, editMessageText, answerCallbackQuery,
+deleteMessage; остальные методы отвечают True. Фотографии пользователей - снимки из photos/ в вариантах
+90..2560 пикселей, как их отдает Telegram. Загруженные ботом фото и стикеры получают file_id, по которому их
+можно отправить повторно (так работает result_cache); неизвестный file_id дает 400, как у Telegram.
+
+Каждый запрос задерживается на latency + случайные 0..jitter секунд, а доля rate_limit отправок отвечает 429
+с retry_after. Сервер считает вызовы каждого метода, ответы 429, скачивания и загрузки в байтах - по ним видно,
+сколько запросов сэкономили кэши. Обновления кладутся в очередь методом push_update (см. load_test.py) или
+запросом POST /fake/updates с JSON-обновлением или списком обновлений; GET /fake/stats возвращает счетчики.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import time
+import zlib
+from collections import Counter
+
+from aiohttp import web
+from PIL import Image
+
+
+PHOTOS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'photos')
+PHOTO_SIDES = (90, 320, 800, 1280, 2560)  # стороны вариантов фото, которые делает Telegram
+SEND_METHODS = ('sendMessage', 'sendPhoto', 'sendSticker', 'sendVideo', 'sendMediaGroup', 'editMessageText')
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+
+
+def photo_variants(path):
+    """ Варианты фото как в Telegram: JPEG с большей стороной из PHOTO_SIDES (не больше исходной),
+    последний - исходный размер. Возвращает [(ширина, высота, байты)] от меньшего к большему. """
+
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+    variants = []
+    for side in PHOTO_SIDES:
+        if side >= max(image.size):
+            break
+        variant = image.copy()
+        variant.thumbnail((side, side))
+        variants.append(variant)
+    variants.append(image)
+    result = []
+    for variant in variants:
+        output = io.BytesIO()
+        variant.save(output, format='JPEG', quality=87)
+        result.append((variant.width, variant.height, output.getvalue()))
+    return result
+
+
+class FakeTelegram:
+    """ Состояние поддельного Bot API: файлы, очередь обновлений, счетчики вызовов. on_send(method, params, result)
+    вызывается после каждой успешной отправки в чат и каждого answerCallbackQuery - так load_test.py видит
+    ответы бота. """
+
+    def __init__(self, photos_dir=PHOTOS_DIR, latency=0.0, jitter=0.0, rate_limit=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.on_send = None
+        self.calls = Counter()  # метод -> число вызовов (скачивания файлов - 'file')
+        self.limited = Counter()  # метод -> число ответов 429
+        self.traffic = Counter()  # 'downloaded', 'uploaded' - байты; 'uploads', 'reused' - отправки файлом и по file_id
+        self.polling = asyncio.Event()  # бот начал опрашивать getUpdates
+        self._files = {}  # file_id -> (file_unique_id, file_path)
+        self._paths = {}  # file_path -> байты
+        self._file_numbers = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._arrived = asyncio.Event()
+        self.photos = []  # для каждого фото из photos_dir - список PhotoSize от меньшего к большему
+        for name in sorted(os.listdir(photos_dir)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                self.photos.append([self._photo_size(data, width, height)
+                                    for width, height, data in photo_variants(os.path.join(photos_dir, name))])
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self._api)
+        app.router.add_get('/file/bot{token}/{path:.+}', self._file)
+        app.router.add_post('/fake/updates', self._push)
+        app.router.add_get('/fake/stats', self._stats)
+        return app
+
+    def stats(self):
+        return {'calls': dict(self.calls), 'limited': dict(self.limited), 'traffic': dict(self.traffic)}
+
+    def push_update(self, update):
+        """ Кладет обновление в очередь getUpdates, присваивает ему update_id и возвращает его. """
+
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.append(update)
+        self._arrived.set()
+        return update
+
+    def message(self, chat_id, **content):
+        """ Сообщение (Message) в чате chat_id от имени пользователя с тем же id. """
+
+        return dict({'message_id': next(self._message_ids), 'date': int(time.time()),
+                     'chat': {'id': chat_id, 'type': 'private'},
+                     'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'}}, **content)
+
+    def photo_update(self, chat_id, index):
+        """ Обновление с фото номер index (по модулю числа фото в photos/). """
+
+        return {'message': self.message(chat_id, photo=self.photos[index % len(self.photos)])}
+
+    def text_update(self, chat_id, text):
+        message = self.message(chat_id, text=text)
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'message': message}
+
+    def callback_update(self, chat_id, data, message=None):
+        """ Нажатие кнопки data под сообщением message (по умолчанию - новое сообщение бота в чате). """
+
+        message = message or dict(self.message(chat_id, text='...'), **{'from': BOT_USER})
+        return {'callback_query': {'id': str(next(self._message_ids)), 'chat_instance': str(chat_id), 'data': data,
+                                   'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+                                   'message': message}}
+
+    def _photo_size(self, data, width, height):
+        file_id, unique_id = self._add_file(data, 'photos', 'jpg')
+        return {'file_id': file_id, 'file_unique_id': unique_id, 'width': width, 'height': height,
+                'file_size': len(data)}
+
+    def _add_file(self, data, folder, extension):
+        number = next(self._file_numbers)
+        file_id, path = f'{folder}-{number}', f'{folder}/file_{number}.{extension}'
+        self._files[file_id] = (f'u{number}', path)
+        self._paths[path] = data
+        return file_id, f'u{number}'
+
+    async def _api(self, request):
+        method = request.match_info['method']
+        params = dict(request.query)
+        if request.can_read_body:
+            # AsyncTeleBot шлет параметры формой и в GET-запросах, а request.post() читает тело только у POST
+            params.update(await request.clone(method='POST').post())
+        self.calls[method] += 1
+        if method != 'getUpdates':
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if method in SEND_METHODS and random.random() < self.rate_limit:
+            self.limited[method] += 1
+            return web.json_response({'ok': False, 'error_code': 429,
+                                      'description': f'Too Many Requests: retry after {self.retry_after}',
+                                      'parameters': {'retry_after': self.retry_after}}, status=429)
+        try:
+            handler = getattr(self, '_' + method, None)
+            result = await handler(params) if handler else True
+        except KeyError as error:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': f'Bad Request: {error.args[0]}'},
+                                     status=400)
+        if (method in SEND_METHODS or method == 'answerCallbackQuery') and self.on_send:
+            self.on_send(method, params, result)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _file(self, request):
+        data = self._paths.get(request.match_info['path'])
+        if data is None:
+            raise web.HTTPNotFound()
+        self.calls['file'] += 1
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        self.traffic['downloaded'] += len(data)
+        return web.Response(body=data, content_type='application/octet-stream')
+
+    async def _push(self, request):
+        body = await request.json()
+        updates = [self.push_update(update) for update in (body if isinstance(body, list) else [body])]
+        return web.json_response({'ok': True, 'result': [update['update_id'] for update in updates]})
+
+    async def _stats(self, request):
+        return web.json_response(self.stats())
+
+    async def _getUpdates(self, params):
+        self.polling.set()
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        while True:
+            # обновления до offset бот уже получил
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            remaining = deadline - time.monotonic()
+            if self._updates or remaining <= 0:
+                return self._updates[:limit]
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _getMe(self, params):
+        return BOT_USER
+
+    async def _getFile(self, params):
+        file_id = params['file_id']
+        if file_id not in self._files:
+            # file_id из записанного потока обновлений: отдаем одно из фото photos/
+            photo = self.photos[zlib.crc32(file_id.encode()) % len(self.photos)][-1]
+            file_id = photo['file_id']
+        unique_id, path = self._files[file_id]
+        return {'file_id': file_id, 'file_unique_id': unique_id, 'file_size': len(self._paths[path]),
+                'file_path': path}
+
+    def _media(self, params, field, folder, extension):
+        """ Файл из поля field: загруженный (новый file_id) или уже известный file_id. Возвращает
+        (file_id, file_unique_id, байты). """
+
+        value = params[field]
+        if isinstance(value, str):
+            if value.startswith('attach://'):
+                value = params[value[len('attach://'):]]
+            else:
+                if value not in self._files:
+                    raise KeyError('wrong file identifier/HTTP URL specified')
+                self.traffic['reused'] += 1
+                unique_id, path = self._files[value]
+                return value, unique_id, self._paths[path]
+        data = value.file.read()
+        self.traffic['uploads'] += 1
+        self.traffic['uploaded'] += len(data)
+        return self._add_file(data, folder, extension) + (data,)
+
+    def _bot_message(self, params, **content):
+        message = self.message(int(params['chat_id']), **content)
+        message['from'] = BOT_USER
+        return message
+
+    @staticmethod
+    def _image_size(data):
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                return image.size
+        except Exception:
+            return 0, 0
+
+    def _photo_message(self, params, field='photo'):
+        file_id, unique_id, data = self._media(params, field, 'photos', 'jpg')
+        width, height = self._image_size(data)
+        return self._bot_message(params, photo=[{'file_id': file_id, 'file_unique_id': unique_id, 'width': width,
+                                                 'height': height, 'file_size': len(data)}])
+
+    async def _sendMessage(self, params):
+        content = {'text': params['text']}
+        if params.get('reply_markup'):
+            content['reply_markup'] = json.loads(params['reply_markup'])
+        return self._bot_message(params, **content)
+
+    async def _editMessageText(self, params):
+        return await self._sendMessage(params)
+
+    async def _sendPhoto(self, params):
+        return self._photo_message(params)
+
+    async def _sendSticker(self, params):
+        file_id, unique_id, data = self._media(params, 'sticker', 'stickers', 'webp')
+        width, height = self._image_size(data)
+        return self._bot_message(params, sticker={'file_id': file_id, 'file_unique_id': unique_id, 'type': 'regular',
+                                                  'width': width, 'height': height, 'is_animated': False,
+                                                  'is_video': False})
+
+    async def _sendVideo(self, params):
+        file_id, unique_id, data = self._media(params, 'video', 'videos', 'mp4')
+        return self._bot_message(params, video={'file_id': file_id, 'file_unique_id': unique_id, 'width': 0,
+                                                'height': 0, 'duration': 0, 'file_size': len(data)})
+
+    async def _sendMediaGroup(self, params):
+        messages = []
+        for item in json.loads(params['media']):
+            messages.append(self._photo_message(dict(params, media=item['media']), 'media'))
+        return messages
+
+
+async def serve(fake, host='127.0.0.1', port=0):
+    """ Запускает сервер и возвращает (runner, адрес для TELEGRAM_API_URL). port=0 - любой свободный порт. """
+
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка каждого запроса, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, с')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='доля отправок, получающих 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    async def run():
+        fake = FakeTelegram(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                            retry_after=args.retry_after)
+        _, url = await serve(fake, args.host, args.port)
+        print(f'TELEGRAM_API_URL={url}')
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+""" Сквозной нагрузочный тест бота без Telegram: поднимает поддельный Bot API (fake_telegram.py), запускает бота
+с TELEGRAM_API_URL, указывающим на него, подает поток обновлений с заданной частотой и измеряет время от
+обновления до ответа бота. Запуск из корня репозитория:
+
+    python -m benchmarks.load_test [--bot "python bot.py"] [--env TRANSFORM_BACKEND=process ...]
+                                   [--sessions 20] [--rate 2] [--script pixelate,ascii,negative]
+                                   [--replay updates.jsonl] [--record updates.jsonl]
+                                   [--latency 0.05] [--jitter 0.02] [--rate-limit 0.01] [--output results.json]
+
+Бот может работать в любом режиме: --bot "python async_bot.py", --env TRANSFORM_BACKEND=thread и т. д.
+С --bot "" бот не запускается - тест ждет, пока его запустят вручную с TELEGRAM_API_URL из вывода.
+
+По сценарию (--script) каждая из --sessions сессий - это отдельный чат, который присылает фото (по очереди
+из photos/) и нажимает кнопки сценария, дожидаясь ответа на каждое нажатие, как живой пользователь; новые
+сессии начинаются с частотой --rate в секунду. Шаг сценария, начинающийся с '/', - команда (например, /joke).
+С --replay подаются записанные обновления (JSONL, по обновлению Bot API на строку) с частотой --rate
+обновлений в секунду, не дожидаясь ответов; --record сохраняет поданный поток для повторного прогона.
+
+Ответом на обновление считается первое подходящее сообщение бота в тот же чат: клавиатура для фото,
+фото для преобразований, стикер для resize, моноширинный текст для ascii. Уведомление о позиции в очереди
+ответом не считается, другой текст вместо ожидаемого ответа - ошибка (например, "бот занят"), а нажатие,
+склеенное с такой же идущей обработкой (см. single_flight.py), учитывается отдельно как coalesced.
+Выводятся p50/p95/p99 времени ответа по операциям, пропускная способность и число вызовов каждого метода
+Bot API, ответов 429, скачанных и загруженных байт.
+
+Поддельный Bot API (fake_telegram.py), а значит и тест, работают на aiohttp (pip install aiohttp), как и async_bot.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shlex
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.bench_transforms import git_revision, percentile
+from benchmarks.fake_telegram import FakeTelegram, serve
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# тексты, которые бот присылает до ответа (bot.QUEUED_TEXT)
+NOTICE_PREFIXES = ('Задача в очереди',)
+# ответ на повторное нажатие, склеенное с уже идущей обработкой (bot.DUPLICATE_TEXT)
+DUPLICATE_PREFIXES = ('Уже обрабатываю',)
+# какой ответ завершает операцию; нажатия, которых здесь нет, ждут фото, сообщения - любой текст
+EXPECTED_REPLIES = {'photo': 'keyboard', 'document': 'keyboard', 'mirror': 'keyboard', 'chain': 'keyboard',
+                    'chain_step': 'editMessageText', 'chain_clear': 'editMessageText', 'ascii': 'ascii',
+                    'resize': 'sendSticker', '/rnd': 'sendVideo'}
+
+
+def update_operation(update):
+    """ Название операции обновления: данные кнопки, 'photo', 'document' или команда. """
+
+    if 'callback_query' in update:
+        data = update['callback_query'].get('data', '')
+        return data.split(':', 1)[0] + '_step' if ':' in data else data
+    message = update.get('message', {})
+    for content in ('photo', 'document'):
+        if content in message:
+            return content
+    text = message.get('text', '')
+    return text.split()[0].split('@')[0] if text.startswith('/') else 'text'
+
+
+def reply_kind(method, params):
+    """ Вид ответа бота: 'keyboard', 'ascii', 'text' для sendMessage, 'sendPhoto' для фото и альбомов,
+    иначе имя метода. """
+
+    if method == 'sendMessage':
+        if params.get('reply_markup'):
+            return 'keyboard'
+        return 'ascii' if params.get('parse_mode') else 'text'
+    return 'sendPhoto' if method == 'sendMediaGroup' else method
+
+
+class Operation:
+    __slots__ = ('name', 'chat_id', 'expected', 'started', 'finished', 'status', 'done')
+
+    def __init__(self, name, chat_id, expected):
+        self.name = name
+        self.chat_id = chat_id
+        self.expected = expected
+        self.started = time.perf_counter()
+        self.finished = None
+        self.status = None  # 'ok', 'coalesced', 'error' или 'timeout'
+        self.done = asyncio.Event()
+
+
+class Tracker:
+    """ Сопоставляет ответы бота (FakeTelegram.on_send) с поданными обновлениями: в каждом чате ответ завершает
+    самую раннюю операцию, которая его ждет. """
+
+    def __init__(self, record=None):
+        self.operations = []
+        self.last_message = {}  # chat_id -> последнее сообщение бота с клавиатурой (под ним нажимаются кнопки)
+        self._pending = defaultdict(list)  # chat_id -> незавершенные операции в порядке подачи
+        self._callbacks = {}  # id нажатия -> его операция
+        self._record = record
+
+    def submit(self, update):
+        """ Регистрирует поданное обновление и возвращает его Operation. """
+
+        if self._record:
+            self._record.write(json.dumps(update, ensure_ascii=False) + '\n')
+        name = update_operation(update)
+        chat = (update.get('callback_query', {}).get('message') or update.get('message', {})).get('chat', {})
+        default = 'sendPhoto' if 'callback_query' in update else 'reply'
+        operation = Operation(name, chat.get('id'), EXPECTED_REPLIES.get(name, default))
+        self.operations.append(operation)
+        self._pending[operation.chat_id].append(operation)
+        if 'callback_query' in update:
+            self._callbacks[update['callback_query']['id']] = operation
+        return operation
+
+    def on_send(self, method, params, result):
+        if method == 'answerCallbackQuery':
+            operation = self._callbacks.pop(params.get('callback_query_id'), None)
+            if operation and params.get('text', '').startswith(DUPLICATE_PREFIXES):
+                self._finish(operation, 'coalesced')
+            return
+        chat_id = int(params['chat_id'])
+        kind = reply_kind(method, params)
+        if kind == 'keyboard':
+            self.last_message[chat_id] = result
+        if kind == 'text' and params['text'].startswith(NOTICE_PREFIXES):
+            return
+        pending = self._pending.get(chat_id)
+        if not pending:
+            return
+        for operation in pending:
+            if operation.expected == kind or (operation.expected == 'reply' and kind in ('text', 'keyboard', 'ascii')):
+                self._finish(operation, 'ok')
+                return
+        if kind == 'text':
+            self._finish(pending[0], 'error')
+
+    async def wait(self, operation, timeout):
+        """ Ждет завершения операции не дольше timeout секунд с ее подачи; возвращает True, если бот ответил
+        не ошибкой. """
+
+        try:
+            await asyncio.wait_for(operation.done.wait(), max(0.0, operation.started + timeout - time.perf_counter()))
+        except asyncio.TimeoutError:
+            self._finish(operation, 'timeout')
+        return operation.status in ('ok', 'coalesced')
+
+    def _finish(self, operation, status):
+        if operation.status is not None:
+            return
+        operation.status = status
+        operation.finished = time.perf_counter()
+        self._pending[operation.chat_id].remove(operation)
+        operation.done.set()
+
+
+async def run_session(fake, tracker, chat_id, photo_index, script, timeout):
+    """ Сессия одного чата: фото, затем нажатия и команды сценария по одному; ошибка прерывает сессию. """
+
+    for step in ['photo'] + script:
+        if step == 'photo':
+            update = fake.photo_update(chat_id, photo_index)
+        elif step.startswith('/'):
+            update = fake.text_update(chat_id, step)
+        else:
+            update = fake.callback_update(chat_id, step, tracker.last_message.get(chat_id))
+        operation = tracker.submit(fake.push_update(update))
+        if not await tracker.wait(operation, timeout):
+            return
+
+
+async def run_script(fake, tracker, args):
+    sessions = []
+    for index in range(args.sessions):
+        sessions.append(asyncio.create_task(run_session(fake, tracker, args.first_chat + index, index,
+                                                        args.script, args.timeout)))
+        if args.rate > 0:
+            await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*sessions)
+
+
+async def run_replay(fake, tracker, args):
+    operations = []
+    with open(args.replay, encoding='utf-8') as updates:
+        for line in updates:
+            if line.strip():
+                update = json.loads(line)
+                update.pop('update_id', None)
+                operations.append(tracker.submit(fake.push_update(update)))
+                if args.rate > 0:
+                    await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*(tracker.wait(operation, args.timeout) for operation in operations))
+
+
+def summarize(operations, elapsed):
+    """ Сводка по операциям: число, исходы и перцентили времени ответа в миллисекундах. """
+
+    rows = []
+    for name in sorted({operation.name for operation in operations}):
+        selected = [operation for operation in operations if operation.name == name]
+        timings = sorted(operation.finished - operation.started for operation in selected if operation.status == 'ok')
+        row = {'operation': name, 'count': len(selected),
+               'ok': len(timings),
+               'coalesced': sum(operation.status == 'coalesced' for operation in selected),
+               'errors': sum(operation.status == 'error' for operation in selected),
+               'timeouts': sum(operation.status == 'timeout' for operation in selected),
+               'ok_per_s': len(timings) / elapsed if elapsed else 0.0}
+        for label, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            row[label] = percentile(timings, fraction) * 1000 if timings else None
+        row['max_ms'] = timings[-1] * 1000 if timings else None
+        rows.append(row)
+    return rows
+
+
+def print_report(rows, stats, elapsed, operations):
+    def ms(value):
+        return f'{value:>9.1f}' if value is not None else f"{'-':>9}"
+
+    print(f"\n{'operation':<16} {'count':>6} {'ok':>6} {'merged':>6} {'errors':>6} {'timeout':>7} {'p50 ms':>9}"
+          f" {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in rows:
+        print(f"{row['operation']:<16} {row['count']:>6} {row['ok']:>6} {row['coalesced']:>6} {row['errors']:>6}"
+              f" {row['timeouts']:>7} {ms(row['p50_ms'])} {ms(row['p95_ms'])} {ms(row['p99_ms'])} {ms(row['max_ms'])}")
+    completed = sum(row['ok'] for row in rows)
+    print(f'\n{len(operations)} updates, {completed} answered in {elapsed:.1f} s: {completed / elapsed if elapsed else 0:.1f} ops/s')
+
+    print(f"\n{'API method':<22} {'calls':>7} {'429':>5}")
+    for method, calls in sorted(stats['calls'].items(), key=lambda item: -item[1]):
+        print(f"{method:<22} {calls:>7} {stats['limited'].get(method, 0):>5}")
+    traffic = stats['traffic']
+    print(f"\ndownloaded {traffic.get('downloaded', 0) / 1e6:.1f} MB in {stats['calls'].get('file', 0)} files,"
+          f" uploaded {traffic.get('uploaded', 0) / 1e6:.1f} MB in {traffic.get('uploads', 0)} files,"
+          f" {traffic.get('reused', 0)} sends by file_id")
+
+
+async def start_bot(command, url, variables):
+    env = dict(os.environ, TOKEN=os.environ.get('TOKEN', '123456:FAKE'), TELEGRAM_API_URL=url)
+    env.update(variable.split('=', 1) for variable in variables)
+    return await asyncio.create_subprocess_exec(*shlex.split(command), cwd=ROOT_DIR, env=env)
+
+
+async def stop_bot(process):
+    if process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), 10)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def run(args):
+    fake = FakeTelegram(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                        retry_after=args.retry_after)
+    runner, url = await serve(fake, port=args.port)
+    record = open(args.record, 'w', encoding='utf-8') if args.record else None
+    tracker = Tracker(record)
+    fake.on_send = tracker.on_send
+    process = await start_bot(args.bot, url, args.env) if args.bot else None
+    try:
+        print(f'TELEGRAM_API_URL={url}, waiting for the bot to poll getUpdates...', flush=True)
+        await asyncio.wait_for(fake.polling.wait(), args.startup_timeout)
+        started = time.perf_counter()
+        if args.replay:
+            await run_replay(fake, tracker, args)
+        else:
+            await run_script(fake, tracker, args)
+        elapsed = time.perf_counter() - started
+    finally:
+        if process:
+            await stop_bot(process)
+        if record:
+            record.close()
+        await runner.cleanup()
+
+    rows = summarize(tracker.operations, elapsed)
+    stats = fake.stats()
+    print_report(rows, stats, elapsed, tracker.operations)
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'bot': args.bot,
+        'env': args.env,
+        'sessions': args.sessions,
+        'script': args.script,
+        'replay': args.replay,
+        'rate': args.rate,
+        'latency': args.latency,
+        'rate_limit': args.rate_limit,
+        'elapsed_s': elapsed,
+        'results': rows,
+        'api': stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bot', default=f'{shlex.quote(sys.executable)} bot.py',
+                        help='команда запуска бота ("" - бот запускается вручную)')
+    parser.add_argument('--env', action='append', default=[], help='переменная окружения бота KEY=VALUE')
+    parser.add_argument('--port', type=int, default=0, help='порт поддельного Bot API (0 - любой свободный)')
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--first-chat', type=int, default=1000, help='chat_id первой сессии')
+    parser.add_argument('--script', type=lambda value: value.split(','),
+                        default='pixelate,ascii,negative,heatmap,resize',
+                        help='нажатия и команды сценария через запятую')
+    parser.add_argument('--replay', help='JSONL с записанными обновлениями вместо сценария')
+    parser.add_argument('--record', help='куда сохранить поданные обновления (JSONL)')
+    parser.add_argument('--rate', type=float, default=2.0, help='новых сессий (или обновлений --replay) в секунду')
+    parser.add_argument('--timeout', type=float, default=60.0, help='сколько ждать ответа на обновление, с')
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка каждого запроса к Bot API, с')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='доля отправок, получающих 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,156 +1,54 @@
 import telebot
-from PIL import Image, ImageOps
 import io
 from telebot import types
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
 import os
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from decoding import ImageTooLarge
+from encoders import is_sticker
+from photo_sizes import document_sizes, photo_sizes
+from scheduler import JobScheduler, QueueFull
+from transform_backend import BackendBusy, TransformTimeout
+
+# тексты, настройки, общее состояние и функции, общие с async_bot.py
+from bot_common import (ALBUM_WAIT, BUSY_TEXT, DOCUMENT_MAX_BYTES, DOCUMENT_MIME_TYPES, DOCUMENT_TOO_BIG_TEXT,
+                        DUPLICATE_TEXT, EMPTY_PIPELINE_TEXT, IMAGE_TOO_LARGE_TEXT, JOB_CALLBACKS, MAX_ASCII_WIDTH,
+                        MIN_ASCII_WIDTH, NOT_IMAGE_TEXT, NO_PHOTO_TEXT, QUEUED_TEXT, QUEUE_FULL_TEXT, TELEGRAM_API_URL,
+                        TIMEOUT_TEXT, VIDEO_UNAVAILABLE_TEXT, album_text, colormap_reply, compliments, deal_entry,
+                        download_cache, get_mirror_keyboard, get_options_keyboard, get_pipeline_keyboard, job_key,
+                        jobs, jokes, media_assets, operation_params, operation_result_key, photo_for_operation,
+                        pipeline_text, result_cache, save_mirror_direction, send_queue, sessions, stats_text,
+                        store_album, transform_backend, update_pipeline)
 
 
 TOKEN = os.environ['TOKEN']
-bot = telebot.TeleBot(TOKEN)
-
-JOKES = ['- Жить, как говорится, хорошо! \n- А хорошо жить ещё лучше! \n- Точно!',
-         'Заполняла резюме. Под конец расплакалась... БЛИИИН... Я такая классная!',
-         '- Мама, я хочу татуировку! \n- Неси ремень, сейчас набьём!!!',
-         'Дружу только с диваном, потому что на него можно положиться.',
-         'Жить надо так, чтобы от твоего настроения была депрессия у других!',
-         'Чему нас научили бегемоты? Что нельзя похудеть, питаясь только травой и салатами!',
-         'Каждый вечер после просмотра новостей я включаю фильм ужасов, чтобы хоть как-то успокоиться!',
-         'Иногда, пока мозг думает, задница успевает принять такое решение, что тараканы в голове аплодируют стоя!',
-         'Сейчас поленюсь еще немного, а потом бездельничать начну.',
-         'Составила большой список дел...  Я только не поняла, кто их делать-то будет....'
-]
-
-COMPLIMENTS = ['У тебя потрясающее чувство юмора! С тобой мне всегда весело и легко.',
-               'Ты невероятно умный и талантливый. Мне повезло быть с тобой рядом.',
-               'Твоя щедрость и забота всегда меня поражают. Ты замечательный человек.',
-               'Твоя улыбка всегда меня вдохновляет. Ты такой прекрасный человек.',
-               'Ты всегда такой решительный и уверенный. Меня это вдохновляет.',
-               'Ты моя опора в трудные моменты. Спасибо, что всегда рядом.',
-               'Ты удивляешь меня своей глубиной. Мне нравится, что мы можем обсуждать важные темы.',
-               'Ты выглядишь так мужественно и уверенно!',
-               'Твои руки такие сильные, и я всегда чувствую себя защищенной рядом с тобой.',
-               'Твоя эрудиция и знания об этой теме просто впечатляют. Могу у тебя многому поучиться.',
-               'Ты всегда находишь интересные темы для обсуждения. Мне с тобой никогда не бывает скучно.']
-
-user_states = {}  # тут будем хранить информацию о действиях пользователя
-
-ASCII_CHARS = ''
-type_mirror = 1
-
-
-def resize_image(image, new_width=100):
-    """ Изменяет размер изображения с сохранением пропорций."""
-
-    width, height = image.size
-    ratio = height / width
-    new_height = int(new_width * ratio)
-    return image.resize((new_width, new_height))
-
-def resize_for_sticker(image, new_max_size=512):
-    """ Изменяет, в случае необходимости,  размеры изображения, ограничивая максимальный из них определенной величиной
-    (512 пикселей), сохраняя при этом исходную пропорцию."""
-
-    width, height = image.size
-    # print(f'Размеры изображения исходного: {width, height}')
-    if width < new_max_size and height < new_max_size:
-        return image
-    else:
-        ratio = height / width
-        if height > width:
-            new_height = new_max_size
-            new_width = int(new_height / ratio)
-        else:
-            new_width = new_max_size
-            new_height = int(new_width * ratio)
-        # print(f'Размеры изображения трансформированного: {new_width, new_height}')
-        image_for_sticker = image.resize((new_width, new_height))
-        return image_for_sticker
-
-def invert_colors(image):
-    """ Преобразует изображение в инверсионное (эффект негатива) """
-
-    im_invert = ImageOps.invert(image)
-    return im_invert
-
-
-def mirror_image(image):
-    """ Преобразует изображение в зеркальное """
-    if type_mirror == 1:
-        im_flipped = image.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
-    else:
-        im_flipped = image.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
-    return im_flipped
-
-
-def convert_to_heatmap(image):
-    """ Преобразует изображение так, чтобы его цвета отображались в виде тепловой карты,
-    от синего (холодные области) до красного (теплые области) """
-
-    image = grayify(image)
-    image = ImageOps.colorize(image, black='blue', white='red', mid='green')
-
-    return image
-
-
-def grayify(image):
-    """ Преобразует цветное изображение в оттенки серого. """
-
-    return image.convert("L")
-
-
-def image_to_ascii(image_stream, new_width=40):
-    """ Основная функция для преобразования изображения в ASCII-арт. Изменяет размер, преобразует в градации серого
-    и затем в строку ASCII-символов."""
-
-    # Переводим в оттенки серого
-    image = Image.open(image_stream).convert('L')
-
-    # меняем размер сохраняя отношение сторон
-    width, height = image.size
-    aspect_ratio = height / float(width)
-    new_height = int(
-        aspect_ratio * new_width * 0.55)  # 0,55 так как буквы выше чем шире
-    img_resized = image.resize((new_width, new_height))
-
-    img_str = pixels_to_ascii(img_resized)
-    img_width = img_resized.width
-
-    max_characters = 4000 - (new_width + 1)
-    max_rows = max_characters // (new_width + 1)
-
-    ascii_art = ""
-    for i in range(0, min(max_rows * img_width, len(img_str)), img_width):
-        ascii_art += img_str[i:i + img_width] + "\n"
-
-    return ascii_art
-
-
-def pixels_to_ascii(image):
-    """ Конвертирует пиксели изображения в градациях серого в строку ASCII-символов, используя предопределенную строку
-    ASCII_CHARS"""
-
-    pixels = image.getdata()
-    characters = ""
-    for pixel in pixels:
-        characters += ASCII_CHARS[pixel * len(ASCII_CHARS) // 256]
-    return characters
-
-
-# Огрубляем изображение
-def pixelate_image(image, pixel_size):
-    """ Принимает изображение и размер пикселя. Уменьшает изображение до размера, где один пиксель представляет большую
-     область, затем увеличивает обратно, создавая пиксельный эффект."""
-
-    image = image.resize(
-        (image.size[0] // pixel_size, image.size[1] // pixel_size),
-        Image.Resampling.NEAREST
-    )
-    image = image.resize(
-        (image.size[0] * pixel_size, image.size[1] * pixel_size),
-        Image.Resampling.NEAREST
-    )
-    return image
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL + '/bot{0}/{1}'
+    apihelper.FILE_URL = TELEGRAM_API_URL + '/file/bot{0}/{1}'
+# обработчики только ставят обработку фото в очередь планировщика (job_scheduler) и быстро освобождаются,
+# поэтому их потоки - быстрая полоса для команд
+bot = telebot.TeleBot(TOKEN, num_threads=int(os.environ.get('BOT_THREADS', 4)))
+
+# все отправки идут через общую очередь с лимитами Telegram (bot_common.send_queue)
+apihelper.CUSTOM_REQUEST_SENDER = send_queue.request_sender(
+    lambda method, url, **kwargs: apihelper._get_req_session().request(method, url, **kwargs))
+
+# тяжелые задачи (скачивание, обработка и отправка фото) выполняются по кругу между чатами: у чата одновременно
+# не больше JOB_CHAT_LIMIT задач и не больше JOB_CHAT_QUEUE ожидающих (см. scheduler.py)
+job_scheduler = JobScheduler(workers=int(os.environ.get('JOB_WORKERS', (os.cpu_count() or 1) + 2)),
+                             chat_limit=int(os.environ.get('JOB_CHAT_LIMIT', 1)),
+                             chat_queue=int(os.environ.get('JOB_CHAT_QUEUE', 5)),
+                             max_queue=int(os.environ.get('JOB_MAX_QUEUE', 100)))
+
+pending_albums = {}  # media_group_id -> {'message': первое сообщение, 'photos': [(message_id, sizes)], 'timer': Timer}
+pending_albums_lock = threading.Lock()
+# потоки, в которых фото альбома скачиваются и обрабатываются параллельно
+album_threads = ThreadPoolExecutor(max_workers=transform_backend.workers, thread_name_prefix='album')
+metrics.QUEUE_DEPTH.set_function(lambda: len(pending_albums), 'albums')
 
 
 @bot.message_handler(commands=['start', 'help'])
@@ -162,100 +60,191 @@ def send_welcome(message):
 
 @bot.message_handler(commands=['joke'])
 def send_random_joke(message):
-    """ Обработчик сообщений, реагирует на команду /joke, отправляя случайным образом выбранную
-    из списка JOKES шутку."""
+    """ Обработчик сообщений, реагирует на команду /joke, отправляя следующую шутку из колоды чата:
+    шутки идут в случайном порядке и не повторяются, пока не закончатся."""
 
-    lots_jokes = len(JOKES) - 1
-    random_number = random.randint(0, lots_jokes)
-    JOKE = JOKES[random_number]
-    bot.reply_to(message, JOKE)
+    bot.reply_to(message, deal_entry(message.chat.id, 'jokes', jokes))
 
 @bot.message_handler(commands=['compliment'])
 def send_random_compliment(message):
-    """ Обработчик сообщений, реагирует на команду /compliment, отправляя случайным образом выбранный
-    из списка COMPLIMENTS комплимент."""
+    """ Обработчик сообщений, реагирует на команду /compliment, отправляя следующий комплимент из колоды чата. """
+
+    bot.reply_to(message, deal_entry(message.chat.id, 'compliments', compliments))
 
-    lots_compliments = len(COMPLIMENTS) - 1
-    random_number = random.randint(0, lots_compliments)
-    COMPLIMENT = COMPLIMENTS[random_number]
-    bot.reply_to(message, COMPLIMENT)
 
 @bot.message_handler(commands=['rnd'])
 def toss_a_coin(message):
     """ Обработчик сообщений, реагирует на команду /rnd, отправляя одно из двух видео с записью процесса подбрасывания
     монеты. Результат, ОРЕЛ или РЕШКА зависит от сгенерированного числа 1 или 0."""
 
-    rnd = random.randint(0, 1)
-    if rnd == 0:
-        video = open('C:/Users/User/PycharmProjects/Stajirovka/Project3/multifunctional_telegram_bot/111.mp4', 'rb')
-    else:
-        video = open('C:/Users/User/PycharmProjects/Stajirovka/Project3/multifunctional_telegram_bot/222.mp4', 'rb')
-
-    bot.send_video(message.chat.id, video, timeout=10)
+    rnd = random.randint(0, len(media_assets.paths) - 1)
+    send_video_asset(message.chat.id, f'coin_{rnd}')
+
+
+def send_video_asset(chat_id, name):
+    """ Отправляет видео из media_assets: по сохраненному file_id, а если его нет или Telegram его отверг -
+    загружает файл и запоминает новый file_id."""
+    file_id = media_assets.file_id(name)
+    if file_id is not None:
+        try:
+            bot.send_video(chat_id, file_id)
+            return
+        except ApiTelegramException:
+            media_assets.forget(name)
+    try:
+        video = media_assets.open(name)
+    except OSError:
+        bot.send_message(chat_id, VIDEO_UNAVAILABLE_TEXT)
+        return
+    with video:
+        sent = bot.send_video(chat_id, video, timeout=10)
+    media_assets.remember(name, sent.video.file_id)
 
 @bot.message_handler(content_types=['photo'])
 def handle_photo(message):
     """ Обработчик сообщений, реагирует на изображения, отправляемые пользователем. Предлагает
-    пользователю ввести уникальный набор символов ASCII и выбрать варианты обработки."""
-
+    пользователю ввести уникальный набор символов ASCII и выбрать варианты обработки. Фото из альбома
+    собираются вместе (collect_album_photo), и клавиатура предлагается одна на весь альбом."""
+
+    # храним все варианты фото, которые предлагает Telegram: каждой операции скачиваем наименьший достаточный
+    sizes = tuple(photo_sizes(message.photo))
+    if message.media_group_id:
+        collect_album_photo(message, sizes)
+        return
+    # сессия сохраняется до ответа: нажатие кнопки под ответом должно застать фото в сессии
+    session = sessions.get(message.chat.id)
+    session.sizes = sizes
+    session.album = ()
+    sessions.save(session)
     bot.reply_to(message, "I got your photo! Please choose what you'd like to do with it.",
                  reply_markup=get_options_keyboard())
-    user_states[message.chat.id] = {'photo': message.photo[-1].file_id}
     # bot.reply_to(message, "Введите набор символов ASCII без пробелов, без запятых....")
     # bot.register_next_step_handler(message, save_ascii_chars)
 
 
-@bot.message_handler(content_types=['text'])
-def save_ascii_chars(message):
-    """ Обработчик сообщений, принимает уникальный набор символов ASCII, введенный пользователем."""
-    global ASCII_CHARS
-    ASCII_CHARS = message.text
-    bot.reply_to(message, f'Ваши данные успешно сохранены!')
+@bot.message_handler(content_types=['document'])
+def handle_document(message):
+    """ Обработчик изображений, присланных документом, то есть в полном разрешении. Принимает файлы
+    до DOCUMENT_MAX_BYTES форматов DOCUMENT_MIME_TYPES; дальше документ обрабатывается как фото с одним вариантом
+    (большие изображения - по полосам и в уменьшенном масштабе, см. tiles.py и decoding.py)."""
+
+    document = message.document
+    if document.mime_type not in DOCUMENT_MIME_TYPES:
+        bot.reply_to(message, NOT_IMAGE_TEXT)
+        return
+    if document.file_size and document.file_size > DOCUMENT_MAX_BYTES:
+        bot.reply_to(message, DOCUMENT_TOO_BIG_TEXT.format(DOCUMENT_MAX_BYTES // (1024 * 1024)))
+        return
+    session = sessions.get(message.chat.id)
+    session.sizes = tuple(document_sizes(document))
+    session.album = ()
+    sessions.save(session)
+    bot.reply_to(message, "I got your image! Please choose what you'd like to do with it.",
+                 reply_markup=get_options_keyboard())
+
 
+def collect_album_photo(message, sizes):
+    """ Добавляет фото к альбому с тем же media_group_id. Альбом считается полученным, когда после последнего
+    его фото прошло ALBUM_WAIT секунд."""
 
-def get_options_keyboard():
-    """ Создает клавиатуру с кнопками для выбора пользователем, как обработать изображение: через пикселизацию или
-    преобразование в ASCII-арт, сделать негативное изображение или зеркальное отображение """
-    keyboard = types.InlineKeyboardMarkup()
-    pixelate_btn = types.InlineKeyboardButton("Pixelate", callback_data="pixelate")
-    ascii_btn = types.InlineKeyboardButton("ASCII Art", callback_data="ascii")
-    negative_btn = types.InlineKeyboardButton("Negative", callback_data="negative")
-    mirror_btn = types.InlineKeyboardButton("Mirror", callback_data="mirror")
-    heatmap_btn = types.InlineKeyboardButton("Heatmap", callback_data="heatmap")
-    resize_btn = types.InlineKeyboardButton("Resize", callback_data="resize")
-    keyboard.add(pixelate_btn, ascii_btn, negative_btn, mirror_btn, heatmap_btn, resize_btn)
-    return keyboard
+    with pending_albums_lock:
+        album = pending_albums.setdefault(message.media_group_id, {'message': message, 'photos': [], 'timer': None})
+        album['photos'].append((message.message_id, sizes))
+        if album['timer'] is not None:
+            album['timer'].cancel()
+        album['timer'] = threading.Timer(ALBUM_WAIT, finish_album, args=(message.media_group_id,))
+        album['timer'].start()
 
 
-def get_mirror_keyboard():
-    """ Создает клавиатуру с кнопками для выбора горизонтально или вертикально отзеркалить"""
-    keyboard = types.InlineKeyboardMarkup()
-    horyzont_btn = types.InlineKeyboardButton("Горизонтально", callback_data="horizontal")
-    vert_btn = types.InlineKeyboardButton("Вертикально", callback_data="vertical")
-    keyboard.add(horyzont_btn, vert_btn)
-    return keyboard
+def finish_album(media_group_id):
+    """ Сохраняет собранный альбом в сессии и предлагает одну клавиатуру для всех его фото. """
+
+    with pending_albums_lock:
+        album = pending_albums.pop(media_group_id)
+    message = album['message']
+    store_album(message.chat.id, album['photos'])
+    bot.reply_to(message, album_text(len(album['photos'])), reply_markup=get_options_keyboard())
+
+
+@bot.message_handler(commands=['width'])
+def save_ascii_width(message):
+    """ Обработчик сообщений, реагирует на команду /width N, задавая ширину ASCII-арта в символах (и текстом,
+    и картинкой). Если арт текстом такой ширины не поместится в одно сообщение, он будет сужен."""
+
+    argument = message.text.split(maxsplit=1)[1:]
+    if not argument or not argument[0].isdigit() or not MIN_ASCII_WIDTH <= int(argument[0]) <= MAX_ASCII_WIDTH:
+        bot.reply_to(message, f'Укажите ширину от {MIN_ASCII_WIDTH} до {MAX_ASCII_WIDTH} символов, например: /width 80')
+        return
+    session = sessions.get(message.chat.id)
+    session.ascii_width = int(argument[0])
+    sessions.save(session)
+    bot.reply_to(message, f'Ширина ASCII-арта: {argument[0]} символов.')
+
+
+@bot.message_handler(commands=['colormap'])
+def save_colormap(message):
+    """ Обработчик сообщений, реагирует на команду /colormap NAME, выбирая цветовую карту для тепловой карты. """
+
+    bot.reply_to(message, colormap_reply(message.chat.id, message.text))
+
+
+@bot.message_handler(commands=['stats'])
+def send_stats(message):
+    """ Обработчик сообщений, реагирует на команду /stats, сообщая долю попаданий в кэши бота. """
+
+    bot.reply_to(message, stats_text())
+
+
+@bot.message_handler(content_types=['text'])
+def save_ascii_chars(message):
+    """ Обработчик сообщений, принимает уникальный набор символов ASCII, введенный пользователем."""
+    session = sessions.get(message.chat.id)
+    session.charset = message.text
+    sessions.save(session)
+    bot.reply_to(message, f'Ваши данные успешно сохранены!')
 
 
 @bot.callback_query_handler(func=lambda call: True)
 def callback_query(call: types.CallbackQuery):
+    """ Обработчик нажатий кнопок: замеряет время ответа (стадия callback) и передает нажатие answer_callback.
+    Повторное нажатие, пока такая же обработка идет или только что закончилась, получает только
+    answer_callback_query - без второй обработки и отправки (см. job_key). Ключ снимается, когда завершится
+    задача планировщика (см. schedule_transform)."""
+    with metrics.timed(call.data.split(':', 1)[0], 'callback'):
+        key = job_key(call.message.chat.id, call.data)
+        if key is not None and not jobs.begin(key, JOB_CALLBACKS[call.data]):
+            bot.answer_callback_query(call.id, DUPLICATE_TEXT)
+            return
+        try:
+            answer_callback(call, key)
+        except BaseException:
+            if key is not None:
+                jobs.finish(key)
+            raise
+
+
+def answer_callback(call: types.CallbackQuery, key=None):
     """ Определяет действия в ответ на выбор пользователя (например, пикселизация или ASCII-арт) и вызывает
-    соответствующую функцию обработки.
+    соответствующую функцию обработки. key - ключ склейки нажатий, который передается в задачу обработки.
 """
     if call.data == "pixelate":
         bot.answer_callback_query(call.id, "Pixelating your image...")
-        pixelate_and_send(call.message)
+        pixelate_and_send(call.message, key)
     elif call.data == "ascii":
         bot.answer_callback_query(call.id, "Converting your image to ASCII art...")
-        ascii_and_send(call.message)
+        ascii_and_send(call.message, key)
+    elif call.data in ("ascii_image", "ascii_color"):
+        bot.answer_callback_query(call.id, "Drawing your image as ASCII art...")
+        ascii_image_and_send(call.message, call.data == "ascii_color", key)
     elif call.data == "negative":
         bot.answer_callback_query(call.id, "Creating a negative your image...")
-        invert_and_send(call.message)
+        invert_and_send(call.message, key)
     elif call.data == "heatmap":
         bot.answer_callback_query(call.id, "Creating a heatmap your image...")
-        heatmap_and_send(call.message)
+        heatmap_and_send(call.message, key)
     elif call.data == "resize":
         bot.answer_callback_query(call.id, "Resizing an your image...")
-        resize_for_sticker_and_send(call.message)
+        resize_for_sticker_and_send(call.message, key)
     elif call.data == "mirror":
         bot.answer_callback_query(call.id, "Выберите горизонтально или вертикально отзеркалить...")
         bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -266,109 +255,239 @@ def callback_query(call: types.CallbackQuery):
         bot.delete_message(call.message.chat.id, call.message.message_id)
         bot.send_message(chat_id=call.message.chat.id, text="Отразить горизонтально или вертикально:",
                          reply_markup=get_mirror_keyboard())
-        global type_mirror
-        type_mirror = 1
-        mirror_and_send(call.message)
+        save_mirror_direction(call.message.chat.id, True)
+        mirror_and_send(call.message, key)
     elif call.data == "vertical":
         bot.answer_callback_query(call.id, "Выберите горизонтально или вертикально отзеркалить...")
         bot.delete_message(call.message.chat.id, call.message.message_id)
         bot.send_message(chat_id=call.message.chat.id, text="Отразить горизонтально или вертикально:",
                          reply_markup=get_mirror_keyboard())
-        type_mirror = 0
-        mirror_and_send(call.message)
-
-
-def pixelate_and_send(message):
+        save_mirror_direction(call.message.chat.id, False)
+        mirror_and_send(call.message, key)
+    elif call.data == "chain":
+        bot.answer_callback_query(call.id, "Соберите цепочку преобразований...")
+        bot.send_message(call.message.chat.id, pipeline_text(sessions.get(call.message.chat.id).pipeline),
+                         reply_markup=get_pipeline_keyboard())
+    elif call.data.startswith("chain:") or call.data == "chain_clear":
+        steps = update_pipeline(call.message.chat.id, call.data)
+        bot.answer_callback_query(call.id, f"Шагов в цепочке: {len(steps)}")
+        bot.edit_message_text(pipeline_text(steps), call.message.chat.id, call.message.message_id,
+                              reply_markup=get_pipeline_keyboard())
+    elif call.data == "chain_apply":
+        bot.answer_callback_query(call.id, "Applying the chain to your image...")
+        schedule_transform(call.message.chat.id, 'pipeline', key)
+
+
+def download_photo(sizes, operation, params):
+    """ Возвращает байты фотографии в варианте, достаточном для операции operation. Обращается к Telegram
+    (get_file и download_file) только если фотографии с таким file_unique_id еще нет в кэше."""
+    file_id, file_unique_id = photo_for_operation(sizes, operation, params)
+
+    def download():
+        with metrics.timed(operation, 'get_file'):
+            file_info = bot.get_file(file_id)
+        with metrics.timed(operation, 'download_file'):
+            return bot.download_file(file_info.file_path)
+
+    return download_cache.get_or_download(file_unique_id, download)
+
+
+def transform_photo(chat_id, operation, data, params):
+    """ Выполняет преобразование через transform_backend и возвращает результат. Если исполнитель перегружен,
+    не уложился во время или изображение слишком большое, сообщает об этом пользователю и возвращает None."""
+    try:
+        return transform_backend.run(operation, data, params)
+    except BackendBusy:
+        bot.send_message(chat_id, BUSY_TEXT)
+    except TransformTimeout:
+        bot.send_message(chat_id, TIMEOUT_TEXT)
+    except ImageTooLarge:
+        bot.send_message(chat_id, IMAGE_TOO_LARGE_TEXT)
+    return None
+
+
+def send_ascii(chat_id, art):
+    """ Отправляет ASCII-арт моноширинным блоком. """
+    bot.send_message(chat_id, f"```\n{art}\n```", parse_mode="MarkdownV2")
+
+
+def send_stored_result(chat_id, kind, value):
+    """ Отправляет результат из result_cache: фото и стикер - по file_id, ASCII-арт - текстом. """
+    if kind == 'photo':
+        bot.send_photo(chat_id, value)
+    elif kind == 'sticker':
+        bot.send_sticker(chat_id, value)
+    else:
+        send_ascii(chat_id, value)
+
+
+def send_new_result(chat_id, operation, key, result):
+    """ Отправляет только что полученный результат (ASCII-арт - текстом, результат resize - стикером, остальное -
+    фотографией) и запоминает в result_cache текст или file_id, который вернул Telegram."""
+    if operation == 'ascii':
+        send_ascii(chat_id, result)
+        result_cache.put(key, 'text', result)
+    elif is_sticker(operation):
+        sent = bot.send_sticker(chat_id, io.BytesIO(result))
+        result_cache.put(key, 'sticker', sent.sticker.file_id)
+    else:
+        sent = bot.send_photo(chat_id, io.BytesIO(result))
+        result_cache.put(key, 'photo', sent.photo[-1].file_id)
+
+
+def send_cached_result(chat_id, key):
+    """ Отправляет ранее полученный результат без обработки и загрузки: фото и стикер - по file_id, ASCII-арт -
+    текстом. Возвращает False, если результата нет в кэше или Telegram отверг сохраненный file_id."""
+    cached = result_cache.get(key)
+    if cached is None:
+        return False
+    try:
+        send_stored_result(chat_id, *cached)
+    except ApiTelegramException:
+        result_cache.discard(key)
+        return False
+    return True
+
+
+def schedule_transform(chat_id, operation, key=None):
+    """ Ставит send_transformed в очередь планировщика. Если задача начнется не сразу, сообщает пользователю
+    позицию в очереди, если очередь заполнена - просит подождать. key - ключ склейки нажатий (см. job_key),
+    он снимается после завершения задачи."""
+    def job():
+        try:
+            send_transformed(chat_id, operation)
+        finally:
+            if key is not None:
+                jobs.finish(key)
+
+    try:
+        position = job_scheduler.submit(chat_id, operation, job)
+    except QueueFull:
+        if key is not None:
+            jobs.finish(key)
+        bot.send_message(chat_id, QUEUE_FULL_TEXT)
+        return
+    if position:
+        bot.send_message(chat_id, QUEUED_TEXT.format(position))
+
+
+def send_transformed(chat_id, operation):
+    """ Скачивает фотографию пользователя, преобразует ее и отправляет результат: ASCII-арт - текстом,
+    стикер - стикером, остальное - фотографией. Повторные запросы той же операции над тем же фото отвечаются из result_cache.
+    Длительность каждой стадии записывается в metrics.STAGE_SECONDS."""
+    with metrics.IN_FLIGHT.track(operation), metrics.timed(operation, 'total'):
+        session = sessions.get(chat_id)
+        if not session.sizes:
+            bot.send_message(chat_id, NO_PHOTO_TEXT)
+            return
+        if operation == 'pipeline' and not session.pipeline:
+            bot.send_message(chat_id, EMPTY_PIPELINE_TEXT)
+            return
+        if session.album:
+            send_album(chat_id, session, operation)
+            return
+        params = operation_params(session, operation)
+        key = operation_result_key(session.sizes, operation, params)
+        with metrics.timed(operation, 'cache'):
+            if send_cached_result(chat_id, key):
+                return
+        downloaded_file = download_photo(session.sizes, operation, params)
+        result = transform_photo(chat_id, operation, downloaded_file, params)
+        if result is None:
+            return
+        with metrics.timed(operation, 'send'):
+            send_new_result(chat_id, operation, key, result)
+
+
+def album_photo_result(session, sizes, operation, use_cache):
+    """ Возвращает (ключ, вид, значение) результата для одного фото альбома: из result_cache ('photo' или 'sticker'
+    и file_id, 'text' и текст) либо после скачивания и преобразования ('new' и байты изображения или ASCII-арт)."""
+    params = operation_params(session, operation, sizes)
+    key = operation_result_key(sizes, operation, params)
+    cached = result_cache.get(key) if use_cache else None
+    if cached is not None:
+        return (key,) + cached
+    return key, 'new', transform_backend.run(operation, download_photo(sizes, operation, params), params)
+
+
+def send_album(chat_id, session, operation):
+    """ Применяет операцию ко всем фото альбома параллельно и отправляет результаты одним send_media_group
+    (ASCII-арты и стикеры, которые нельзя группировать, - отдельными сообщениями). Если Telegram отверг file_id
+    из кэша, фото обрабатываются заново."""
+    for use_cache in (True, False):
+        try:
+            results = list(album_threads.map(
+                lambda sizes: album_photo_result(session, sizes, operation, use_cache), session.album))
+        except BackendBusy:
+            bot.send_message(chat_id, BUSY_TEXT)
+            return
+        except TransformTimeout:
+            bot.send_message(chat_id, TIMEOUT_TEXT)
+            return
+
+        if operation == 'ascii' or is_sticker(operation):
+            for sizes, (key, kind, value) in zip(session.album, results):
+                if kind != 'new':
+                    try:
+                        send_stored_result(chat_id, kind, value)
+                        continue
+                    except ApiTelegramException:
+                        result_cache.discard(key)
+                        key, kind, value = album_photo_result(session, sizes, operation, False)
+                send_new_result(chat_id, operation, key, value)
+            return
+
+        media = [types.InputMediaPhoto(value if kind == 'photo' else io.BytesIO(value)) for _, kind, value in results]
+        try:
+            with metrics.timed(operation, 'send'):
+                sent = bot.send_media_group(chat_id, media)
+        except ApiTelegramException:
+            if not use_cache:
+                raise
+            for key, kind, _ in results:
+                if kind == 'photo':
+                    result_cache.discard(key)
+            continue
+        for (key, kind, _), message in zip(results, sent):
+            if kind == 'new':
+                result_cache.put(key, 'photo', message.photo[-1].file_id)
+        return
+
+
+def pixelate_and_send(message, key=None):
     """ Пикселизирует изображение и отправляет его обратно пользователю."""
-    photo_id = user_states[message.chat.id]['photo']
-    file_info = bot.get_file(photo_id)
-    downloaded_file = bot.download_file(file_info.file_path)
+    schedule_transform(message.chat.id, 'pixelate', key)
 
-    image_stream = io.BytesIO(downloaded_file)
-    image = Image.open(image_stream)
-    pixelated = pixelate_image(image, 20)
 
-    output_stream = io.BytesIO()
-    pixelated.save(output_stream, format="JPEG")
-    output_stream.seek(0)
-    bot.send_photo(message.chat.id, output_stream)
-
-
-def ascii_and_send(message):
+def ascii_and_send(message, key=None):
     """ Преобразует изображение в ASCII-арт и отправляет результат в виде текстового сообщения."""
-    photo_id = user_states[message.chat.id]['photo']
-    file_info = bot.get_file(photo_id)
-    downloaded_file = bot.download_file(file_info.file_path)
+    schedule_transform(message.chat.id, 'ascii', key)
 
-    image_stream = io.BytesIO(downloaded_file)
-    ascii_art = image_to_ascii(image_stream)
-    bot.send_message(message.chat.id, f"```\n{ascii_art}\n```", parse_mode="MarkdownV2")
 
+def ascii_image_and_send(message, color=False, key=None):
+    """ Рисует ASCII-арт картинкой (при color=True - цветами исходника) и отправляет ее фотографией. """
+    schedule_transform(message.chat.id, 'ascii_color' if color else 'ascii_image', key)
 
-def invert_and_send(message):
-    """ Преобразует изображение в 'негатив' и  отправляет его обратно пользователю. """
-    photo_id = user_states[message.chat.id]['photo']
-    file_info = bot.get_file(photo_id)
-    downloaded_file = bot.download_file(file_info.file_path)
-
-    image_stream = io.BytesIO(downloaded_file)
-    image = Image.open(image_stream)
-    inverted = invert_colors(image)
 
-    output_stream = io.BytesIO()
-    inverted.save(output_stream, format="JPEG")
-    output_stream.seek(0)
-    bot.send_photo(message.chat.id, output_stream)
+def invert_and_send(message, key=None):
+    """ Преобразует изображение в 'негатив' и  отправляет его обратно пользователю. """
+    schedule_transform(message.chat.id, 'negative', key)
 
 
-def mirror_and_send(message):
+def mirror_and_send(message, key=None):
     """ Преобразует изображение в зеркальное и отправляет его обратно пользователю. """
-    photo_id = user_states[message.chat.id]['photo']
-    file_info = bot.get_file(photo_id)
-    downloaded_file = bot.download_file(file_info.file_path)
-
-    image_stream = io.BytesIO(downloaded_file)
-    image = Image.open(image_stream)
-    reflected_mirror = mirror_image(image)
-
-    output_stream = io.BytesIO()
-    reflected_mirror.save(output_stream, format="JPEG")
-    output_stream.seek(0)
-    bot.send_photo(message.chat.id, output_stream)
-
-    global type_mirror
-    type_mirror = 1
+    schedule_transform(message.chat.id, 'mirror', key)
 
 
-def heatmap_and_send(message):
+def heatmap_and_send(message, key=None):
     """ Преобразует изображение в тепловую карту. """
-    photo_id = user_states[message.chat.id]['photo']
-    file_info = bot.get_file(photo_id)
-    downloaded_file = bot.download_file(file_info.file_path)
+    schedule_transform(message.chat.id, 'heatmap', key)
 
-    image_stream = io.BytesIO(downloaded_file)
-    image = Image.open(image_stream)
-    created_heatmap = convert_to_heatmap(image)
-
-    output_stream = io.BytesIO()
-    created_heatmap.save(output_stream, format="JPEG")
-    output_stream.seek(0)
-    bot.send_photo(message.chat.id, output_stream)
-
-def resize_for_sticker_and_send(message):
+def resize_for_sticker_and_send(message, key=None):
     """ Преобразует изображение для стикера. """
-    photo_id = user_states[message.chat.id]['photo']
-    file_info = bot.get_file(photo_id)
-    downloaded_file = bot.download_file(file_info.file_path)
-
-    image_stream = io.BytesIO(downloaded_file)
-    image = Image.open(image_stream)
-    created_sticker = resize_for_sticker(image)
-
-    output_stream = io.BytesIO()
-    created_sticker.save(output_stream, format="JPEG")
-    output_stream.seek(0)
-    bot.send_photo(message.chat.id, output_stream)
+    schedule_transform(message.chat.id, 'resize', key)
 
 
-bot.polling(none_stop=True)
+if __name__ == '__main__':
+    metrics.start_server_from_env()
+    bot.polling(none_stop=True)
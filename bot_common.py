@@ -0,0 +1,299 @@
+""" Общие для bot.py и async_bot.py настройки, тексты ответов, общее состояние (сессии, кэши, исполнитель
+преобразований, очередь отправок) и функции, не зависящие от того, синхронный бот или асинхронный.
+
+Импорт модуля не читает TOKEN, не создает бота и не меняет настройки telebot, а объекты состояния создаются
+при первом обращении к ним (см. Lazy): их можно импортировать в инструментах и тестах, и async_bot.py больше
+не выполняет при импорте код синхронного бота.
+"""
+import os
+import threading
+
+from telebot import types
+
+import metrics
+from corpus import deal, open_corpus
+from download_cache import DownloadCache
+from media_assets import open_media_assets
+from pipeline import MAX_STEPS, STEPS
+from point_ops import COLORMAPS
+from photo_sizes import ASCII_IMAGE_WIDTH, ASCII_WIDTH, PIXEL_SIZE, pick_photo_size, size_params
+from result_cache import ResultCache, result_key
+from send_queue import SendQueue
+from sessions import open_session_store
+from single_flight import SingleFlight
+from transform_backend import TransformBackend
+
+
+# адрес Bot API, если это не api.telegram.org: свой сервер Bot API или тестовый (см. benchmarks/fake_telegram.py)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '').rstrip('/')
+
+MIN_ASCII_WIDTH = 10
+MAX_ASCII_WIDTH = 300  # шире ASCII-арт картинкой не помещается в 2560 пикселей фото Telegram
+
+BUSY_TEXT = "Бот сейчас занят другими изображениями, попробуйте чуть позже."
+TIMEOUT_TEXT = "Обработка изображения заняла слишком много времени, попробуйте еще раз."
+NO_PHOTO_TEXT = "Не нашел вашего фото, пришлите его еще раз."
+VIDEO_UNAVAILABLE_TEXT = "Видео сейчас недоступно, попробуйте позже."
+EMPTY_PIPELINE_TEXT = "Цепочка пуста: добавьте хотя бы один шаг."
+EMPTY_CORPUS_TEXT = "Пока рассказать нечего, загляните позже."
+DUPLICATE_TEXT = "Уже обрабатываю, результат скоро придет."
+QUEUED_TEXT = "Задача в очереди, позиция {}."
+QUEUE_FULL_TEXT = "Слишком много задач в очереди: дождитесь результатов и попробуйте снова."
+NOT_IMAGE_TEXT = "Этот файл не похож на изображение: пришлите JPEG, PNG, WebP, BMP, GIF или TIFF."
+DOCUMENT_TOO_BIG_TEXT = "Файл слишком большой: бот может скачать не больше {} МБ."
+IMAGE_TOO_LARGE_TEXT = "В изображении слишком много пикселей, уменьшите его и пришлите еще раз."
+
+# изображения, присланные документом (без сжатия): Bot API отдает через getFile файлы не больше 20 МБ
+DOCUMENT_MAX_BYTES = int(os.environ.get('DOCUMENT_MAX_BYTES', 20 * 1024 * 1024))
+DOCUMENT_MIME_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/bmp', 'image/gif', 'image/tiff')
+
+# подписи шагов цепочки преобразований (см. pipeline.py)
+STEP_TITLES = {'resize': 'Resize', 'pixelate': 'Pixelate', 'mirror_h': 'Mirror ↔', 'mirror_v': 'Mirror ↕',
+               'negative': 'Negative', 'heatmap': 'Heatmap', 'grayscale': 'Grayscale', 'posterize': 'Posterize'}
+
+# сколько секунд ждать остальные фото альбома (они приходят отдельными сообщениями) перед показом клавиатуры
+ALBUM_WAIT = float(os.environ.get('ALBUM_WAIT', 1.0))
+# нажатия, которые запускают обработку фото, и их операции
+JOB_CALLBACKS = {'pixelate': 'pixelate', 'ascii': 'ascii', 'ascii_image': 'ascii_image', 'ascii_color': 'ascii_color',
+                 'negative': 'negative', 'heatmap': 'heatmap', 'resize': 'resize', 'horizontal': 'mirror',
+                 'vertical': 'mirror', 'chain_apply': 'pipeline'}
+
+
+class Lazy:
+    """ Общий объект, который создается вызовом factory при первом обращении к любому его атрибуту. """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return getattr(self._object, name)
+
+
+def create_transform_backend():
+    """ Создает исполнитель преобразований по переменным окружения и публикует глубину его очереди в metrics. """
+
+    backend = TransformBackend(mode=os.environ.get('TRANSFORM_BACKEND', 'inline'),
+                               workers=int(os.environ.get('TRANSFORM_WORKERS', 0)) or None,
+                               max_queue=int(os.environ.get('TRANSFORM_QUEUE', 0)) or None,
+                               timeout=float(os.environ.get('TRANSFORM_TIMEOUT', 30)))
+    metrics.QUEUE_DEPTH.set_function(backend.queue_depth, 'transform')
+    return backend
+
+
+# все отправки идут через очередь с лимитами Telegram (см. send_queue.py): общий лимит, лимит на чат и повтор
+# после ответа 429
+send_queue = Lazy(lambda: SendQueue(global_rate=float(os.environ.get('SEND_GLOBAL_RATE', 30)),
+                                    chat_rate=float(os.environ.get('SEND_CHAT_RATE', 1)),
+                                    chat_burst=int(os.environ.get('SEND_CHAT_BURST', 3)),
+                                    max_retries=int(os.environ.get('SEND_MAX_RETRIES', 5))))
+
+# шутки и комплименты читаются из файлов (см. corpus.py), каждый чат получает их по своей колоде без повторов
+jokes = Lazy(lambda: open_corpus('JOKES_FILE', 'jokes.txt'))
+compliments = Lazy(lambda: open_corpus('COMPLIMENTS_FILE', 'compliments.txt'))
+
+# видео для /rnd: загружаются в Telegram один раз, дальше отправляются по file_id
+media_assets = Lazy(open_media_assets)
+
+# тут будем хранить информацию о действиях пользователя: фото, набор символов, направление отражения
+sessions = Lazy(open_session_store)
+
+# общий для всех обработчиков кэш скачанных фотографий: несколько кнопок под одним фото - одно скачивание
+download_cache = Lazy(lambda: DownloadCache(max_bytes=int(os.environ.get('DOWNLOAD_CACHE_BYTES', 64 * 1024 * 1024)),
+                                            ttl=int(os.environ.get('DOWNLOAD_CACHE_TTL', 3600)),
+                                            disk_dir=os.environ.get('DOWNLOAD_CACHE_DIR')))
+
+# готовые результаты: file_id отправленных фото и тексты ASCII-артов, чтобы не обрабатывать одно и то же дважды
+result_cache = Lazy(lambda: ResultCache(path=os.environ.get('RESULT_CACHE_DB'),
+                                        max_bytes=int(os.environ.get('RESULT_CACHE_BYTES', 8 * 1024 * 1024))))
+
+# где выполняются преобразования изображений: inline, thread или process (см. transform_backend.py)
+transform_backend = Lazy(create_transform_backend)
+
+# повторные нажатия той же кнопки под тем же фото не запускают вторую обработку, пока идет первая
+# и еще COALESCE_DEBOUNCE секунд после нее (см. single_flight.py)
+jobs = Lazy(lambda: SingleFlight(debounce=float(os.environ.get('COALESCE_DEBOUNCE', 2.0))))
+
+
+def update_session(chat_id, **fields):
+    """ Записывает в сессию чата значения полей fields и сохраняет ее (одним вызовом, чтобы async_bot.py мог
+    выполнить чтение и запись сессии вне цикла событий). """
+
+    session = sessions.get(chat_id)
+    for name, value in fields.items():
+        setattr(session, name, value)
+    sessions.save(session)
+
+
+def deal_entry(chat_id, name, corpus):
+    """ Возвращает следующую запись корпуса corpus по колоде чата с именем name (состояние колоды хранится
+    в сессии, см. corpus.deal)."""
+    view = corpus.view()
+    if not len(view):
+        return EMPTY_CORPUS_TEXT
+    session = sessions.get(chat_id)
+    index, session.decks[name] = deal(session.decks.get(name), len(view))
+    sessions.save(session)
+    return view[index]
+
+
+def store_album(chat_id, photos):
+    """ Сохраняет в сессии фото альбома в порядке их сообщений; последним фото сессии считается первое. """
+
+    session = sessions.get(chat_id)
+    session.album = tuple(sizes for _, sizes in sorted(photos))
+    session.sizes = session.album[0]
+    sessions.save(session)
+
+
+def album_text(count):
+    """ Текст ответа на полученный альбом. """
+
+    return f"I got your album of {count} photos! Please choose what you'd like to do with them."
+
+
+def colormap_reply(chat_id, text):
+    """ Сохраняет в сессии цветовую карту из текста команды /colormap и возвращает текст ответа. """
+    argument = text.split(maxsplit=1)[1:]
+    if not argument or argument[0] not in COLORMAPS:
+        return f"Укажите цветовую карту: {', '.join(COLORMAPS)}, например: /colormap viridis"
+    session = sessions.get(chat_id)
+    session.colormap = argument[0]
+    sessions.save(session)
+    return f'Цветовая карта тепловой карты: {argument[0]}.'
+
+
+def get_options_keyboard():
+    """ Создает клавиатуру с кнопками для выбора пользователем, как обработать изображение: через пикселизацию или
+    преобразование в ASCII-арт, сделать негативное изображение или зеркальное отображение """
+    keyboard = types.InlineKeyboardMarkup()
+    pixelate_btn = types.InlineKeyboardButton("Pixelate", callback_data="pixelate")
+    ascii_btn = types.InlineKeyboardButton("ASCII Art", callback_data="ascii")
+    ascii_image_btn = types.InlineKeyboardButton("ASCII Image", callback_data="ascii_image")
+    ascii_color_btn = types.InlineKeyboardButton("ASCII Color", callback_data="ascii_color")
+    negative_btn = types.InlineKeyboardButton("Negative", callback_data="negative")
+    mirror_btn = types.InlineKeyboardButton("Mirror", callback_data="mirror")
+    heatmap_btn = types.InlineKeyboardButton("Heatmap", callback_data="heatmap")
+    resize_btn = types.InlineKeyboardButton("Resize", callback_data="resize")
+    chain_btn = types.InlineKeyboardButton("Chain", callback_data="chain")
+    keyboard.add(pixelate_btn, ascii_btn, ascii_image_btn, ascii_color_btn, negative_btn, mirror_btn, heatmap_btn,
+                 resize_btn, chain_btn)
+    return keyboard
+
+
+def get_pipeline_keyboard():
+    """ Создает клавиатуру для сборки цепочки преобразований: кнопка каждого шага добавляет его в конец цепочки,
+    Apply применяет всю цепочку за один проход, Clear очищает ее."""
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(*[types.InlineKeyboardButton(f"+ {STEP_TITLES[step]}", callback_data=f"chain:{step}")
+                   for step in STEPS])
+    keyboard.add(types.InlineKeyboardButton("Apply", callback_data="chain_apply"),
+                 types.InlineKeyboardButton("Clear", callback_data="chain_clear"))
+    return keyboard
+
+
+def pipeline_text(steps):
+    """ Текст сообщения с текущей цепочкой преобразований. """
+    chain = ' → '.join(STEP_TITLES[step] for step in steps) if steps else 'пусто'
+    return f"Соберите цепочку преобразований и нажмите Apply.\nЦепочка: {chain}"
+
+
+def get_mirror_keyboard():
+    """ Создает клавиатуру с кнопками для выбора горизонтально или вертикально отзеркалить"""
+    keyboard = types.InlineKeyboardMarkup()
+    horyzont_btn = types.InlineKeyboardButton("Горизонтально", callback_data="horizontal")
+    vert_btn = types.InlineKeyboardButton("Вертикально", callback_data="vertical")
+    keyboard.add(horyzont_btn, vert_btn)
+    return keyboard
+
+
+def job_key(chat_id, data):
+    """ Ключ задачи для склейки повторных нажатий: чат и ключи результатов (фото, операция, параметры) всех фото,
+    которые обработает нажатие data. None - нажатие не запускает обработку или фото еще нет."""
+    operation = JOB_CALLBACKS.get(data)
+    if operation is None:
+        return None
+    session = sessions.get(chat_id)
+    if not session.sizes:
+        return None
+    keys = []
+    for sizes in session.album or (session.sizes,):
+        params = operation_params(session, operation, sizes)
+        if operation == 'mirror':
+            # направление выбирает само нажатие, в сессию оно попадет уже после проверки
+            params = {'horizontal': data == 'horizontal'}
+        keys.append(operation_result_key(sizes, operation, params))
+    return (chat_id,) + tuple(keys)
+
+
+def update_pipeline(chat_id, data):
+    """ Добавляет в цепочку шаг из callback_data вида 'chain:<шаг>' (не больше MAX_STEPS шагов) или очищает
+    ее по 'chain_clear'. Возвращает получившуюся цепочку."""
+    session = sessions.get(chat_id)
+    if data == "chain_clear":
+        session.pipeline = ()
+    else:
+        step = data.split(':', 1)[1]
+        if step in STEPS and len(session.pipeline) < MAX_STEPS:
+            session.pipeline = session.pipeline + (step,)
+    sessions.save(session)
+    return session.pipeline
+
+
+def save_mirror_direction(chat_id, horizontal):
+    """ Запоминает, как отражать фото пользователя: горизонтально (horizontal=True) или вертикально. """
+    session = sessions.get(chat_id)
+    session.mirror_horizontal = horizontal
+    sessions.save(session)
+
+
+def operation_params(session, operation, sizes=None):
+    """ Возвращает параметры преобразования operation для сессии пользователя (см. transforms.run_transform).
+    sizes - варианты обрабатываемого фото, если это не последнее фото сессии (например, фото из альбома)."""
+    sizes = sizes or session.sizes
+    _, _, width, height = sizes[-1]
+    # у документа размер неизвестен до скачивания (0), тогда run_transform берет его из файла
+    output_size = (width, height) if width else None
+    if operation == 'pixelate':
+        return {'pixel_size': PIXEL_SIZE, 'output_size': output_size}
+    if operation == 'ascii':
+        return {'charset': session.charset, 'new_width': session.ascii_width or ASCII_WIDTH}
+    if operation in ('ascii_image', 'ascii_color'):
+        return {'charset': session.charset, 'new_width': session.ascii_width or ASCII_IMAGE_WIDTH}
+    if operation == 'mirror':
+        return {'horizontal': session.mirror_horizontal}
+    # цветовая карта попадает в параметры (и ключ кэша результатов), только если выбрана не по умолчанию
+    colormap = {'colormap': session.colormap} if session.colormap else {}
+    if operation == 'heatmap':
+        return colormap
+    if operation == 'pipeline':
+        return {'steps': list(session.pipeline), 'pixel_size': PIXEL_SIZE, 'output_size': output_size, **colormap}
+    return {}
+
+
+def photo_for_operation(sizes, operation, params):
+    """ Возвращает (file_id, file_unique_id) наименьшего из вариантов фотографии sizes, достаточного для
+    операции operation с параметрами params."""
+    file_id, file_unique_id, _, _ = pick_photo_size(sizes, operation, **size_params(operation, params))
+    return file_id, file_unique_id
+
+
+def stats_text():
+    """ Текст ответа на /stats: доли попаданий в кэш скачиваний и в кэш результатов. """
+    downloads = download_cache.stats()
+    results = result_cache.stats()
+    download_hits = downloads['hits'] + downloads['disk_hits']
+    return (f"Кэш скачиваний: {downloads['hit_ratio']:.0%} попаданий "
+            f"({download_hits} из {download_hits + downloads['misses']})\n"
+            f"Кэш результатов: {results['hit_ratio']:.0%} попаданий "
+            f"({results['hits']} из {results['hits'] + results['misses']})")
+
+
+def operation_result_key(sizes, operation, params):
+    """ Ключ кэша результатов: самый большой вариант фото определяет саму фотографию. """
+    return result_key(sizes[-1][1], operation, params)
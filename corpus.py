@@ -0,0 +1,153 @@
+""" Корпусы текстов (шутки, комплименты) в файлах и колоды без повторов для каждого чата.
+
+Файл корпуса - UTF-8, записи разделены строкой из одного символа '%' (формат fortune). Файл отображается
+в память (mmap), поэтому все процессы бота делят одни и те же страницы кэша ОС, а в куче каждого процесса
+остается только индекс - массив array смещений начала и конца записей (по 4 байта, если файл меньше 4 ГБ).
+Доступ к записи по номеру - O(1). Если файл изменился (размер или время изменения), он перечитывается при
+следующем обращении, но не чаще раза в check_interval секунд.
+
+Обновлять файл нужно атомарной заменой: записать новую версию во временный файл рядом и переименовать его
+(os.replace, mv). Старое отображение тогда остается целым, пока его читают снимки. Если же файл переписан
+на месте (тот же inode), чтение обрезанного отображения завершило бы процесс сигналом SIGBUS, поэтому такой
+файл больше не отображается: новая версия читается в память целиком (до следующей атомарной замены).
+
+Колода чата - это не перемешанный список номеров, а три числа [seed, позиция, размер корпуса]: seed задает
+псевдослучайную перестановку номеров (сеть Фейстеля, см. permute), позиция - сколько записей уже выдано.
+Пока колода не пройдена целиком, записи не повторяются; затем (или если размер корпуса изменился) она
+тасуется заново.
+"""
+import mmap
+import os
+import random
+import re
+import threading
+import time
+from array import array
+
+
+SEPARATOR = re.compile(rb'\n%[ \t]*\r?(?=\n|\Z)')
+LEADING_SEPARATOR = re.compile(rb'%[ \t]*\r?(?=\n|\Z)')
+MASK64 = (1 << 64) - 1
+FEISTEL_ROUNDS = 4
+
+
+def build_index(data):
+    """ Индекс записей: array с парами (начало, конец) в байтах для каждой непустой записи. """
+
+    offsets = array('I' if len(data) < 2 ** 32 else 'Q')
+    leading = LEADING_SEPARATOR.match(data)
+    start = leading.end() if leading else 0
+    for separator in SEPARATOR.finditer(data):
+        if data[start:separator.start()].strip():
+            offsets.extend((start, separator.start()))
+        start = separator.end()
+    if data[start:].strip():
+        offsets.extend((start, len(data)))
+    return offsets
+
+
+class CorpusView:
+    """ Согласованный снимок корпуса: записи одной версии файла (len и индексация). """
+
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) // 2
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index * 2], self.offsets[index * 2 + 1]
+        return self.data[start:end].decode('utf-8', errors='replace').strip()
+
+
+class Corpus:
+    """ Корпус из файла path. Если файла нет, корпус пуст (и появится, когда файл будет создан). """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._view = CorpusView(b'', array('I'))
+        self._fingerprint = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._reload()
+
+    def view(self):
+        """ Текущая версия корпуса; перед этим проверяет, не изменился ли файл. """
+
+        if time.monotonic() - self._checked >= self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked >= self.check_interval:
+                    self._reload()
+        return self._view
+
+    def __len__(self):
+        return len(self.view())
+
+    def _reload(self):
+        self._checked = time.monotonic()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            fingerprint = None
+        else:
+            fingerprint = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if fingerprint == self._fingerprint:
+            return
+        data = b''
+        if fingerprint is not None and fingerprint[0] > 0:
+            with open(self.path, 'rb') as file:
+                if self._fingerprint is not None and self._fingerprint[2] == fingerprint[2]:
+                    # тот же inode - файл переписан на месте и может быть обрезан снова, отображать его нельзя
+                    data = file.read()
+                else:
+                    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        # старое отображение закроется само, когда его перестанут использовать снимки в других потоках
+        self._view = CorpusView(data, build_index(data))
+        self._fingerprint = fingerprint
+
+
+def open_corpus(variable, filename):
+    """ Корпус из файла, заданного переменной окружения variable (по умолчанию filename рядом с ботом). """
+
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    return Corpus(os.environ.get(variable, default))
+
+
+def mix(seed, value):
+    """ Перемешивающая функция splitmix64: 64-битное псевдослучайное число из seed и value. """
+
+    value = (seed * 0x9E3779B97F4A7C15 + value) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def permute(index, size, seed):
+    """ Элемент номер index псевдослучайной перестановки чисел 0..size-1, заданной seed. Сеть Фейстеля
+    переставляет числа из диапазона 4**half_bits (не больше 4 * size); результат вне 0..size-1 переставляется
+    еще раз, пока не попадет в него (cycle walking), - так получается перестановка именно size чисел."""
+
+    half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    value = index
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ (mix(seed + round_number, right) & mask)
+        value = (left << half_bits) | right
+        if value < size:
+            return value
+
+
+def deal(deck, size):
+    """ Выдает следующую запись колоды deck ([seed, позиция, размер] или None для новой) из корпуса
+    в size записей. Возвращает (номер записи, новое состояние колоды)."""
+
+    if not deck or deck[1] >= deck[2] or deck[2] != size:
+        deck = [random.getrandbits(62), 0, size]
+    seed, position, _ = deck
+    return permute(position, size, seed), [seed, position + 1, size]
@@ -0,0 +1,70 @@
+import io
+import os
+import warnings
+
+from PIL import Image
+
+
+# сколько пикселей может быть в изображении: больше - отказ еще до декодирования (защита от "бомб", когда
+# файл в несколько мегабайт разворачивается в гигабайты растра)
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 80_000_000))
+# наибольшая сторона результата: документы крупнее обрабатываются как уменьшенная копия такого размера
+# (Telegram все равно уменьшает фото до 2560 пикселей); 0 - без ограничения
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', 2560))
+
+
+class ImageTooLarge(Exception):
+    """ Изображение больше IMAGE_MAX_PIXELS пикселей. """
+
+
+def open_image(data, max_pixels=IMAGE_MAX_PIXELS):
+    """ Открывает изображение из байтов, не декодируя его, и проверяет размер по заголовку. Бросает ImageTooLarge,
+    если пикселей больше max_pixels (в том числе если Pillow сам распознал "бомбу")."""
+
+    try:
+        with warnings.catch_warnings():
+            # предупреждение Pillow о больших изображениях заменяет проверка ниже
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as error:
+        raise ImageTooLarge(str(error)) from None
+    if image.width * image.height > max_pixels:
+        raise ImageTooLarge(f'{image.width}x{image.height}')
+    return image
+
+
+def fit_size(size, max_side=IMAGE_MAX_SIDE):
+    """ Уменьшает размер (ширина, высота) с сохранением пропорций так, чтобы большая сторона была не больше
+    max_side. """
+
+    width, height = size
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def decode_reduced(image, min_size, mode=None):
+    """ Готовит открытое, но еще не декодированное изображение к декодированию не крупнее, чем нужно операции.
+    min_size - минимальные (ширина, высота), которые должны остаться после уменьшения (см. photo_sizes.required_size).
+
+    JPEG декодируется сразу в уменьшенном масштабе (draft mode: DCT-масштабирование в 1/2, 1/4 или 1/8), так что
+    полноразмерный растр вообще не создается; mode='L' дополнительно пропускает декодирование цветности.
+    Остальные форматы (PNG, WebP, BMP, GIF, TIFF) Pillow умеет декодировать только целиком, поэтому для них
+    полноразмерный растр (не больше IMAGE_MAX_PIXELS) на время создается, а затем уменьшается целочисленным
+    Image.reduce: экономится время следующих шагов, но не пиковая память. Если операции нужно полное разрешение,
+    изображение не меняется."""
+
+    min_width, min_height = max(1, min_size[0]), max(1, min_size[1])
+    if image.format == 'JPEG':
+        image.draft(mode or image.mode, (min_width, min_height))
+        return image.convert(mode) if mode and image.mode != mode else image
+
+    factor = min(image.width // min_width, image.height // min_height)
+    if factor >= 2:
+        if image.mode in ('P', '1'):
+            # Image.reduce не работает с палитрой и однобитными изображениями
+            image = image.convert('RGB')
+        image = image.reduce(factor)
+    return image.convert(mode) if mode and image.mode != mode else image
+
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class DownloadCache:
+    """ Кэш скачанных из Telegram фотографий, адресуемый по file_unique_id. Хранит байты в памяти с вытеснением
+    давно не используемых записей (LRU) при превышении бюджета в байтах и по истечении времени жизни (TTL).
+    Если задан каталог disk_dir, каждая запись дублируется на диск, так что после перезапуска процесса
+    «прогретые» фотографии не скачиваются заново. На диске время изменения файла обновляется при каждом попадании,
+    поэтому при превышении disk_max_bytes удаляются давно не использованные файлы, а TTL отсчитывается от
+    последнего использования. Объем дискового уровня отслеживается счетчиком, и каталог просматривается целиком
+    только при его переполнении."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # file_unique_id -> (байты, время записи)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_size = 0  # оценка объема дискового уровня (точная после каждого _trim_disk)
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._trim_disk()
+
+    def get(self, key):
+        """ Возвращает байты фотографии или None, если её нет ни в памяти, ни на диске. """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                data, stored_at = entry
+                if time.time() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                self._remove(key)
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, data)
+        return data
+
+    def put(self, key, data):
+        """ Сохраняет байты фотографии в памяти и, если включен, в дисковом уровне кэша. """
+
+        with self._lock:
+            self._store(key, data)
+        self._write_disk(key, data)
+
+    def get_or_download(self, key, download):
+        """ Возвращает фотографию из кэша, а при промахе вызывает download() и запоминает результат. """
+
+        data = self.get(key)
+        if data is None:
+            data = download()
+            self.put(key, data)
+        return data
+
+    def stats(self):
+        """ Возвращает счетчики попаданий и промахов и текущий объем кэша в памяти. """
+
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+    def _store(self, key, data):
+        if key in self._entries:
+            self._remove(key)
+        if len(data) > self.max_bytes:
+            return
+        self._entries[key] = (data, time.time())
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key):
+        data, _ = self._entries.pop(key)
+        self._size -= len(data)
+
+    def _disk_path(self, key):
+        # file_unique_id состоит из символов base64url, но на всякий случай отбрасываем все остальные
+        safe_key = ''.join(ch for ch in key if ch.isalnum() or ch in '-_')
+        return os.path.join(self.disk_dir, safe_key + '.bin')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as file:
+                data = file.read()
+            # отмечаем использование: по времени изменения _trim_disk выбирает, что удалять
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._disk_lock:
+            # перезапись существующего файла счетчик завышает - это лишь приближает следующий пересчет
+            self._disk_size += len(data)
+            if self._disk_size <= self.disk_max_bytes:
+                return
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """ Удаляет с диска просроченные записи, а затем давно не использованные, пока объем не опустится до 90%
+        disk_max_bytes (запас, чтобы не просматривать каталог при каждой следующей записи), и пересчитывает
+        _disk_size. """
+
+        files = []
+        now = time.time()
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.bin'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._unlink(path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes * 0.9:
+                break
+            self._unlink(path)
+            total -= size
+        self._disk_size = total
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
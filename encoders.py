@@ -0,0 +1,119 @@
+""" Выбор формата и настроек кодирования результата для каждой операции.
+
+- pixelate: PNG с палитрой. Крупные одноцветные блоки сжимаются без потерь в несколько раз лучше, чем JPEG,
+  и без артефактов на границах блоков. Палитра строится по сетке блоков еще до увеличения (см. pixelate_image).
+- ascii_image, ascii_color: PNG с палитрой - символы на однотонном фоне сжимаются без потерь. Картинки большие
+  (сотни тысяч ячеек), поэтому цветная квантуется быстрым октодеревом, а zlib работает без optimize: кодирование
+  в несколько раз быстрее, а файл не больше.
+- resize: WebP, у которого большая сторона ровно STICKER_SIZE пикселей, - готовый стикер для send_sticker.
+- остальные фото: JPEG с optimize и progressive. Если результат больше JPEG_MAX_BYTES, качество подбирается
+  двоичным поиском так, чтобы уложиться в этот объем.
+"""
+import io
+import os
+
+from PIL import Image
+
+from photo_sizes import STICKER_SIZE
+
+
+# сколько байт может занимать фото-результат в JPEG, прежде чем качество начнет снижаться
+JPEG_MAX_BYTES = int(os.environ.get('JPEG_MAX_BYTES', 1024 * 1024))
+
+# качество 75, как у Pillow по умолчанию: с optimize и progressive файл на ~10% меньше, чем без них, а 85 дает
+# на ~20% больше (фото из photos/ после негатива: 2.44 МБ при прежних настройках, 2.22 МБ при 75, 2.92 МБ при 85)
+JPEG_POLICY = {'format': 'JPEG', 'quality': 75, 'min_quality': 40, 'max_bytes': JPEG_MAX_BYTES}
+ENCODER_POLICY = {
+    'pixelate': {'format': 'PNG', 'colors': 256},
+    'ascii_image': {'format': 'PNG', 'colors': 256, 'optimize': False},
+    'ascii_color': {'format': 'PNG', 'colors': 256, 'optimize': False},
+    'resize': {'format': 'WEBP', 'quality': 90, 'sticker': True},
+}
+
+
+def encoder_policy(operation):
+    """ Настройки кодирования результата операции operation. """
+
+    return ENCODER_POLICY.get(operation, JPEG_POLICY)
+
+
+def is_sticker(operation):
+    """ Отправляется ли результат операции стикером (send_sticker), а не фотографией. """
+
+    return encoder_policy(operation).get('sticker', False)
+
+
+def fit_sticker(image, size=STICKER_SIZE):
+    """ Масштабирует изображение так, чтобы большая сторона была ровно size пикселей, как требует Telegram
+    для стикеров (resize_for_sticker только уменьшает, поэтому маленькие фото здесь увеличиваются). """
+
+    if max(image.size) == size:
+        return image
+    scale = size / max(image.size)
+    return image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+
+
+def save(image, image_format, **options):
+    """ Кодирует изображение в формат image_format с параметрами Pillow options и возвращает байты. """
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def encode_jpeg(image, quality=75, max_bytes=None, min_quality=40):
+    """ Кодирует изображение в прогрессивный JPEG. Если задан max_bytes и результат больше, ищет двоичным поиском
+    наибольшее качество не ниже min_quality, при котором результат укладывается в max_bytes (если не укладывается
+    и при min_quality, возвращает результат с min_quality). Изображения с прозрачностью или палитрой
+    (например, из PNG) предварительно переводятся в RGB, так как JPEG их не поддерживает."""
+
+    if image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    data = save(image, 'JPEG', quality=quality, optimize=True, progressive=True)
+    if max_bytes is None or len(data) <= max_bytes:
+        return data
+
+    low, high = min_quality, quality - 1
+    best = None
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = save(image, 'JPEG', quality=middle, optimize=True, progressive=True)
+        if len(candidate) <= max_bytes:
+            best, low = candidate, middle + 1
+        else:
+            high = middle - 1
+    return best or save(image, 'JPEG', quality=min_quality, optimize=True, progressive=True)
+
+
+def encode_png(image, colors=256, optimize=True):
+    """ Кодирует изображение в PNG с палитрой. Изображение, еще не переведенное в палитру, квантуется здесь
+    (это дороже, чем квантовать сетку блоков до увеличения) методом FASTOCTREE: на больших картинках он
+    в несколько раз быстрее медианного сечения при ошибке около одного уровня яркости. optimize=False заменяет
+    перебор настроек zlib (optimize) обычным сжатием уровня 6. """
+
+    if image.mode not in ('P', 'L', '1'):
+        image = image.convert('RGB').quantize(colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    if optimize:
+        return save(image, 'PNG', optimize=True)
+    return save(image, 'PNG', compress_level=6)
+
+
+def encode_webp(image, quality=90, sticker=False):
+    """ Кодирует изображение в WebP; для стикера сначала приводит большую сторону к STICKER_SIZE. """
+
+    if sticker:
+        image = fit_sticker(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    return save(image, 'WEBP', quality=quality, method=4)
+
+
+def encode_result(image, operation):
+    """ Кодирует результат операции operation по ее настройкам из ENCODER_POLICY и возвращает байты. """
+
+    policy = encoder_policy(operation)
+    if policy['format'] == 'PNG':
+        return encode_png(image, policy.get('colors', 256), policy.get('optimize', True))
+    if policy['format'] == 'WEBP':
+        return encode_webp(image, policy.get('quality', 90), policy.get('sticker', False))
+    return encode_jpeg(image, policy.get('quality', 75), policy.get('max_bytes'), policy.get('min_quality', 40))
@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+import threading
+
+
+class MediaAssets:
+    """ Реестр медиафайлов, которые бот отправляет многим пользователям (например, видео для /rnd). Каждый файл
+    загружается в Telegram один раз, дальше отправляется по file_id из ответа Telegram - это несколько сотен байт
+    вместо всего видео. file_id сохраняются в JSON-файле store_path и переживают перезапуск; если файл на диске
+    изменился (другой размер или время изменения), сохраненный file_id отбрасывается."""
+
+    def __init__(self, paths, store_path=None):
+        self.paths = dict(paths)  # имя -> путь к файлу
+        self.store_path = store_path
+        self._ids = {}  # имя -> {'file_id': ..., 'fingerprint': [размер, время изменения]}
+        self._lock = threading.Lock()
+        if store_path and os.path.exists(store_path):
+            try:
+                with open(store_path, encoding='utf-8') as store:
+                    saved = json.load(store)
+            except (OSError, ValueError):
+                # испорченный или нечитаемый файл: начинаем с пустого реестра, файлы будут загружены заново
+                saved = {}
+            for name, entry in saved.items():
+                if name not in self.paths:
+                    continue
+                current = self._fingerprint(name)
+                # если самого файла нет, сохраненный file_id - единственный способ отправить его
+                if current is None or entry.get('fingerprint') == current:
+                    self._ids[name] = entry
+
+    def file_id(self, name):
+        """ Возвращает сохраненный file_id или None, если файл еще не загружался. """
+
+        with self._lock:
+            entry = self._ids.get(name)
+            return entry['file_id'] if entry else None
+
+    def open(self, name):
+        """ Открывает файл для загрузки (закрывать его должен вызывающий, например через with). """
+
+        return open(self.paths[name], 'rb')
+
+    def remember(self, name, file_id):
+        """ Запоминает file_id, который Telegram вернул после загрузки файла. """
+
+        with self._lock:
+            self._ids[name] = {'file_id': file_id, 'fingerprint': self._fingerprint(name)}
+            self._save()
+
+    def forget(self, name):
+        """ Удаляет file_id, который Telegram больше не принимает: следующая отправка загрузит файл заново. """
+
+        with self._lock:
+            if self._ids.pop(name, None) is not None:
+                self._save()
+
+    def _fingerprint(self, name):
+        try:
+            stat = os.stat(self.paths[name])
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _save(self):
+        if not self.store_path:
+            return
+        # запись во временный файл и замена, чтобы при падении не остался наполовину записанный JSON; у каждой
+        # записи свой временный файл, так как тот же реестр могут сохранять несколько процессов (см. supervisor.py)
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(os.path.abspath(self.store_path)),
+                                         prefix=os.path.basename(self.store_path) + '.', suffix='.tmp',
+                                         delete=False) as store:
+            json.dump(self._ids, store)
+        try:
+            os.replace(store.name, self.store_path)
+        except OSError:
+            os.remove(store.name)
+            raise
+
+
+def open_media_assets():
+    """ Создает реестр по переменным окружения: видео для /rnd лежат в MEDIA_DIR (по умолчанию - рядом с ботом)
+    под именами COIN_VIDEOS (через запятую), file_id сохраняются в MEDIA_IDS_FILE. """
+
+    media_dir = os.environ.get('MEDIA_DIR', os.path.dirname(os.path.abspath(__file__)))
+    names = os.environ.get('COIN_VIDEOS', '111.mp4,222.mp4').split(',')
+    paths = {f'coin_{index}': os.path.join(media_dir, name.strip()) for index, name in enumerate(names)}
+    return MediaAssets(paths, os.environ.get('MEDIA_IDS_FILE', os.path.join(media_dir, 'media_ids.json')))
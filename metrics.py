@@ -0,0 +1,259 @@
+""" Метрики задержек по стадиям обработки и локальный HTTP-эндпоинт для них.
+
+Стадии (метка stage): schedule - ожидание в очереди планировщика задач (см. scheduler.py),
+cache - попытка ответить из кэша результатов, get_file и download_file - запросы к Telegram,
+queue - ожидание свободного воркера исполнителя, decode, transform и encode - работа с изображением,
+send - отправка результата, total - весь запрос. Метка operation - операция (pixelate, ascii, ...).
+
+Если задан METRICS_PORT, бот поднимает HTTP-сервер (start_server) с адресами:
+- /metrics - гистограммы и счетчики в текстовом формате Prometheus;
+- /profile/start?interval=0.005 - включает семплирующий профилировщик (стеки всех потоков раз в interval секунд);
+- /profile/stop - выключает его и возвращает накопленные стеки в свернутом формате (flamegraph.pl, speedscope).
+"""
+import collections
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+# границы корзин гистограмм в секундах: от быстрых ответов из кэша до долгой обработки больших фото
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    """ Гистограмма с метками в духе prometheus_client: observe(значение, *значения меток). """
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # значения меток -> [счетчики по корзинам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((values, (list(counts), total, count)) for values, (counts, total, count)
+                            in self._series.items())
+        for values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels + ('le',), values + (repr(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), values + ("+Inf",))} {count}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, values)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, values)} {count}')
+        return lines
+
+
+class Gauge:
+    """ Текущее значение с метками: inc/dec, либо функция, которая вызывается при каждом чтении метрик. """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set_function(self, function, *label_values):
+        self._functions[label_values] = function
+
+    @contextmanager
+    def track(self, *label_values):
+        """ Увеличивает значение на время выполнения блока with. """
+
+        self.inc(*label_values)
+        try:
+            yield
+        finally:
+            self.dec(*label_values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = dict(self._values)
+        for label_values, function in list(self._functions.items()):
+            values[label_values] = function()
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Counter(Gauge):
+    """ Счетчик событий: то же, что Gauge, но значение только растет (inc). """
+
+    kind = 'counter'
+
+
+STAGE_SECONDS = Histogram('bot_stage_seconds', 'Duration of a request processing stage',
+                          ('operation', 'stage'))
+IN_FLIGHT = Gauge('bot_in_flight', 'Requests being processed right now', ('operation',))
+QUEUE_DEPTH = Gauge('bot_queue_depth', 'Tasks waiting in a queue', ('queue',))
+SEND_WAIT_SECONDS = Histogram('bot_send_wait_seconds', 'Time an outbound request waited in the send queue',
+                              ('lane',))
+SEND_THROTTLED = Counter('bot_send_throttled_total', 'Outbound requests rejected by Telegram with 429',
+                         ('method',))
+COALESCED = Counter('bot_coalesced_total', 'Duplicate button presses answered without processing', ('operation',))
+REGISTRY = [STAGE_SECONDS, IN_FLIGHT, QUEUE_DEPTH, SEND_WAIT_SECONDS, SEND_THROTTLED, COALESCED]
+
+
+@contextmanager
+def timed(operation, stage):
+    """ Записывает длительность блока with в STAGE_SECONDS, в том числе если блок завершился исключением. """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, operation, stage)
+
+
+def observe_stages(operation, timings):
+    """ Записывает длительности стадий из словаря {стадия: секунды} (например, полученного из процесса-воркера). """
+
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, operation, stage)
+
+
+def render():
+    """ Все метрики в текстовом формате Prometheus. """
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """ Семплирующий профилировщик: отдельный поток раз в interval секунд снимает стеки всех остальных потоков
+    (sys._current_frames) и считает, сколько раз встретился каждый стек. Накладные расходы не зависят от числа
+    вызовов функций, поэтому его можно включать на работающем боте."""
+
+    def __init__(self):
+        self._stacks = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=0.005):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stacks = collections.Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, args=(interval,), name='sampling-profiler',
+                                            daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """ Останавливает сбор и возвращает стеки в свернутом формате: 'кадр;кадр;... число' на строку. """
+
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+    def _sample(self, interval):
+        own = threading.get_ident()
+        while not self._stop.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            self._reply(200, render(), 'text/plain; version=0.0.4')
+        elif url.path == '/profile/start':
+            interval = float(parse_qs(url.query).get('interval', ['0.005'])[0])
+            started = profiler.start(interval)
+            self._reply(200 if started else 409, 'started\n' if started else 'already running\n')
+        elif url.path == '/profile/stop':
+            if profiler.running:
+                self._reply(200, profiler.stop())
+            else:
+                self._reply(409, 'not running\n')
+        else:
+            self._reply(404, 'not found\n')
+
+    def _reply(self, status, text, content_type='text/plain'):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, host='127.0.0.1'):
+    """ Запускает HTTP-сервер метрик в фоновом потоке и возвращает его. """
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def start_server_from_env():
+    """ Запускает сервер метрик, если задан METRICS_PORT (адрес - METRICS_HOST, по умолчанию 127.0.0.1). """
+
+    if os.environ.get('METRICS_PORT'):
+        return start_server(int(os.environ['METRICS_PORT']), os.environ.get('METRICS_HOST', '127.0.0.1'))
+    return None
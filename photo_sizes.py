@@ -0,0 +1,71 @@
+PIXEL_SIZE = 20  # размер "пикселя" при пикселизации
+ASCII_WIDTH = 40  # число столбцов ASCII-арта
+ASCII_IMAGE_WIDTH = 200  # число столбцов ASCII-арта картинкой (см. ascii_image.py)
+ASCII_OPERATIONS = ('ascii', 'ascii_image', 'ascii_color')  # ASCII-арт текстом, картинкой и цветной картинкой
+ASCII_OVERSAMPLING = 2  # во сколько раз исходник должен быть шире ASCII-арта, чтобы уменьшение было сглаженным
+STICKER_SIZE = 512  # максимальная сторона стикера
+
+
+def photo_sizes(photo):
+    """ Преобразует список PhotoSize из сообщения Telegram в список кортежей
+    (file_id, file_unique_id, ширина, высота), упорядоченный от меньшего варианта к большему."""
+
+    sizes = [(size.file_id, size.file_unique_id, size.width, size.height) for size in photo]
+    return sorted(sizes, key=lambda size: size[2] * size[3])
+
+
+def document_sizes(document):
+    """ То же для изображения, присланного документом (без сжатия): у документа один вариант, а его ширина
+    и высота до скачивания неизвестны и записываются как 0 (размер берется из самого файла)."""
+
+    return [(document.file_id, document.file_unique_id, 0, 0)]
+
+
+def required_size(operation, width, height, ascii_width=ASCII_WIDTH, steps=(), pixel_size=PIXEL_SIZE):
+    """ Возвращает минимальные ширину и высоту исходника, достаточные для операции над фотографией
+    с полным размером width x height. Операции, которым нужно полное разрешение, получают его целиком.
+    Для цепочки преобразований (steps) требование определяет шаг, который pipeline выполняет первым."""
+
+    if operation in ASCII_OPERATIONS:
+        return ascii_width * ASCII_OVERSAMPLING, 0
+    if operation == 'pixelate':
+        # после пикселизации остается по одному пикселю исходника на каждый блок pixel_size x pixel_size
+        return width // pixel_size, height // pixel_size
+    if operation == 'pipeline':
+        if 'resize' in steps:
+            return required_size('resize', width, height)
+        if 'pixelate' in steps:
+            return required_size('pixelate', width, height, pixel_size=pixel_size)
+        return width, height
+    if operation == 'resize':
+        scale = min(1, STICKER_SIZE / max(width, height))
+        return int(width * scale), int(height * scale)
+    return width, height
+
+
+def size_params(operation, params):
+    """ Извлекает из параметров преобразования (см. transforms.run_transform) то, что влияет на required_size. """
+
+    if operation in ASCII_OPERATIONS:
+        return {'ascii_width': params.get('new_width', ASCII_WIDTH)}
+    if operation == 'pixelate':
+        return {'pixel_size': params.get('pixel_size', PIXEL_SIZE)}
+    if operation == 'pipeline':
+        return {'steps': params['steps'], 'pixel_size': params.get('pixel_size', PIXEL_SIZE)}
+    return {}
+
+
+def pick_photo_size(sizes, operation, **params):
+    """ Выбирает наименьший из предложенных Telegram вариантов фотографии, которого достаточно для операции
+    с параметрами params. Если ни один вариант не подходит, возвращает самый большой. У документа размер
+    неизвестен (0, см. document_sizes) и вариант только один - он и возвращается."""
+
+    _, _, width, height = sizes[-1]
+    if not width or not height:
+        return sizes[-1]
+    min_width, min_height = required_size(operation, width, height, **params)
+    for size in sizes:
+        # Telegram округляет размеры уменьшенных копий, поэтому допускаем расхождение в один пиксель
+        if size[2] >= min_width - 1 and size[3] >= min_height - 1:
+            return size
+    return sizes[-1]
@@ -0,0 +1,72 @@
+""" Цепочка преобразований, которую пользователь собирает кнопками и применяет за один проход: изображение
+декодируется один раз, шаги выполняются в выгодном порядке, а результат кодируется один раз.
+
+Порядок выполнения не обязательно совпадает с порядком нажатий:
+1. уменьшение для стикера ('resize') выполняется первым, чтобы остальные шаги работали с меньшим числом пикселей;
+2. при пикселизации ('pixelate') изображение сразу уменьшается до сетки блоков, отражения и поточечные операции
+   применяются к этой маленькой сетке, а увеличение до полного размера выполняется последним;
+3. отражения сокращаются по четности (два одинаковых отражения отменяют друг друга);
+4. поточечные операции ('negative', 'heatmap', 'grayscale', 'posterize') сливаются в одну таблицу (LUT)
+   и применяются одним проходом (см. point_ops.py).
+Отражения и поточечные операции перестановочны с остальными шагами, поэтому результат отличается от
+последовательного применения только деталями интерполяции при уменьшении.
+"""
+from PIL import Image
+
+from point_ops import DEFAULT_COLORMAP, apply_point_ops
+
+
+GEOMETRY_STEPS = ('resize', 'pixelate', 'mirror_h', 'mirror_v')
+POINT_STEPS = ('negative', 'heatmap', 'grayscale', 'posterize')
+STEPS = GEOMETRY_STEPS + POINT_STEPS
+MAX_STEPS = 10
+
+
+def sticker_size(width, height, new_max_size=512):
+    """ Размер, к которому resize_for_sticker приводит изображение width x height. """
+
+    if width < new_max_size and height < new_max_size:
+        return width, height
+    scale = new_max_size / max(width, height)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def run_pipeline(image, steps, pixel_size=20, output_size=None, colormap=DEFAULT_COLORMAP):
+    """ Применяет цепочку steps к изображению за один проход. output_size - полный размер фотографии, если image -
+    ее уменьшенная копия (от него считаются размер стикера и сетка пикселизации); colormap - цветовая карта
+    для шага 'heatmap'."""
+
+    full_width, full_height = output_size or image.size
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    target = (full_width, full_height)
+    if 'resize' in steps:
+        target = sticker_size(full_width, full_height)
+        if image.size != target:
+            image = image.resize(target, reducing_gap=3.0)
+
+    if 'pixelate' in steps:
+        # сетка блоков считается, как в pixelate_image, от размера изображения на момент пикселизации:
+        # от стикера, если пользователь уменьшил фото раньше, иначе от полного размера
+        resized_before = 'resize' in steps and steps.index('resize') < steps.index('pixelate')
+        base_width, base_height = target if resized_before else (full_width, full_height)
+        blocks = (max(1, base_width // pixel_size), max(1, base_height // pixel_size))
+        image = image.resize(blocks, Image.Resampling.NEAREST)
+        if resized_before or 'resize' not in steps:
+            target = (blocks[0] * pixel_size, blocks[1] * pixel_size)
+
+    flip_h = steps.count('mirror_h') % 2
+    flip_v = steps.count('mirror_v') % 2
+    if flip_h and flip_v:
+        image = image.transpose(Image.Transpose.ROTATE_180)
+    elif flip_h:
+        image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    elif flip_v:
+        image = image.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+
+    image = apply_point_ops(image, [step for step in steps if step in POINT_STEPS], colormap)
+
+    if 'pixelate' in steps:
+        image = image.resize(target, Image.Resampling.NEAREST)
+    return image
@@ -0,0 +1,197 @@
+""" Поточечные операции (цвет каждого пикселя зависит только от его собственного цвета): негатив, оттенки серого,
+постеризация и тепловая карта с выбором цветовой карты.
+
+Каждая операция - таблица из 256 значений (LUT). Таблицы строятся один раз и кэшируются, цепочка операций
+сворачивается в одну таблицу (compile_point_ops) и применяется за один проход Image.point, а тепловая карта -
+как палитра на изображении в оттенках серого. Поддерживаются все режимы изображений: у палитровых ('P')
+таблица применяется прямо к палитре, у изображений с прозрачностью ('RGBA', 'LA') альфа-канал сохраняется.
+
+Имена операций: 'negative', 'grayscale', 'posterize' или 'posterize:<бит>' и 'heatmap' или 'heatmap:<карта>'
+(карты - см. COLORMAPS).
+"""
+from functools import lru_cache
+
+from PIL import Image, ImageOps
+
+
+POSTERIZE_BITS = 3  # сколько старших бит каждого канала оставляет постеризация по умолчанию
+DEFAULT_COLORMAP = 'heat'
+
+# опорные цвета цветовых карт для тепловой карты: (положение от 0 до 1, (R, G, B))
+COLORMAPS = {
+    'heat': None,  # синий - зеленый - красный, как ImageOps.colorize(black='blue', mid='green', white='red')
+    'viridis': ((0, (68, 1, 84)), (0.25, (59, 82, 139)), (0.5, (33, 145, 140)), (0.75, (94, 201, 98)),
+                (1, (253, 231, 37))),
+    'inferno': ((0, (0, 0, 4)), (0.25, (87, 16, 110)), (0.5, (188, 55, 84)), (0.75, (249, 142, 9)),
+                (1, (252, 255, 164))),
+    'jet': ((0, (0, 0, 128)), (0.125, (0, 0, 255)), (0.375, (0, 255, 255)), (0.625, (255, 255, 0)),
+            (0.875, (255, 0, 0)), (1, (128, 0, 0))),
+    'gray': ((0, (0, 0, 0)), (1, (255, 255, 255))),
+}
+
+IDENTITY = tuple(range(256))
+
+
+@lru_cache(maxsize=None)
+def colormap_palette(name=DEFAULT_COLORMAP):
+    """ Палитра цветовой карты: 768 байт RGB для уровней серого 0..255. """
+
+    stops = COLORMAPS[name]
+    if stops is None:
+        gradient = Image.frombytes('L', (256, 1), bytes(range(256)))
+        return ImageOps.colorize(gradient, black='blue', white='red', mid='green').tobytes()
+    palette = bytearray()
+    for level in range(256):
+        position = level / 255
+        for (start, low), (end, high) in zip(stops, stops[1:]):
+            if position <= end:
+                fraction = (position - start) / (end - start)
+                palette.extend(round(a + (b - a) * fraction) for a, b in zip(low, high))
+                break
+    return bytes(palette)
+
+
+@lru_cache(maxsize=None)
+def operation_lut(name):
+    """ Таблица операции, которая применяется к каждому каналу отдельно ('negative', 'posterize[:бит]'). """
+
+    if name == 'negative':
+        return tuple(255 - value for value in range(256))
+    if name.startswith('posterize'):
+        bits = int(name.split(':', 1)[1]) if ':' in name else POSTERIZE_BITS
+        mask = ~(2 ** (8 - bits) - 1) & 0xFF
+        return tuple(value & mask for value in range(256))
+    raise ValueError(f'Unknown point operation: {name}')
+
+
+def gray_level(red, green, blue):
+    """ Яркость цвета по той же формуле (ITU-R 601-2), что использует Image.convert('L'). """
+
+    return (red * 19595 + green * 38470 + blue * 7471 + 0x8000) >> 16
+
+
+def compose(first, second):
+    """ Таблица, равная применению first, а затем second. """
+
+    return tuple(second[value] for value in first)
+
+
+def map_palette(palette, lut):
+    """ Применяет таблицу к каждому компоненту палитры RGB. """
+
+    return bytes(lut[value] for value in palette)
+
+
+def palette_levels(palette):
+    """ Уровни серого цветов палитры (для перевода результата тепловой карты обратно в оттенки серого). """
+
+    return tuple(gray_level(*palette[i * 3:i * 3 + 3]) for i in range(256))
+
+
+class PointPlan:
+    """ Скомпилированная цепочка поточечных операций:
+    - color_lut - таблица для каждого канала до перевода в оттенки серого (None - не нужна);
+    - gray - переводится ли изображение в оттенки серого;
+    - gray_lut - таблица для уровней серого после перевода;
+    - palette - 768 байт RGB по уровню серого, если результат цветной (тепловая карта)."""
+
+    __slots__ = ('color_lut', 'gray', 'gray_lut', 'palette')
+
+    def __init__(self, color_lut=None, gray=False, gray_lut=IDENTITY, palette=None):
+        self.color_lut = color_lut
+        self.gray = gray
+        self.gray_lut = gray_lut
+        self.palette = palette
+
+
+@lru_cache(maxsize=256)
+def compile_point_ops(operations, colormap=DEFAULT_COLORMAP):
+    """ Сворачивает кортеж операций в PointPlan. Пока изображение цветное, таблицы операций компонуются
+    в color_lut. Перевод в оттенки серого перестановочен с негативом, поэтому таблица из одних негативов
+    переносится после перевода; остальные (постеризация) применяются до него. После перевода операции
+    компонуются в gray_lut, а после тепловой карты - применяются к ее палитре."""
+
+    lut = IDENTITY
+    affine = True  # lut - тождество или негатив, перестановочные с переводом в оттенки серого
+    plan = PointPlan()
+    for operation in operations:
+        name, _, argument = operation.partition(':')
+        if name in ('grayscale', 'heatmap'):
+            if plan.palette is not None:
+                # результат тепловой карты снова сводится к уровням серого
+                plan.gray_lut = compose(plan.gray_lut, palette_levels(plan.palette))
+                plan.palette = None
+            elif not plan.gray:
+                plan.gray = True
+                if affine:
+                    plan.gray_lut = lut
+                elif lut != IDENTITY:
+                    plan.color_lut = lut
+                lut = IDENTITY
+            if name == 'heatmap':
+                plan.palette = colormap_palette(argument or colormap)
+            continue
+
+        step = operation_lut(operation)
+        if plan.palette is not None:
+            plan.palette = map_palette(plan.palette, step)
+        elif plan.gray:
+            plan.gray_lut = compose(plan.gray_lut, step)
+        else:
+            lut = compose(lut, step)
+            affine = affine and name == 'negative'
+    if not plan.gray and lut != IDENTITY:
+        plan.color_lut = lut
+    return plan
+
+
+def prepare(image):
+    """ Приводит изображение к режиму, с которым работают таблицы: 'L', 'RGB', 'LA', 'RGBA' или 'P'. """
+
+    if image.mode == 'PA' or 'transparency' in image.info and image.mode not in ('L', 'RGB', 'LA', 'RGBA'):
+        # прозрачность палитровых и однобитных изображений переводится в альфа-канал, который сохранится
+        return image.convert('RGBA')
+    if image.mode in ('L', 'RGB', 'LA', 'RGBA', 'P'):
+        return image
+    if image.mode in ('1', 'I', 'I;16', 'F'):
+        return image.convert('L')
+    return image.convert('RGB')
+
+
+def apply_lut(image, lut):
+    """ Применяет таблицу к цветовым каналам изображения одним проходом, не трогая альфа-канал.
+    У палитрового изображения меняется только палитра. """
+
+    if image.mode == 'P':
+        image = image.copy()
+        palette = image.getpalette()
+        image.putpalette(map_palette(palette, lut))
+        return image
+    bands = image.getbands()
+    return image.point([value for band in bands for value in (lut if band != 'A' else IDENTITY)])
+
+
+def apply_point_ops(image, operations, colormap=DEFAULT_COLORMAP):
+    """ Применяет цепочку поточечных операций operations к изображению любого режима. """
+
+    plan = compile_point_ops(tuple(operations), colormap)
+    image = prepare(image)
+    if plan.color_lut is not None:
+        image = apply_lut(image, plan.color_lut)
+    if not plan.gray:
+        return image
+
+    alpha = image.getchannel('A') if image.mode in ('RGBA', 'LA') else None
+    gray = image.convert('L')
+    if plan.palette is None:
+        if plan.gray_lut != IDENTITY:
+            gray = gray.point(plan.gray_lut)
+        if alpha is not None:
+            gray = Image.merge('LA', (gray, alpha))
+        return gray
+    # уровень серого сразу служит индексом палитры, в которую уже вписана gray_lut
+    gray.putpalette(b''.join(plan.palette[level * 3:level * 3 + 3] for level in plan.gray_lut))
+    image = gray.convert('RGB')
+    if alpha is not None:
+        image.putalpha(alpha)
+    return image
@@ -1,9 +1,11 @@
 import telebot
-from PIL import Image, ImageOps
+from PIL import Image
 import io
 from telebot import types
 import os
 
+import transforms
+
 
 TOKEN = os.environ['TOKEN']
 bot = telebot.TeleBot(TOKEN)
@@ -18,61 +20,33 @@ def resize_image(image, new_width=100):
 
     """ Изменяет размер изображения с сохранением пропорций."""
 
-    width, height = image.size
-    ratio = height / width
-    new_height = int(new_width * ratio)
-    return image.resize((new_width, new_height))
+    return transforms.resize_image(image, new_width)
 
 def invert_colors(image):
 
     """ Преобразует изображение в инверсионное (эффект негатива) """
 
-    im_invert = ImageOps.invert(image)
-    return im_invert
+    return transforms.invert_colors(image)
 
 def mirror_image(image):
 
     """ Преобразует изображение в зеркальное """
-    if type_mirror == 'Y':
-        im_flipped = image.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
-    else:
-        im_flipped = image.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
-    return im_flipped
+
+    return transforms.mirror_image(image, horizontal=type_mirror == 'Y')
 
 
 def grayify(image):
 
     """ Преобразует цветное изображение в оттенки серого. """
 
-    return image.convert("L")
+    return transforms.grayify(image)
 
 
 def image_to_ascii(image_stream, new_width=40):
 
-    """ Основная функция для преобразования изображения в ASCII-арт. Изменяет размер, преобразует в градации серого
-    и затем в строку ASCII-символов."""
-
-    # Переводим в оттенки серого
-    image = Image.open(image_stream).convert('L')
-
-    # меняем размер сохраняя отношение сторон
-    width, height = image.size
-    aspect_ratio = height / float(width)
-    new_height = int(
-        aspect_ratio * new_width * 0.55)  # 0,55 так как буквы выше чем шире
-    img_resized = image.resize((new_width, new_height))
-
-    img_str = pixels_to_ascii(img_resized)
-    img_width = img_resized.width
-
-    max_characters = 4000 - (new_width + 1)
-    max_rows = max_characters // (new_width + 1)
-
-    ascii_art = ""
-    for i in range(0, min(max_rows * img_width, len(img_str)), img_width):
-        ascii_art += img_str[i:i + img_width] + "\n"
+    """ Основная функция для преобразования изображения в ASCII-арт (см. transforms.image_to_ascii)."""
 
-    return ascii_art
+    return transforms.image_to_ascii(Image.open(image_stream), ASCII_CHARS, new_width)
 
 
 def pixels_to_ascii(image):
@@ -80,28 +54,15 @@ def pixels_to_ascii(image):
     """ Конвертирует пиксели изображения в градациях серого в строку ASCII-символов, используя предопределенную строку
     ASCII_CHARS"""
 
-    pixels = image.getdata()
-    characters = ""
-    for pixel in pixels:
-        characters += ASCII_CHARS[pixel * len(ASCII_CHARS) // 256]
-    return characters
+    return transforms.pixels_to_ascii(image, ASCII_CHARS)
 
 
 # Огрубляем изображение
 def pixelate_image(image, pixel_size):
 
-    """ Принимает изображение и размер пикселя. Уменьшает изображение до размера, где один пиксель представляет большую
-     область, затем увеличивает обратно, создавая пиксельный эффект."""
+    """ Принимает изображение и размер пикселя и создает пиксельный эффект (см. transforms.pixelate_image)."""
 
-    image = image.resize(
-        (image.size[0] // pixel_size, image.size[1] // pixel_size),
-        Image.Resampling.NEAREST
-    )
-    image = image.resize(
-        (image.size[0] * pixel_size, image.size[1] * pixel_size),
-        Image.Resampling.NEAREST
-    )
-    return image
+    return transforms.pixelate_image(image, pixel_size)
 
 
 @bot.message_handler(commands=['start', 'help'])
@@ -244,4 +205,5 @@ def mirror_and_send(message):
     bot.send_photo(message.chat.id, output_stream)
 
 
-bot.polling(none_stop=True)
+if __name__ == '__main__':
+    bot.polling(none_stop=True)
@@ -0,0 +1,140 @@
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def result_key(file_unique_id, operation, params):
+    """ Ключ результата: исходная фотография, операция и ее параметры. """
+
+    return f'{file_unique_id}:{operation}:{json.dumps(params, sort_keys=True, ensure_ascii=False)}'
+
+
+class ResultCache:
+    """ Кэш готовых результатов. Для фотографий хранит file_id, который Telegram вернул при первой отправке,
+    для ASCII-арта - сам текст: повторный запрос той же операции над тем же фото отвечается без декодирования,
+    обработки и повторной загрузки. Объем ограничен max_bytes (вытесняются давно не использовавшиеся записи).
+    Если задан path, кэш хранится в файле SQLite и загружается из него при старте. Время использования записей
+    (по нему при загрузке восстанавливается порядок вытеснения) попадание отмечает только в памяти, а в файл оно
+    записывается пачкой: вместе с put и discard, не реже раза в flush_interval секунд и при выходе из процесса."""
+
+    def __init__(self, path=None, max_bytes=8 * 1024 * 1024, flush_interval=60):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # ключ -> (вид результата 'photo' или 'text', значение)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._used = {}  # ключ -> время последнего попадания, еще не записанное в файл
+        self._flushed = time.monotonic()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, kind TEXT, value TEXT, '
+                             'used REAL)')
+            evicted = []
+            for key, kind, value in self._db.execute('SELECT key, kind, value FROM results ORDER BY used').fetchall():
+                evicted.extend(self._store(key, kind, value))
+            # записи, не поместившиеся в max_bytes, удаляются и из файла, иначе он растет без ограничений
+            self._db.executemany('DELETE FROM results WHERE key = ?', [(key,) for key in evicted])
+            self._db.commit()
+            atexit.register(self.close)
+
+    def get(self, key):
+        """ Возвращает (вид, значение) сохраненного результата или None. """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._used[key] = time.time()
+                if time.monotonic() - self._flushed >= self.flush_interval:
+                    self._flush()
+                    self._db.commit()
+            return entry
+
+    def put(self, key, kind, value):
+        """ Запоминает результат: kind='photo' и file_id отправленной фотографии или kind='text' и текст. """
+
+        with self._lock:
+            evicted = self._store(key, kind, value)
+            if self._db is not None:
+                self._flush()
+                self._db.executemany('DELETE FROM results WHERE key = ?', [(old,) for old in evicted])
+                self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, kind, value, time.time()))
+                self._db.commit()
+
+    def discard(self, key):
+        """ Удаляет результат, например если Telegram больше не принимает сохраненный file_id. """
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self._db is not None:
+                self._flush()
+                self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                self._db.commit()
+
+    def close(self):
+        """ Записывает в файл накопленные времена использования и закрывает его. """
+
+        with self._lock:
+            if self._db is None:
+                return
+            self._flush()
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        """ Возвращает счетчики попаданий и промахов, долю попаданий и объем кэша. """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+    def _store(self, key, kind, value):
+        """ Кладет запись в память и возвращает список вытесненных ключей. """
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (kind, value)
+        self._size += self._entry_size(key, value)
+        evicted = []
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            evicted.append(oldest)
+        return evicted
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._size -= self._entry_size(key, value)
+        self._used.pop(key, None)
+
+    def _flush(self):
+        """ Записывает накопленные времена использования (без commit - его делает вызывающий). """
+
+        if self._used:
+            self._db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                                 [(used, key) for key, used in self._used.items()])
+            self._used.clear()
+        self._flushed = time.monotonic()
+
+    @staticmethod
+    def _entry_size(key, value):
+        return len(key.encode()) + len(value.encode())
@@ -0,0 +1,208 @@
+""" Планировщик тяжелых задач (скачивание, обработка и отправка фото) с честной очередью между чатами.
+
+Обработчики сообщений и нажатий только ставят тяжелую задачу в очередь и сразу освобождаются, поэтому команды
+вроде /joke и /start (быстрая полоса - потоки или цикл событий самого бота) не ждут за обработкой фото.
+Тяжелые задачи выполняют workers собственных воркеров планировщика. Очереди ведутся по чатам и обходятся
+по кругу (round-robin): чат, приславший десять фото, получает воркер так же часто, как чат с одним фото.
+У одного чата одновременно выполняется не больше chat_limit задач, ждет не больше chat_queue, всего ждет
+не больше max_queue; сверх этого submit бросает QueueFull. submit возвращает позицию задачи в очереди
+(0 - задача начнется сразу), чтобы бот мог ответить "в очереди, позиция N".
+
+JobScheduler - для sync-бота (потоки), AsyncJobScheduler - для async-бота (задачи asyncio).
+"""
+import asyncio
+import threading
+import time
+import traceback
+from collections import deque
+
+import metrics
+
+
+class QueueFull(Exception):
+    """ Очередь чата или общая очередь планировщика заполнена. """
+
+
+class FairQueue:
+    """ Очереди задач по чатам с выдачей по кругу. Блокировки у нее нет - ее держит планировщик. """
+
+    def __init__(self, chat_limit=1, chat_queue=5, max_queue=100):
+        self.chat_limit = chat_limit
+        self.chat_queue = chat_queue
+        self.max_queue = max_queue
+        self.waiting = 0
+        self._queues = {}  # chat_id -> deque задач
+        self._ring = deque()  # чаты с ожидающими задачами в порядке обхода
+        self._running = {}  # chat_id -> число выполняемых задач
+
+    def push(self, chat_id, job):
+        """ Ставит задачу в очередь чата и возвращает, сколько ожидающих задач будет выдано раньше нее (при обходе
+        по кругу - до стольких же задач каждого другого чата, сколько своих впереди, плюс одна). """
+
+        queue = self._queues.get(chat_id)
+        own = len(queue) if queue else 0
+        if own >= self.chat_queue or self.waiting >= self.max_queue:
+            raise QueueFull()
+        ahead = own + sum(min(len(other), own + 1) for other_id, other in self._queues.items() if other_id != chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            self._ring.append(chat_id)
+        queue.append(job)
+        self.waiting += 1
+        return ahead
+
+    def pop(self):
+        """ Возвращает (chat_id, задача) следующего по кругу чата, у которого выполняется меньше chat_limit задач,
+        или None, если таких чатов нет. """
+
+        for _ in range(len(self._ring)):
+            chat_id = self._ring[0]
+            self._ring.rotate(-1)
+            if self._running.get(chat_id, 0) >= self.chat_limit:
+                continue
+            queue = self._queues[chat_id]
+            job = queue.popleft()
+            self.waiting -= 1
+            if not queue:
+                # после rotate чат стоит в конце круга
+                del self._queues[chat_id]
+                self._ring.pop()
+            self._running[chat_id] = self._running.get(chat_id, 0) + 1
+            return chat_id, job
+        return None
+
+    def done(self, chat_id):
+        """ Отмечает завершение задачи чата, выданной pop. """
+
+        self._running[chat_id] -= 1
+        if not self._running[chat_id]:
+            del self._running[chat_id]
+
+    def can_start(self, chat_id):
+        """ Начнется ли задача чата сразу при свободном воркере: у чата нет ожидающих задач и он не на пределе. """
+
+        return chat_id not in self._queues and self._running.get(chat_id, 0) < self.chat_limit
+
+
+class Job:
+    __slots__ = ('operation', 'function', 'args', 'enqueued')
+
+    def __init__(self, operation, function, args):
+        self.operation = operation
+        self.function = function
+        self.args = args
+        self.enqueued = time.perf_counter()
+
+    def started(self):
+        """ Записывает ожидание в очереди планировщика как стадию schedule. """
+
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - self.enqueued, self.operation, 'schedule')
+
+
+class JobScheduler:
+    """ Планировщик для sync-бота: workers потоков выполняют задачи из FairQueue. """
+
+    def __init__(self, workers=4, chat_limit=1, chat_queue=5, max_queue=100):
+        self.workers = workers
+        self._queue = FairQueue(chat_limit, chat_queue, max_queue)
+        self._cond = threading.Condition()
+        self._active = 0  # выполняемые задачи
+        self._threads = []
+        metrics.QUEUE_DEPTH.set_function(lambda: self._queue.waiting, 'jobs')
+
+    def submit(self, chat_id, operation, function, *args):
+        """ Ставит function(*args) в очередь чата chat_id и возвращает позицию в очереди (0 - начнется сразу).
+        Бросает QueueFull, если очередь чата или общая очередь заполнена. """
+
+        with self._cond:
+            starts_now = self._queue.can_start(chat_id) and self._active + self._queue.waiting < self.workers
+            ahead = self._queue.push(chat_id, Job(operation, function, args))
+            if not self._threads:
+                for index in range(self.workers):
+                    thread = threading.Thread(target=self._work, name=f'job-{index}', daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            self._cond.notify()
+        return 0 if starts_now else ahead + 1
+
+    def wait_idle(self, timeout=None):
+        """ Ждет, пока не останется ни ожидающих, ни выполняемых задач. Возвращает False, если за timeout секунд
+        задачи не закончились. """
+
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._active and not self._queue.waiting, timeout)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                item = self._queue.pop()
+                while item is None:
+                    self._cond.wait()
+                    item = self._queue.pop()
+                self._active += 1
+            chat_id, job = item
+            job.started()
+            try:
+                job.function(*job.args)
+            except Exception:
+                # ошибка одной задачи не должна останавливать воркер
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._queue.done(chat_id)
+                    # будим всех: кроме воркеров, завершения задач может ждать wait_idle
+                    self._cond.notify_all()
+
+
+class AsyncJobScheduler:
+    """ То же для async-бота: workers задач asyncio выполняют корутины из FairQueue. Воркеры запускаются
+    при первом submit в работающем цикле событий. """
+
+    def __init__(self, workers=16, chat_limit=1, chat_queue=5, max_queue=100):
+        self.workers = workers
+        self._queue = FairQueue(chat_limit, chat_queue, max_queue)
+        self._cond = None
+        self._active = 0  # выполняемые задачи
+        self._tasks = []
+        metrics.QUEUE_DEPTH.set_function(lambda: self._queue.waiting, 'jobs')
+
+    async def submit(self, chat_id, operation, function, *args):
+        """ Ставит корутину function(*args) в очередь чата и возвращает позицию (см. JobScheduler.submit). """
+
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        async with self._cond:
+            starts_now = self._queue.can_start(chat_id) and self._active + self._queue.waiting < self.workers
+            ahead = self._queue.push(chat_id, Job(operation, function, args))
+            self._cond.notify()
+        return 0 if starts_now else ahead + 1
+
+    async def wait_idle(self):
+        """ Ждет, пока не останется ни ожидающих, ни выполняемых задач. """
+
+        if self._cond is None:
+            return
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._active and not self._queue.waiting)
+
+    async def _work(self):
+        while True:
+            async with self._cond:
+                item = self._queue.pop()
+                while item is None:
+                    await self._cond.wait()
+                    item = self._queue.pop()
+                self._active += 1
+            chat_id, job = item
+            job.started()
+            try:
+                await job.function(*job.args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                async with self._cond:
+                    self._active -= 1
+                    self._queue.done(chat_id)
+                    self._cond.notify_all()
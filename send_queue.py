@@ -0,0 +1,268 @@
+""" Очередь исходящих запросов к Telegram с учетом лимитов на частоту сообщений.
+
+Telegram ограничивает бота примерно 30 сообщениями в секунду всего и около одного сообщения в секунду в один чат;
+при превышении он отвечает 429 с retry_after. Все отправки проходят через SendQueue: запрос ждет разрешения
+отдельного потока-диспетчера, который выдает разрешения по корзинам токенов (общей и для каждого чата) и по
+приоритетам: ответы на нажатия кнопок (LANE_CALLBACK) идут раньше текстовых сообщений (LANE_TEXT),
+а те - раньше загрузки фото и видео (LANE_MEDIA). Лимит чата расходуют только отправки сообщений
+(CHAT_LIMITED_METHODS): правка сообщения с позицией в очереди, удаление клавиатуры или индикатор "печатает"
+не ждут за фото того же чата. Ответ 429 блокирует чат на retry_after секунд (для всех методов), после чего
+запрос повторяется. Получение обновлений и файлов (getUpdates, getFile) через очередь не проходит.
+
+Очередь подключается к sync-боту через apihelper.CUSTOM_REQUEST_SENDER (request_sender), к async-боту -
+оберткой над asyncio_helper._process_request (wrap_async). Функцию, которая выполняет сам запрос, можно
+подменить, например, на обращение к локальному фейковому API.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+import metrics
+
+
+LANE_CALLBACK, LANE_TEXT, LANE_MEDIA = 0, 1, 2
+LANE_NAMES = ('callback', 'text', 'media')
+
+# методы Bot API, которые проходят через очередь, и их приоритет
+LANES = {
+    'answerCallbackQuery': LANE_CALLBACK,
+    'sendMessage': LANE_TEXT,
+    'editMessageText': LANE_TEXT,
+    'deleteMessage': LANE_TEXT,
+    'sendChatAction': LANE_TEXT,
+    'sendPhoto': LANE_MEDIA,
+    'sendSticker': LANE_MEDIA,
+    'sendVideo': LANE_MEDIA,
+    'sendDocument': LANE_MEDIA,
+    'sendMediaGroup': LANE_MEDIA,
+}
+# методы, на которые действует лимит Telegram на сообщения в один чат
+CHAT_LIMITED_METHODS = frozenset(('sendMessage', 'sendPhoto', 'sendSticker', 'sendVideo', 'sendDocument',
+                                  'sendMediaGroup'))
+
+
+class TokenBucket:
+    """ Корзина токенов: rate токенов в секунду, не больше burst про запас. Методы вызываются под блокировкой
+    SendQueue, поэтому своей блокировки у корзины нет."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        """ Через сколько секунд можно будет взять токен (0 - можно сейчас). """
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        """ Корзина полна и не заблокирована - ее можно удалить, новая будет такой же. """
+
+        return now >= self.blocked_until and self.wait_time(now) == 0 and self.tokens >= self.burst
+
+
+class Ticket:
+    """ Запрос, ожидающий разрешения на отправку. grant вызывается потоком-диспетчером. """
+
+    __slots__ = ('method', 'chat_id', 'enqueued', 'grant')
+
+    def __init__(self, method, chat_id, grant):
+        self.method = method
+        self.chat_id = chat_id
+        self.enqueued = time.monotonic()
+        self.grant = grant
+
+
+class SendQueue:
+    """ Диспетчер исходящих запросов: global_rate сообщений в секунду всего, chat_rate в секунду (и до chat_burst
+    подряд) в один чат, до max_retries повторов после ответа 429. """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_retries=5):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._lanes = [deque() for _ in LANE_NAMES]
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats = {}  # chat_id -> TokenBucket
+        self._cond = threading.Condition()
+        self._thread = None
+        for lane, name in enumerate(LANE_NAMES):
+            metrics.QUEUE_DEPTH.set_function(self._lanes[lane].__len__, f'send_{name}')
+
+    def set_global_rate(self, rate):
+        """ Меняет общий лимит на ходу: например, когда супервизор делит лимит бота между другим числом воркеров. """
+
+        with self._cond:
+            self._global.wait_time(time.monotonic())  # накопленные по старому лимиту токены
+            self.global_rate = self._global.rate = rate
+            self._global.burst = max(1, rate)
+            self._global.tokens = min(self._global.tokens, self._global.burst)
+            self._cond.notify()
+
+    def acquire(self, method, chat_id):
+        """ Блокирует поток, пока диспетчер не разрешит отправить запрос method в чат chat_id. """
+
+        granted = threading.Event()
+        self._submit(Ticket(method, chat_id, granted.set))
+        granted.wait()
+
+    async def acquire_async(self, method, chat_id):
+        """ То же для цикла событий: ждет разрешения, не блокируя поток. """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = Ticket(method, chat_id, grant)
+        self._submit(ticket)
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._cancel(ticket)
+            raise
+
+    def throttle(self, method, chat_id, retry_after):
+        """ Учитывает ответ 429: чат (или весь бот, если чата нет) не получает разрешений retry_after секунд. """
+
+        metrics.SEND_THROTTLED.inc(method)
+        with self._cond:
+            now = time.monotonic()
+            bucket = self._global if chat_id is None else self._chat_bucket(chat_id, now)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            self._cond.notify()
+
+    def request_sender(self, send):
+        """ Возвращает функцию для apihelper.CUSTOM_REQUEST_SENDER. send(method, url, **kwargs) выполняет сам
+        запрос и возвращает requests.Response. """
+
+        def sender(method, url, **kwargs):
+            api_method = url.rsplit('/', 1)[-1]
+            if api_method not in LANES:
+                return send(method, url, **kwargs)
+            chat_id = (kwargs.get('params') or {}).get('chat_id')
+            for attempt in range(self.max_retries + 1):
+                self.acquire(api_method, chat_id)
+                response = send(method, url, **kwargs)
+                if response.status_code != 429 or attempt == self.max_retries:
+                    return response
+                try:
+                    result_json = response.json()
+                except ValueError:
+                    result_json = None
+                self.throttle(api_method, chat_id, retry_after(result_json))
+                rewind(kwargs.get('files'))
+
+        return sender
+
+    def wrap_async(self, process_request):
+        """ Возвращает замену asyncio_helper._process_request, которая проводит запросы через очередь. """
+
+        from telebot.asyncio_helper import ApiTelegramException
+
+        async def process(token, url, method='get', params=None, files=None, **kwargs):
+            if url not in LANES:
+                return await process_request(token, url, method, params, files, **kwargs)
+            chat_id = params.get('chat_id') if params else None
+            for attempt in range(self.max_retries + 1):
+                await self.acquire_async(url, chat_id)
+                try:
+                    # _process_request забирает из params параметр timeout, поэтому каждой попытке - своя копия
+                    return await process_request(token, url, method, dict(params) if params else params, files,
+                                                 **kwargs)
+                except ApiTelegramException as error:
+                    if error.error_code != 429 or attempt == self.max_retries:
+                        raise
+                    self.throttle(url, chat_id, retry_after(error.result_json))
+                    rewind(files)
+
+        return process
+
+    def _submit(self, ticket):
+        with self._cond:
+            self._lanes[LANES[ticket.method]].append(ticket)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name='send-queue', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _cancel(self, ticket):
+        with self._cond:
+            lane = self._lanes[LANES[ticket.method]]
+            if ticket in lane:
+                lane.remove(ticket)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _next_ticket(self, now):
+        """ Возвращает (билет, 0), если какой-то запрос можно отправить сейчас, иначе (None, сколько ждать).
+        Лимит одного чата не задерживает запросы других чатов из той же и следующих очередей. """
+
+        wait = self._global.wait_time(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for lane in self._lanes:
+            for ticket in lane:
+                if ticket.chat_id is None:
+                    return ticket, 0
+                if ticket.method in CHAT_LIMITED_METHODS:
+                    chat_wait = self._chat_bucket(ticket.chat_id, now).wait_time(now)
+                else:
+                    # остальные методы лимит чата не расходуют, но после ответа 429 в этот чат тоже ждут
+                    bucket = self._chats.get(ticket.chat_id)
+                    chat_wait = max(0.0, bucket.blocked_until - now) if bucket else 0.0
+                if chat_wait == 0:
+                    return ticket, 0
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                ticket, wait = self._next_ticket(now)
+                if ticket is None:
+                    self._cond.wait(wait)
+                    continue
+                self._lanes[LANES[ticket.method]].remove(ticket)
+                self._global.take()
+                if ticket.chat_id is not None and ticket.method in CHAT_LIMITED_METHODS:
+                    self._chat_bucket(ticket.chat_id, now).take()
+            metrics.SEND_WAIT_SECONDS.observe(now - ticket.enqueued, LANE_NAMES[LANES[ticket.method]])
+            ticket.grant()
+
+
+def retry_after(result_json):
+    """ Сколько секунд ждать по ответу 429 (parameters.retry_after, по умолчанию 1). """
+
+    return (result_json or {}).get('parameters', {}).get('retry_after', 1)
+
+
+def rewind(files):
+    """ Перематывает загружаемые файлы в начало перед повтором запроса. """
+
+    for value in (files or {}).values():
+        file = value[1] if isinstance(value, tuple) else value
+        if hasattr(file, 'seek'):
+            file.seek(0)
@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class Session:
+    """ Состояние одного чата: варианты последней присланной фотографии (кортежи из photo_sizes.photo_sizes),
+    набор символов и ширина ASCII-арта, направление отражения, собранная цепочка преобразований, варианты
+    всех фото последнего альбома (album), цветовая карта тепловой карты (colormap, '' - по умолчанию) и колоды
+    шуток и комплиментов (decks: имя корпуса -> [seed, позиция, размер], см. corpus.deal). __slots__ вместо
+    словаря экономит память, когда чатов десятки тысяч."""
+
+    __slots__ = ('chat_id', 'sizes', 'charset', 'ascii_width', 'mirror_horizontal', 'pipeline', 'album', 'colormap',
+                 'decks', 'touched')
+
+    def __init__(self, chat_id, sizes=(), charset='', ascii_width=None, mirror_horizontal=True, pipeline=(),
+                 album=(), colormap='', decks=None, touched=0.0):
+        self.chat_id = chat_id
+        self.sizes = sizes
+        self.charset = charset
+        self.ascii_width = ascii_width
+        self.mirror_horizontal = mirror_horizontal
+        self.pipeline = pipeline
+        self.album = album
+        self.colormap = colormap
+        self.decks = decks or {}
+        self.touched = touched
+
+    def size(self):
+        """ Приблизительный объем памяти, занимаемый записью, в байтах. """
+
+        total = (sys.getsizeof(self) + sys.getsizeof(self.sizes) + sys.getsizeof(self.charset)
+                 + sys.getsizeof(self.pipeline) + sys.getsizeof(self.decks) + 100 * len(self.decks))
+        for sizes in (self.sizes,) + self.album:
+            for size in sizes:
+                total += sys.getsizeof(size) + sum(sys.getsizeof(item) for item in size)
+        return total
+
+
+class SessionStore:
+    """ Хранилище сессий в памяти процесса. Давно не использовавшиеся сессии вытесняются (LRU), когда их больше
+    max_sessions или они вместе занимают больше max_bytes; сессии старше ttl секунд считаются истекшими."""
+
+    def __init__(self, max_sessions=10000, max_bytes=16 * 1024 * 1024, ttl=24 * 3600):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # chat_id -> (Session, размер в байтах)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, chat_id):
+        """ Возвращает сессию чата. Если ее нет или она истекла, возвращает новую пустую сессию
+        (в хранилище она попадет после save)."""
+
+        with self._lock:
+            entry = self._sessions.get(chat_id)
+            if entry is not None:
+                session, _ = entry
+                if time.time() - session.touched <= self.ttl:
+                    self._sessions.move_to_end(chat_id)
+                    return session
+                self._remove(chat_id)
+        return Session(chat_id)
+
+    def save(self, session):
+        """ Сохраняет сессию после изменения и вытесняет лишние. """
+
+        session.touched = time.time()
+        size = session.size()
+        with self._lock:
+            if session.chat_id in self._sessions:
+                self._remove(session.chat_id)
+            self._sessions[session.chat_id] = (session, size)
+            self._size += size
+            while len(self._sessions) > self.max_sessions or self._size > self.max_bytes:
+                self._remove(next(iter(self._sessions)))
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _remove(self, chat_id):
+        _, size = self._sessions.pop(chat_id)
+        self._size -= size
+
+
+class SqliteSessionStore:
+    """ Хранилище сессий в файле SQLite с тем же интерфейсом, что у SessionStore. Сессии переживают перезапуск
+    бота, а несколько процессов-воркеров могут работать с одним файлом (журнал WAL). Вместо ограничения по памяти
+    действует ограничение max_sessions; истекшие и лишние записи удаляются при сохранении."""
+
+    def __init__(self, path, max_sessions=100000, ttl=24 * 3600, cleanup_every=100):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.cleanup_every = cleanup_every
+        self._saves = 0
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                               'chat_id INTEGER PRIMARY KEY, sizes TEXT, charset TEXT, ascii_width INTEGER, '
+                               'mirror_horizontal INTEGER, touched REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)')
+            # файлы, созданные до появления цепочек преобразований, альбомов, цветовых карт и колод
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(sessions)')]
+            for column, default in (('pipeline', "'[]'"), ('album', "'[]'"), ('colormap', "''"), ('decks', "'{}'")):
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE sessions ADD COLUMN {column} TEXT DEFAULT {default}')
+
+    def get(self, chat_id):
+        """ Возвращает сессию чата или новую пустую, если ее нет или она истекла. """
+
+        row = self._connection().execute(
+            'SELECT sizes, charset, ascii_width, mirror_horizontal, pipeline, album, colormap, decks, touched '
+            'FROM sessions WHERE chat_id = ? AND touched >= ?', (chat_id, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return Session(chat_id)
+        sizes, charset, ascii_width, mirror_horizontal, pipeline, album, colormap, decks, touched = row
+        return Session(chat_id, tuple(tuple(size) for size in json.loads(sizes)), charset, ascii_width,
+                       bool(mirror_horizontal), tuple(json.loads(pipeline)),
+                       tuple(tuple(tuple(size) for size in photo) for photo in json.loads(album)), colormap,
+                       json.loads(decks), touched)
+
+    def save(self, session):
+        """ Сохраняет сессию; раз в cleanup_every сохранений удаляет истекшие и самые старые лишние сессии. """
+
+        session.touched = time.time()
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO sessions (chat_id, sizes, charset, ascii_width, '
+                               'mirror_horizontal, pipeline, album, colormap, decks, touched) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (session.chat_id, json.dumps(session.sizes), session.charset, session.ascii_width,
+                                int(session.mirror_horizontal), json.dumps(session.pipeline),
+                                json.dumps(session.album), session.colormap, json.dumps(session.decks),
+                                session.touched))
+            self._saves += 1
+            if self._saves % self.cleanup_every == 0:
+                connection.execute('DELETE FROM sessions WHERE touched < ?', (time.time() - self.ttl,))
+                connection.execute('DELETE FROM sessions WHERE chat_id NOT IN '
+                                   '(SELECT chat_id FROM sessions ORDER BY touched DESC LIMIT ?)',
+                                   (self.max_sessions,))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def _connection(self):
+        # у каждого потока обработчиков свое соединение: объект sqlite3.Connection нельзя делить между потоками
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            self._local.connection = connection
+        return connection
+
+
+def open_session_store():
+    """ Создает хранилище сессий по переменным окружения: SQLite, если задан SESSION_DB, иначе в памяти. """
+
+    ttl = int(os.environ.get('SESSION_TTL', 24 * 3600))
+    if os.environ.get('SESSION_DB'):
+        return SqliteSessionStore(os.environ['SESSION_DB'], max_sessions=int(os.environ.get('SESSION_MAX', 100000)),
+                                  ttl=ttl)
+    return SessionStore(max_sessions=int(os.environ.get('SESSION_MAX', 10000)),
+                        max_bytes=int(os.environ.get('SESSION_MAX_BYTES', 16 * 1024 * 1024)), ttl=ttl)
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import metrics
+
+
+class SingleFlight:
+    """ Склейка повторных нажатий: пока задача с ключом key выполняется и еще debounce секунд после ее
+    завершения, такие же задачи не запускаются (begin возвращает False). Ключ задачи - чат, фотография, операция
+    и ее параметры (см. bot_common.job_key), так что двойное нажатие кнопки дает одну обработку и одну отправку."""
+
+    def __init__(self, debounce=2.0):
+        self.debounce = debounce
+        self._running = set()
+        self._finished = {}  # ключ -> время завершения (time.monotonic), в порядке завершения
+        self._lock = threading.Lock()
+
+    def begin(self, key, operation=''):
+        """ Отмечает начало задачи key и возвращает True; если такая задача уже выполняется или только что
+        завершилась, ничего не отмечает, учитывает повтор в metrics.COALESCED и возвращает False. """
+
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if key in self._running or key in self._finished:
+                metrics.COALESCED.inc(operation)
+                return False
+            self._running.add(key)
+            return True
+
+    def finish(self, key):
+        """ Отмечает завершение задачи key (в том числе неудачное): повторы еще debounce секунд склеиваются. """
+
+        with self._lock:
+            self._running.discard(key)
+            if self.debounce > 0:
+                self._finished.pop(key, None)
+                self._finished[key] = time.monotonic()
+
+    def _expire(self, now):
+        # словарь упорядочен по времени завершения, поэтому истекшие записи всегда в начале
+        while self._finished:
+            key, finished = next(iter(self._finished.items()))
+            if now - finished < self.debounce:
+                break
+            del self._finished[key]
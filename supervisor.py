@@ -0,0 +1,391 @@
+""" Режим супервизора: несколько процессов-воркеров бота, обновления распределяются по chat_id.
+Запуск: python supervisor.py
+
+Супервизор сам получает обновления (getUpdates или вебхук, если задан WEBHOOK_URL) и передает каждое
+воркеру, выбранному по chat_id согласованным хешированием (HashRing), поэтому все обновления чата попадают
+в один процесс, и его сессия, кэш скачанных фото и очередь задач остаются локальными. Воркер - это bot.py
+(или async_bot.py при SUPERVISOR_BOT=async_bot), который вместо опроса Telegram обрабатывает обновления
+из своей очереди. Общий лимит отправок SEND_GLOBAL_RATE делится между воркерами поровну.
+
+Упавший воркер перезапускается (если он падает сразу после старта - с растущей паузой) с новой очередью:
+старую процесс мог оставить посреди чтения, с захваченной блокировкой. Обновления, которые еще лежат в старой
+очереди, переносятся в новую (см. move_updates). Обновления, которые упавший процесс уже забрал из очереди,
+но не обработал, теряются: доставка воркеру - не больше одного раза (at-most-once), а Telegram их повторно
+не пришлет, потому что offset уже подтвержден. Число воркеров SUPERVISOR_WORKERS меняется на ходу сигналами SIGTTIN (+1)
+и SIGTTOU (-1): при согласованном хешировании к другому воркеру переходит только около 1/N чатов. Лишний воркер
+не убивается, а дорабатывает уже полученные обновления и задачи (не дольше SUPERVISOR_DRAIN_TIMEOUT секунд)
+и завершается; так же все воркеры завершаются по SIGTERM и Ctrl+C. Чтобы перешедшие чаты не теряли сессии,
+при нескольких воркерах стоит хранить сессии в общем файле SQLite (SESSION_DB).
+"""
+import bisect
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from telebot import apihelper
+
+
+TOKEN = os.environ['TOKEN']
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '').rstrip('/')
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL + '/bot{0}/{1}'
+
+WORKERS = int(os.environ.get('SUPERVISOR_WORKERS', os.cpu_count() or 1))
+BOT_MODULE = os.environ.get('SUPERVISOR_BOT', 'bot')  # bot или async_bot
+DRAIN_TIMEOUT = float(os.environ.get('SUPERVISOR_DRAIN_TIMEOUT', 60))
+HASH_REPLICAS = 100  # точек каждого воркера на кольце: чем больше, тем ровнее делятся чаты
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+POLLING_TIMEOUT = 20
+
+# вебхук: Telegram присылает обновления на WEBHOOK_URL, супервизор слушает WEBHOOK_LISTEN (HTTPS обычно
+# завершает обратный прокси перед ним), WEBHOOK_SECRET проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0:8080')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+
+# воркер, упавший быстрее чем за STABLE_UPTIME секунд после старта, перезапускается с паузой 1, 2, 4... до 30 с
+STABLE_UPTIME = 10
+MAX_RESTART_DELAY = 30
+
+
+def stable_hash(value):
+    """ 64-битный хеш строки, одинаковый во всех процессах и запусках (в отличие от hash). """
+
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """ Кольцо согласованного хеширования: каждый узел занимает replicas точек, ключ принадлежит узлу
+    с ближайшей точкой по часовой стрелке. При добавлении или удалении узла меняют узел только ключи,
+    попавшие на его точки. """
+
+    def __init__(self, nodes, replicas=HASH_REPLICAS):
+        points = sorted((stable_hash(f'{node}-{replica}'), node) for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        index = bisect.bisect(self._hashes, stable_hash(str(key)))
+        return self._nodes[index % len(self._nodes)]
+
+
+def update_chat_id(update):
+    """ chat_id обновления (сообщения, нажатия кнопки и т. п.); для обновлений без чата - id пользователя,
+    для совсем анонимных - 0. """
+
+    for field, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        if 'chat' in value:
+            return value['chat']['id']
+        if isinstance(value.get('message'), dict):
+            return value['message']['chat']['id']
+        if 'from' in value:
+            return value['from']['id']
+    return 0
+
+
+def run_worker(index, updates, bot_module, send_rate):
+    """ Точка входа процесса-воркера: обрабатывает обновления из очереди updates, пока не получит ('stop', None). """
+
+    # у каждого воркера свой порт метрик: METRICS_PORT + номер воркера
+    if os.environ.get('METRICS_PORT'):
+        os.environ['METRICS_PORT'] = str(int(os.environ['METRICS_PORT']) + index)
+    # Ctrl+C получает вся группа процессов, а остановкой воркеров управляет супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    module = importlib.import_module(bot_module)
+    import metrics
+    metrics.start_server_from_env()
+    module.send_queue.set_global_rate(send_rate)
+    if bot_module == 'async_bot':
+        import asyncio
+        asyncio.run(serve_async(module, updates))
+    else:
+        serve_sync(module, updates)
+
+
+def serve_sync(module, updates):
+    from telebot import types
+
+    bot = module.bot
+    # обработчики выполняются в нашем пуле, чтобы перед остановкой можно было дождаться их завершения
+    bot.threaded = False
+    handlers = ThreadPoolExecutor(max_workers=bot.worker_pool.num_threads, thread_name_prefix='handler')
+
+    def process(update):
+        try:
+            bot.process_new_updates([types.Update.de_json(update)])
+        except Exception:
+            traceback.print_exc()
+
+    while True:
+        kind, value = updates.get()
+        if kind == 'update':
+            handlers.submit(process, value)
+        elif kind == 'rate':
+            module.send_queue.set_global_rate(value)
+        else:
+            break
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    handlers.shutdown(wait=True)
+    # альбомы ждут остальные фото ALBUM_WAIT секунд, после этого их задачи уже в планировщике
+    while module.pending_albums and time.monotonic() < deadline:
+        time.sleep(0.1)
+    module.job_scheduler.wait_idle(max(0.0, deadline - time.monotonic()))
+
+
+async def serve_async(module, updates):
+    import asyncio
+    from telebot import types
+
+    bot = module.bot
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    while True:
+        kind, value = await loop.run_in_executor(None, updates.get)
+        if kind == 'update':
+            task = asyncio.create_task(bot.process_new_updates([types.Update.de_json(value)]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        elif kind == 'rate':
+            module.send_queue.set_global_rate(value)
+        else:
+            break
+
+    async def drain():
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while module.pending_albums:
+            await asyncio.sleep(0.1)
+        await module.job_scheduler.wait_idle()
+
+    try:
+        await asyncio.wait_for(drain(), DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    await bot.close_session()
+
+
+def move_updates(source, target, timeout=0.1):
+    """ Переносит сообщения из очереди source в target в том же порядке и возвращает их число. Останавливается,
+    когда source пуста (ждет не дольше timeout секунд, пока фоновый поток супервизора допишет ее буфер),
+    когда блокировку чтения держит упавший процесс или когда канал поврежден оборванным чтением. """
+
+    moved = 0
+    while True:
+        try:
+            message = source.get(timeout=timeout)
+        except queue.Empty:
+            return moved
+        except Exception:
+            traceback.print_exc()
+            return moved
+        target.put(message)
+        moved += 1
+
+
+class Worker:
+    """ Слот воркера: номер на кольце и очередь обновлений процесса (у перезапущенного процесса - новая). """
+
+    __slots__ = ('index', 'updates', 'process', 'started', 'failures', 'restart_at')
+
+    def __init__(self, index, updates):
+        self.index = index
+        self.updates = updates
+        self.process = None
+        self.started = 0.0
+        self.failures = 0  # подряд упавших сразу после старта
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    def __init__(self, workers=WORKERS, bot_module=BOT_MODULE):
+        self.bot_module = bot_module
+        self.target = workers
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = {}  # номер -> Worker
+        self._retiring = []  # процессы, которые дорабатывают свои обновления
+        self._ring = None
+        self._lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def send_rate(self):
+        return SEND_GLOBAL_RATE / max(1, len(self._workers))
+
+    def route(self, update):
+        """ Передает обновление (словарь из JSON Bot API) воркеру его чата. """
+
+        with self._lock:
+            worker = self._workers[self._ring.node(update_chat_id(update))]
+            worker.updates.put(('update', update))
+
+    def rebalance(self):
+        """ Приводит число воркеров к target: новые получают свою часть кольца сразу, лишние (с большими
+        номерами) перестают получать обновления и дорабатывают очередь. """
+
+        with self._lock:
+            count = max(1, self.target)
+            if count == len(self._workers):
+                return
+            for index in range(len(self._workers), count):
+                self._workers[index] = Worker(index, self._context.Queue())
+            retired = [self._workers.pop(index) for index in sorted(self._workers) if index >= count]
+            self._ring = HashRing(sorted(self._workers))
+            rate = self.send_rate()
+            for worker in self._workers.values():
+                if worker.process is None:
+                    self._start(worker)
+                else:
+                    worker.updates.put(('rate', rate))
+            for worker in retired:
+                self._retire(worker)
+        print(f'Воркеров: {count}')
+
+    def check(self):
+        """ Перезапускает упавшие воркеры и забывает завершившиеся после остановки. """
+
+        with self._lock:
+            now = time.monotonic()
+            self._retiring = [process for process in self._retiring if process.is_alive()]
+            for worker in self._workers.values():
+                if worker.process.is_alive():
+                    continue
+                if not worker.restart_at:
+                    uptime = now - worker.started
+                    worker.failures = worker.failures + 1 if uptime < STABLE_UPTIME else 0
+                    delay = min(MAX_RESTART_DELAY, 2 ** worker.failures - 1)
+                    worker.restart_at = now + delay
+                    print(f'Воркер {worker.index} завершился с кодом {worker.process.exitcode}, '
+                          f'перезапуск через {delay} с')
+                if now >= worker.restart_at:
+                    self._start(worker)
+
+    def monitor(self):
+        """ Поток наблюдения: раз в секунду применяет новое число воркеров и перезапускает упавшие. """
+
+        while not self.stopping.wait(1.0):
+            self.rebalance()
+            self.check()
+
+    def shutdown(self):
+        """ Останавливает все воркеры, дав им доработать полученные обновления. """
+
+        self.stopping.set()
+        with self._lock:
+            for worker in self._workers.values():
+                self._retire(worker)
+            self._workers.clear()
+            retiring, self._retiring = self._retiring, []
+        for process in retiring:
+            process.join(DRAIN_TIMEOUT + 10)
+            if process.is_alive():
+                process.terminate()
+
+    def _start(self, worker):
+        if worker.process is not None:
+            # упавший процесс мог умереть внутри updates.get(), так и не отпустив блокировку чтения очереди,
+            # поэтому новый процесс читает новую очередь, а в нее переносится то, что осталось в старой
+            old, worker.updates = worker.updates, self._context.Queue()
+            moved = move_updates(old, worker.updates)
+            if moved:
+                print(f'Воркеру {worker.index} передано {moved} обновлений из очереди упавшего процесса')
+            # поток записи старой очереди может висеть на полном канале без читателя - не ждем его
+            old.cancel_join_thread()
+            old.close()
+        worker.process = self._context.Process(target=run_worker, name=f'worker-{worker.index}',
+                                               args=(worker.index, worker.updates, self.bot_module, self.send_rate()))
+        worker.process.start()
+        worker.started = time.monotonic()
+        worker.restart_at = 0.0
+
+    def _retire(self, worker):
+        if not worker.process.is_alive():
+            # упавший воркер ждал перезапуска: обновления из его очереди все равно нужно обработать
+            self._start(worker)
+        worker.updates.put(('stop', None))
+        self._retiring.append(worker.process)
+
+
+def poll(supervisor):
+    """ Получает обновления через getUpdates и распределяет их по воркерам. """
+
+    apihelper.delete_webhook(TOKEN)
+    offset = None
+    while not supervisor.stopping.is_set():
+        try:
+            updates = apihelper.get_updates(TOKEN, offset, 100, long_polling_timeout=POLLING_TIMEOUT)
+        except Exception:
+            traceback.print_exc()
+            time.sleep(1)
+            continue
+        for update in updates:
+            supervisor.route(update)
+            offset = update['update_id'] + 1
+
+
+def serve_webhook(supervisor):
+    """ Принимает обновления вебхуком на WEBHOOK_LISTEN и распределяет их по воркерам. """
+
+    path = urlparse(WEBHOOK_URL).path or '/'
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != path or (WEBHOOK_SECRET and
+                                     self.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET):
+                self.send_error(403)
+                return
+            try:
+                update = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                self.send_error(400)
+                return
+            supervisor.route(update)
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    host, port = WEBHOOK_LISTEN.rsplit(':', 1)
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    apihelper.set_webhook(TOKEN, url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    threading.Thread(target=lambda: supervisor.stopping.wait() or server.shutdown(), daemon=True).start()
+    server.serve_forever()
+
+
+def resize_handler(change):
+    def handler(signum, frame):
+        supervisor.target = max(1, supervisor.target + change)
+
+    return handler
+
+
+def stop_handler(signum, frame):
+    raise KeyboardInterrupt
+
+
+if __name__ == '__main__':
+    supervisor = Supervisor()
+    supervisor.rebalance()
+    signal.signal(signal.SIGTTIN, resize_handler(1))
+    signal.signal(signal.SIGTTOU, resize_handler(-1))
+    signal.signal(signal.SIGTERM, stop_handler)
+    threading.Thread(target=supervisor.monitor, name='monitor', daemon=True).start()
+    try:
+        if WEBHOOK_URL:
+            serve_webhook(supervisor)
+        else:
+            poll(supervisor)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.shutdown()
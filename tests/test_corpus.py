@@ -0,0 +1,83 @@
+import mmap
+import os
+
+import pytest
+
+from corpus import Corpus, build_index, deal, permute
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 16, 17, 100, 1000, 4097])
+@pytest.mark.parametrize('seed', [0, 1, 12345, 2 ** 61 + 7])
+def test_permute_is_a_permutation(size, seed):
+    assert sorted(permute(index, size, seed) for index in range(size)) == list(range(size))
+
+
+def test_permute_depends_on_seed():
+    orders = {tuple(permute(index, 50, seed) for index in range(50)) for seed in range(10)}
+    assert len(orders) == 10
+
+
+def test_deal_has_no_repeats_until_the_deck_is_exhausted():
+    deck = None
+    dealt = []
+    for _ in range(37):
+        index, deck = deal(deck, 37)
+        dealt.append(index)
+    assert sorted(dealt) == list(range(37))
+    # колода пройдена - следующая запись берется из новой перетасовки
+    index, deck = deal(deck, 37)
+    assert 0 <= index < 37 and deck[1] == 1
+
+
+def test_deal_reshuffles_when_corpus_size_changes():
+    _, deck = deal(None, 10)
+    _, deck = deal(deck, 10)
+    index, new_deck = deal(deck, 12)
+    assert 0 <= index < 12
+    assert new_deck[1:] == [1, 12]
+
+
+def test_build_index_skips_separators_and_empty_entries():
+    data = b'%\nfirst\n%\n\n%\nsecond\nline\n%  \r\nthird'
+    offsets = build_index(data)
+    entries = [data[offsets[i]:offsets[i + 1]].strip() for i in range(0, len(offsets), 2)]
+    assert entries == [b'first', b'second\nline', b'third']
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text)
+
+
+def test_corpus_reloads_atomically_replaced_file_as_mapping(tmp_path):
+    path = tmp_path / 'jokes.txt'
+    write(path, 'one\n%\ntwo')
+    corpus = Corpus(str(path), check_interval=0)
+    assert [corpus.view()[i] for i in range(len(corpus))] == ['one', 'two']
+    assert isinstance(corpus.view().data, mmap.mmap)
+
+    write(tmp_path / 'jokes.tmp', 'three')
+    os.replace(tmp_path / 'jokes.tmp', path)
+    view = corpus.view()
+    assert len(view) == 1 and view[0] == 'three'
+    assert isinstance(view.data, mmap.mmap)
+
+
+def test_corpus_reads_file_rewritten_in_place_into_memory(tmp_path):
+    path = tmp_path / 'jokes.txt'
+    write(path, 'one\n%\ntwo\n%\nthree')
+    corpus = Corpus(str(path), check_interval=0)
+    assert len(corpus) == 3
+
+    write(path, 'four')
+    view = corpus.view()
+    assert len(view) == 1 and view[0] == 'four'
+    assert isinstance(view.data, bytes)
+
+
+def test_missing_file_gives_empty_corpus(tmp_path):
+    path = tmp_path / 'missing.txt'
+    corpus = Corpus(str(path), check_interval=0)
+    assert len(corpus) == 0
+    write(path, 'hello')
+    assert corpus.view()[0] == 'hello'
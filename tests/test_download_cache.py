@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+import download_cache
+from download_cache import DownloadCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(download_cache.time, 'time', clock)
+    return clock
+
+
+def test_lru_eviction_keeps_byte_budget(clock):
+    cache = DownloadCache(max_bytes=30)
+    cache.put('a', b'a' * 10)
+    cache.put('b', b'b' * 10)
+    cache.put('c', b'c' * 10)
+    # обращение к a делает давно не использованной запись b
+    assert cache.get('a') == b'a' * 10
+    cache.put('d', b'd' * 10)
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in 'acd'] == [True, True, True]
+    assert cache.stats()['bytes'] == 30
+
+
+def test_entry_larger_than_budget_is_not_kept(clock):
+    cache = DownloadCache(max_bytes=10)
+    cache.put('small', b'x' * 5)
+    cache.put('big', b'y' * 11)
+    assert cache.get('big') is None
+    assert cache.get('small') == b'x' * 5
+
+
+def test_ttl_expiry(clock):
+    cache = DownloadCache(ttl=60)
+    cache.put('a', b'data')
+    clock.now += 60
+    assert cache.get('a') == b'data'
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_same_unique_id_is_downloaded_and_stored_once(clock):
+    cache = DownloadCache()
+    downloads = []
+
+    def download():
+        downloads.append(1)
+        return b'photo'
+
+    assert cache.get_or_download('unique', download) == b'photo'
+    assert cache.get_or_download('unique', download) == b'photo'
+    cache.put('unique', b'photo')
+    assert len(downloads) == 1
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['hits'], stats['misses']) == (1, 5, 1, 1)
+
+
+def test_disk_tier_survives_restart_and_promotes_to_memory(tmp_path, clock):
+    DownloadCache(disk_dir=str(tmp_path)).put('unique', b'photo')
+    cache = DownloadCache(disk_dir=str(tmp_path))
+    assert cache.get('unique') == b'photo'
+    assert cache.get('unique') == b'photo'
+    stats = cache.stats()
+    assert (stats['disk_hits'], stats['hits'], stats['entries']) == (1, 1, 1)
+
+
+def test_disk_tier_expires_by_last_use(tmp_path, clock):
+    DownloadCache(disk_dir=str(tmp_path), ttl=60).put('unique', b'photo')
+    path = os.path.join(tmp_path, 'unique.bin')
+    os.utime(path, (clock.now - 61, clock.now - 61))
+    assert DownloadCache(disk_dir=str(tmp_path), ttl=60).get('unique') is None
+    assert not os.path.exists(path)
+
+
+def test_disk_tier_drops_least_recently_used_files(tmp_path):
+    cache = DownloadCache(disk_dir=str(tmp_path), disk_max_bytes=35)
+    now = time.time()
+    for index, key in enumerate('abc'):
+        cache.put(key, key.encode() * 10)
+        # время изменения файлов задает порядок использования: a - самый старый (но все моложе ttl)
+        os.utime(os.path.join(tmp_path, f'{key}.bin'), (now - 100 + index, now - 100 + index))
+    # попадание в дисковый уровень (у другого процесса память пуста) отмечает использование файла
+    assert DownloadCache(disk_dir=str(tmp_path), disk_max_bytes=35).get('a') == b'a' * 10
+    cache.put('d', b'd' * 10)
+    # после переполнения остается не больше 90% бюджета: самым старым стал файл b
+    assert sorted(os.listdir(tmp_path)) == ['a.bin', 'c.bin', 'd.bin']
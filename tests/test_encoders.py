@@ -0,0 +1,78 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from encoders import ENCODER_POLICY, JPEG_POLICY, encode_jpeg, encode_result, encoder_policy, is_sticker, save
+
+
+def noise(size=(400, 300), seed=1):
+    generator = random.Random(seed)
+    return Image.frombytes('RGB', size, bytes(generator.getrandbits(8) for _ in range(size[0] * size[1] * 3)))
+
+
+def jpeg(image, quality):
+    return save(image, 'JPEG', quality=quality, optimize=True, progressive=True)
+
+
+def opened(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_small_result_keeps_default_quality():
+    image = noise((40, 30))
+    assert encode_jpeg(image, 75, max_bytes=10 ** 6) == jpeg(image, 75)
+
+
+def test_quality_search_picks_highest_quality_within_budget():
+    image = noise()
+    max_bytes = len(jpeg(image, 60))
+    data = encode_jpeg(image, 75, max_bytes=max_bytes, min_quality=40)
+    assert len(data) <= max_bytes
+    # двоичный поиск находит то же качество, что и перебор сверху вниз
+    expected = next(jpeg(image, quality) for quality in range(74, 39, -1) if len(jpeg(image, quality)) <= max_bytes)
+    assert data == expected
+
+
+def test_quality_never_drops_below_minimum():
+    image = noise()
+    data = encode_jpeg(image, 75, max_bytes=1000, min_quality=40)
+    assert data == jpeg(image, 40)
+    assert len(data) > 1000
+
+
+def test_jpeg_policy_limits_size():
+    assert encoder_policy('negative') is JPEG_POLICY
+    image = noise((1200, 900))
+    data = encode_result(image, 'negative')
+    assert len(data) <= JPEG_POLICY['max_bytes']
+    assert opened(data).format == 'JPEG' and opened(data).info.get('progressive')
+
+
+def test_jpeg_converts_transparent_and_palette_images():
+    for image in (noise().convert('RGBA'), noise().convert('P')):
+        assert opened(encode_jpeg(image)).mode == 'RGB'
+
+
+def test_pixelate_is_palette_png():
+    assert ENCODER_POLICY['pixelate']['format'] == 'PNG'
+    result = opened(encode_result(noise().resize((20, 15)).resize((400, 300), Image.Resampling.NEAREST), 'pixelate'))
+    assert (result.format, result.mode, result.size) == ('PNG', 'P', (400, 300))
+
+
+def test_ascii_color_is_palette_png():
+    result = opened(encode_result(noise(), 'ascii_color'))
+    assert (result.format, result.mode) == ('PNG', 'P')
+
+
+@pytest.mark.parametrize('size, expected', [
+    ((1000, 600), (512, 307)),
+    # маленькое фото увеличивается: у стикера большая сторона ровно 512
+    ((200, 400), (256, 512)),
+    ((512, 100), (512, 100)),
+])
+def test_resize_is_512_px_webp_sticker(size, expected):
+    assert is_sticker('resize') and not is_sticker('pixelate')
+    result = opened(encode_result(noise(size), 'resize'))
+    assert (result.format, result.size) == ('WEBP', expected)
@@ -0,0 +1,76 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from media_assets import MediaAssets
+
+os.environ.setdefault('TOKEN', '1:test')
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'coin.mp4'
+    path.write_bytes(b'video' * 100)
+    return path
+
+
+def test_file_id_survives_restart(tmp_path, video):
+    store = tmp_path / 'media_ids.json'
+    MediaAssets({'coin': str(video)}, str(store)).remember('coin', 'file-1')
+    assert MediaAssets({'coin': str(video)}, str(store)).file_id('coin') == 'file-1'
+    # временных файлов от сохранения не остается
+    assert sorted(os.listdir(tmp_path)) == ['coin.mp4', 'media_ids.json']
+
+
+def test_missing_store_starts_empty(tmp_path, video):
+    assets = MediaAssets({'coin': str(video)}, str(tmp_path / 'missing.json'))
+    assert assets.file_id('coin') is None
+
+
+def test_corrupt_store_starts_empty_and_is_rewritten(tmp_path, video):
+    store = tmp_path / 'media_ids.json'
+    store.write_text('{"coin": {"file_id": ', encoding='utf-8')
+    assets = MediaAssets({'coin': str(video)}, str(store))
+    assert assets.file_id('coin') is None
+    assets.remember('coin', 'file-2')
+    assert json.loads(store.read_text(encoding='utf-8'))['coin']['file_id'] == 'file-2'
+
+
+def test_changed_video_is_uploaded_again(tmp_path, video):
+    store = tmp_path / 'media_ids.json'
+    MediaAssets({'coin': str(video)}, str(store)).remember('coin', 'file-1')
+    video.write_bytes(b'another video')
+    assert MediaAssets({'coin': str(video)}, str(store)).file_id('coin') is None
+
+
+def test_missing_video_keeps_saved_file_id(tmp_path, video):
+    store = tmp_path / 'media_ids.json'
+    MediaAssets({'coin': str(video)}, str(store)).remember('coin', 'file-1')
+    video.unlink()
+    assert MediaAssets({'coin': str(video)}, str(store)).file_id('coin') == 'file-1'
+
+
+def test_rejected_file_id_falls_back_to_upload(tmp_path, video, monkeypatch):
+    import bot
+
+    store = tmp_path / 'media_ids.json'
+    assets = MediaAssets({'coin': str(video)}, str(store))
+    assets.remember('coin', 'stale')
+    sent = []
+
+    def send_video(chat_id, video_file, timeout=None):
+        if isinstance(video_file, str):
+            sent.append(video_file)
+            raise ApiTelegramException('sendVideo', None, {'error_code': 400, 'description': 'wrong file identifier'})
+        sent.append(video_file.read())
+        return SimpleNamespace(video=SimpleNamespace(file_id='fresh'))
+
+    monkeypatch.setattr(bot, 'media_assets', assets)
+    monkeypatch.setattr(bot.bot, 'send_video', send_video)
+    bot.send_video_asset(1, 'coin')
+    assert sent == ['stale', b'video' * 100]
+    assert assets.file_id('coin') == 'fresh'
+    assert MediaAssets({'coin': str(video)}, str(store)).file_id('coin') == 'fresh'
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot_common import JOB_CALLBACKS, operation_params, photo_for_operation
+from photo_sizes import document_sizes, photo_sizes, pick_photo_size
+from sessions import Session
+
+
+DOCUMENT = SimpleNamespace(file_id='doc', file_unique_id='doc-unique')
+PHOTO = [SimpleNamespace(file_id=f'id{side}', file_unique_id=f'unique{side}', width=side, height=side * 3 // 4)
+         for side in (90, 320, 800, 1280, 2560)]
+
+
+@pytest.mark.parametrize('operation', sorted(set(JOB_CALLBACKS.values())))
+def test_document_has_single_variant_for_every_operation(operation):
+    sizes = document_sizes(DOCUMENT)
+    session = Session(1, sizes=sizes, pipeline=('resize', 'pixelate'))
+    params = operation_params(session, operation)
+    assert photo_for_operation(sizes, operation, params) == ('doc', 'doc-unique')
+
+
+@pytest.mark.parametrize('steps', [['resize'], ['pixelate'], ['pixelate', 'resize'], ['negative']])
+def test_document_pipeline_does_not_divide_by_unknown_size(steps):
+    assert pick_photo_size(document_sizes(DOCUMENT), 'pipeline', steps=steps)[0] == 'doc'
+
+
+def test_smallest_sufficient_photo_variant():
+    sizes = photo_sizes(PHOTO)
+    # стикеру нужно 512 пикселей по большей стороне
+    assert pick_photo_size(sizes, 'resize')[0] == 'id800'
+    # ASCII-арту из 40 символов хватает 80 пикселей в ширину
+    assert pick_photo_size(sizes, 'ascii', ascii_width=40)[0] == 'id90'
+    assert pick_photo_size(sizes, 'negative')[0] == 'id2560'
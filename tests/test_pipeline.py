@@ -0,0 +1,82 @@
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from pipeline import run_pipeline
+from transforms import apply_operation
+
+
+PIXEL_SIZE = 20
+SEQUENTIAL = {
+    'resize': ('resize', {}),
+    'pixelate': ('pixelate', {'pixel_size': PIXEL_SIZE}),
+    'mirror_h': ('mirror', {'horizontal': True}),
+    'mirror_v': ('mirror', {'horizontal': False}),
+    'negative': ('negative', {}),
+    'heatmap': ('heatmap', {}),
+}
+
+
+def gradient(size=(1000, 700)):
+    """ Гладкое изображение без симметрий: разный порядок шагов меняет только детали интерполяции. """
+
+    return Image.merge('RGB', [Image.linear_gradient('L').resize(size),
+                               Image.linear_gradient('L').rotate(90).resize(size),
+                               Image.radial_gradient('L').resize(size)])
+
+
+def sequential(image, steps):
+    """ Шаги цепочки по одному, как отдельные нажатия кнопок. """
+
+    for step in steps:
+        operation, params = SEQUENTIAL[step]
+        image = apply_operation(image, operation, params)
+    return image
+
+
+def mean_difference(first, second):
+    return max(ImageStat.Stat(ImageChops.difference(first, second.convert(first.mode))).mean)
+
+
+@pytest.mark.parametrize('steps', [
+    ['resize', 'pixelate'],
+    ['mirror_h', 'mirror_h', 'negative'],
+    ['heatmap', 'pixelate'],
+    ['mirror_v', 'negative', 'mirror_v', 'heatmap'],
+    ['pixelate', 'negative', 'mirror_h'],
+])
+def test_reordered_pipeline_equals_sequential_steps(steps):
+    image = gradient()
+    result = run_pipeline(image.copy(), steps, PIXEL_SIZE)
+    expected = sequential(image, steps)
+    assert result.size == expected.size
+    assert mean_difference(result, expected) < 0.01
+
+
+@pytest.mark.parametrize('steps', [
+    # resize выполняется первым, а сетка пикселизации считается от полного размера
+    ['pixelate', 'resize'],
+    # отражение переносится на сетку блоков, поэтому блоки выбираются с другого края
+    ['mirror_h', 'pixelate', 'mirror_v'],
+    ['negative', 'resize', 'mirror_v'],
+])
+def test_pipeline_differs_from_sequential_only_by_interpolation(steps):
+    image = gradient()
+    result = run_pipeline(image.copy(), steps, PIXEL_SIZE)
+    expected = sequential(image, steps)
+    assert result.size == expected.size
+    assert mean_difference(result, expected) < 2
+
+
+def test_mirrors_cancel_by_parity():
+    image = gradient((64, 48))
+    assert run_pipeline(image, ['mirror_h', 'mirror_v', 'mirror_h', 'mirror_v']).tobytes() == image.tobytes()
+    flipped = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    assert run_pipeline(image, ['mirror_h', 'mirror_h', 'mirror_h']).tobytes() == flipped.tobytes()
+
+
+def test_reduced_copy_gives_full_size_result():
+    image = gradient()
+    reduced = image.resize((250, 175))
+    steps = ['pixelate', 'negative']
+    result = run_pipeline(reduced, steps, PIXEL_SIZE, output_size=image.size)
+    assert result.size == run_pipeline(image, steps, PIXEL_SIZE).size == (1000, 700)
@@ -0,0 +1,51 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from photo_sizes import required_size, size_params
+from transforms import run_transform
+
+
+@pytest.fixture(scope='module')
+def noise_jpeg():
+    """ Шум без гладких областей: соседние блоки пикселизации почти никогда не совпадают по цвету. """
+
+    rng = random.Random(1)
+    image = Image.frombytes('RGB', (800, 600), bytes(rng.getrandbits(8) for _ in range(800 * 600 * 3)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def equal_neighbours(image, pixel_size):
+    """ Доля пар соседних по горизонтали блоков почти одного цвета (JPEG цепочки немного искажает цвета). """
+
+    grid = image.convert('RGB').resize((image.width // pixel_size, image.height // pixel_size),
+                                       Image.Resampling.NEAREST)
+    pixels = grid.load()
+
+    def close(left, right):
+        return sum(abs(a - b) for a, b in zip(left, right)) < 30
+
+    pairs = [(pixels[x, y], pixels[x + 1, y]) for y in range(grid.height) for x in range(grid.width - 1)]
+    return sum(close(left, right) for left, right in pairs) / len(pairs)
+
+
+def test_required_size_follows_pixel_size():
+    assert required_size('pixelate', 1600, 1200, **size_params('pixelate', {'pixel_size': 4})) == (400, 300)
+    params = {'steps': ['pixelate', 'negative'], 'pixel_size': 4}
+    assert required_size('pipeline', 1600, 1200, **size_params('pipeline', params)) == (400, 300)
+    assert required_size('pixelate', 1600, 1200, **size_params('pixelate', {})) == (80, 60)
+
+
+@pytest.mark.parametrize('operation, params', [
+    ('pixelate', {'pixel_size': 4}),
+    ('pipeline', {'steps': ['pixelate'], 'pixel_size': 4}),
+])
+def test_blocks_have_requested_size(noise_jpeg, operation, params):
+    result = Image.open(io.BytesIO(run_transform(operation, noise_jpeg, params)))
+    assert result.size == (800, 600)
+    # если бы JPEG был декодирован слишком мелко, один пиксель исходника растянулся бы на несколько блоков
+    assert equal_neighbours(result, 4) < 0.3
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+from PIL import Image, ImageOps
+
+from point_ops import COLORMAPS, apply_point_ops, colormap_palette, compile_point_ops
+
+
+def noise(mode='RGB', size=(37, 23), seed=1):
+    generator = random.Random(seed)
+    bands = len(Image.new(mode, (1, 1)).getbands())
+    return Image.frombytes(mode, size, bytes(generator.randrange(256) for _ in range(size[0] * size[1] * bands)))
+
+
+def per_pixel(image, operations):
+    """ Прежняя реализация: каждая операция отдельным вызовом ImageOps / convert. """
+
+    for operation in operations:
+        if operation == 'negative':
+            image = ImageOps.invert(image)
+        elif operation == 'posterize':
+            image = ImageOps.posterize(image, 3)
+        elif operation == 'grayscale':
+            image = image.convert('L')
+        elif operation == 'heatmap':
+            image = ImageOps.colorize(image.convert('L'), black='blue', white='red', mid='green')
+    return image
+
+
+@pytest.mark.parametrize('operations', [
+    ['negative'], ['grayscale'], ['posterize'], ['heatmap'],
+    ['negative', 'negative'], ['posterize', 'negative'], ['negative', 'grayscale'], ['grayscale', 'negative'],
+    ['posterize', 'grayscale', 'posterize'], ['heatmap', 'negative'], ['heatmap', 'grayscale', 'heatmap'],
+    ['negative', 'posterize', 'grayscale', 'negative', 'heatmap'],
+])
+def test_lut_matches_per_pixel_operations(operations):
+    image = noise()
+    assert apply_point_ops(image, operations).tobytes() == per_pixel(image, operations).tobytes()
+
+
+def test_chain_compiles_to_single_lut():
+    plan = compile_point_ops(('negative', 'posterize', 'negative'))
+    assert not plan.gray and plan.palette is None
+    assert len(plan.color_lut) == 256
+
+
+def test_alpha_channel_is_kept():
+    image = noise('RGBA')
+    result = apply_point_ops(image, ['negative'])
+    assert result.mode == 'RGBA'
+    assert result.getchannel('A').tobytes() == image.getchannel('A').tobytes()
+    assert result.convert('RGB').tobytes() == ImageOps.invert(image.convert('RGB')).tobytes()
+
+
+def test_palette_image_inverts_palette_only():
+    image = noise().quantize(16)
+    result = apply_point_ops(image, ['negative'])
+    assert result.mode == 'P'
+    assert result.tobytes() == image.tobytes()
+    assert result.convert('RGB').tobytes() == ImageOps.invert(image.convert('RGB')).tobytes()
+
+
+@pytest.mark.parametrize('name', sorted(COLORMAPS))
+def test_colormap_palettes_are_complete(name):
+    palette = colormap_palette(name)
+    assert len(palette) == 768
+    if COLORMAPS[name] is not None:
+        assert tuple(palette[:3]) == COLORMAPS[name][0][1]
+        assert tuple(palette[-3:]) == COLORMAPS[name][-1][1]
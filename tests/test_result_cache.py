@@ -0,0 +1,100 @@
+import os
+import sqlite3
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import result_cache
+from result_cache import ResultCache, result_key
+
+os.environ.setdefault('TOKEN', '1:test')
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, 'time', clock)
+    return clock
+
+
+def test_key_covers_photo_operation_and_params():
+    assert result_key('u1', 'pixelate', {'a': 1, 'b': 2}) == result_key('u1', 'pixelate', {'b': 2, 'a': 1})
+    keys = {result_key('u1', 'pixelate', {'pixel_size': 20}), result_key('u2', 'pixelate', {'pixel_size': 20}),
+            result_key('u1', 'negative', {'pixel_size': 20}), result_key('u1', 'pixelate', {'pixel_size': 10})}
+    assert len(keys) == 4
+
+
+def test_hit_and_miss():
+    cache = ResultCache()
+    key = result_key('u1', 'heatmap', {'colormap': 'viridis'})
+    assert cache.get(key) is None
+    cache.put(key, 'photo', 'file-id')
+    assert cache.get(key) == ('photo', 'file-id')
+    assert cache.get(result_key('u1', 'heatmap', {})) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 1)
+
+
+def test_memory_budget_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=20)
+    cache.put('a', 'photo', '123456789')
+    cache.put('b', 'photo', '123456789')
+    cache.get('a')
+    cache.put('c', 'photo', '123456789')
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+
+
+def test_load_restores_recency_and_deletes_evicted_rows(tmp_path, clock):
+    path = str(tmp_path / 'results.db')
+    cache = ResultCache(path)
+    for key in 'abc':
+        clock.now += 1
+        cache.put(key, 'photo', '123456789')
+    clock.now += 1
+    # попадание пишется в файл не сразу, а при закрытии (или пачкой вместе со следующей записью)
+    assert cache.get('a') == ('photo', '123456789')
+    cache.close()
+
+    reloaded = ResultCache(path, max_bytes=20)
+    assert reloaded.get('b') is None
+    assert reloaded.get('a') and reloaded.get('c')
+    with sqlite3.connect(path) as connection:
+        assert sorted(key for key, in connection.execute('SELECT key FROM results')) == ['a', 'c']
+    reloaded.close()
+
+
+def test_discard_removes_from_memory_and_file(tmp_path):
+    path = str(tmp_path / 'results.db')
+    cache = ResultCache(path)
+    cache.put('a', 'sticker', 'file-id')
+    cache.discard('a')
+    assert cache.get('a') is None
+    cache.close()
+    assert ResultCache(path).get('a') is None
+
+
+def test_rejected_file_id_is_discarded(monkeypatch):
+    import bot
+
+    cache = ResultCache()
+    monkeypatch.setattr(bot, 'result_cache', cache)
+    key = result_key('u1', 'negative', {})
+    cache.put(key, 'photo', 'stale-file-id')
+
+    def reject(chat_id, kind, value):
+        raise ApiTelegramException('sendPhoto', None, {'error_code': 400, 'description': 'wrong file identifier'})
+
+    monkeypatch.setattr(bot, 'send_stored_result', reject)
+    assert not bot.send_cached_result(1, key)
+    assert cache.get(key) is None
+    # следующая попытка идет мимо кэша: результат будет обработан и загружен заново
+    assert not bot.send_cached_result(1, key)
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+
+import pytest
+
+from scheduler import AsyncJobScheduler, FairQueue, JobScheduler, QueueFull
+
+
+def drain(queue):
+    """ Выдает все задачи по очереди, сразу отмечая каждую выполненной. """
+
+    order = []
+    while True:
+        item = queue.pop()
+        if item is None:
+            return order
+        chat_id, job = item
+        order.append(job)
+        queue.done(chat_id)
+
+
+def test_round_robin_between_chats():
+    queue = FairQueue(chat_queue=10)
+    for index in range(4):
+        queue.push('big', f'big{index}')
+    queue.push('small', 'small0')
+    queue.push('other', 'other0')
+    assert drain(queue) == ['big0', 'small0', 'other0', 'big1', 'big2', 'big3']
+    assert queue.waiting == 0
+
+
+def test_push_reports_jobs_ahead():
+    queue = FairQueue(chat_queue=10)
+    assert queue.push('a', 'a0') == 0
+    assert queue.push('a', 'a1') == 1
+    assert queue.push('a', 'a2') == 2
+    # у b впереди только по одной задаче каждого другого чата
+    assert queue.push('b', 'b0') == 1
+    assert queue.push('b', 'b1') == 3
+
+
+def test_chat_limit_skips_busy_chat():
+    queue = FairQueue(chat_limit=1, chat_queue=10)
+    queue.push('a', 'a0')
+    queue.push('a', 'a1')
+    queue.push('b', 'b0')
+    assert queue.pop() == ('a', 'a0')
+    assert queue.pop() == ('b', 'b0')
+    # a0 еще выполняется, поэтому a1 ждет
+    assert queue.pop() is None
+    assert not queue.can_start('a')
+    queue.done('a')
+    assert queue.pop() == ('a', 'a1')
+
+
+def test_queue_full_per_chat_and_total():
+    queue = FairQueue(chat_queue=2, max_queue=3)
+    queue.push('a', 'a0')
+    queue.push('a', 'a1')
+    with pytest.raises(QueueFull):
+        queue.push('a', 'a2')
+    queue.push('b', 'b0')
+    with pytest.raises(QueueFull):
+        queue.push('c', 'c0')
+    assert queue.waiting == 3
+
+
+def test_job_scheduler_runs_jobs_fairly_and_waits_idle():
+    scheduler = JobScheduler(workers=1, chat_queue=10)
+    gate = threading.Event()
+    order = []
+    assert scheduler.submit('blocker', 'test', gate.wait) == 0
+    for index in range(3):
+        scheduler.submit('a', 'test', order.append, f'a{index}')
+    scheduler.submit('b', 'test', order.append, 'b0')
+    gate.set()
+    assert scheduler.wait_idle(timeout=5)
+    assert order == ['a0', 'b0', 'a1', 'a2']
+
+
+def test_job_scheduler_survives_failing_job(capsys):
+    scheduler = JobScheduler(workers=1)
+    done = []
+    scheduler.submit('a', 'test', lambda: 1 / 0)
+    scheduler.submit('a', 'test', done.append, 'ok')
+    assert scheduler.wait_idle(timeout=5)
+    assert done == ['ok']
+    assert 'ZeroDivisionError' in capsys.readouterr().err
+
+
+def test_job_scheduler_raises_queue_full():
+    scheduler = JobScheduler(workers=1, chat_queue=1)
+    started = threading.Event()
+    gate = threading.Event()
+    scheduler.submit('a', 'test', lambda: started.set() or gate.wait())
+    assert started.wait(5)
+    scheduler.submit('a', 'test', gate.wait)
+    with pytest.raises(QueueFull):
+        scheduler.submit('a', 'test', gate.wait)
+    gate.set()
+    assert scheduler.wait_idle(timeout=5)
+
+
+def test_async_job_scheduler_round_robin():
+    async def scenario():
+        scheduler = AsyncJobScheduler(workers=1, chat_queue=10)
+        gate = asyncio.Event()
+        order = []
+
+        async def record(name):
+            order.append(name)
+
+        await scheduler.submit('blocker', 'test', gate.wait)
+        for index in range(3):
+            await scheduler.submit('a', 'test', record, f'a{index}')
+        await scheduler.submit('b', 'test', record, 'b0')
+        gate.set()
+        await asyncio.wait_for(scheduler.wait_idle(), 5)
+        for task in scheduler._tasks:
+            task.cancel()
+        return order
+
+    assert asyncio.run(scenario()) == ['a0', 'b0', 'a1', 'a2']
@@ -0,0 +1,90 @@
+import time
+
+from send_queue import SendQueue, TokenBucket
+
+
+class Response:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self._json = {'parameters': {'retry_after': retry_after}} if retry_after is not None else {}
+
+    def json(self):
+        return self._json
+
+
+def elapsed(function, *args):
+    started = time.monotonic()
+    function(*args)
+    return time.monotonic() - started
+
+
+def test_token_bucket_refills_at_rate_up_to_burst():
+    bucket = TokenBucket(rate=2, burst=3, now=0.0)
+    for _ in range(3):
+        assert bucket.wait_time(0.0) == 0
+        bucket.take()
+    assert bucket.wait_time(0.0) == 0.5
+    assert bucket.wait_time(0.5) == 0
+    # за долгий простой копится не больше burst токенов
+    bucket.wait_time(100.0)
+    assert bucket.tokens == 3
+
+
+def test_blocked_bucket_waits_until_unblocked():
+    bucket = TokenBucket(rate=10, burst=1, now=0.0)
+    bucket.blocked_until = 2.0
+    assert bucket.wait_time(0.5) == 1.5
+    assert not bucket.idle(0.5)
+    assert bucket.idle(2.0)
+
+
+def test_request_is_retried_after_429():
+    queue = SendQueue(global_rate=1000, chat_rate=1000, chat_burst=10)
+    responses = [Response(429, retry_after=0.1), Response(200)]
+    calls = []
+
+    def send(method, url, **kwargs):
+        calls.append(kwargs['params']['chat_id'])
+        return responses.pop(0)
+
+    sender = queue.request_sender(send)
+    started = time.monotonic()
+    assert sender('post', 'https://api/bot1:a/sendMessage', params={'chat_id': 7}).status_code == 200
+    assert calls == [7, 7]
+    assert time.monotonic() - started >= 0.1
+
+
+def test_retries_stop_after_max_retries():
+    queue = SendQueue(global_rate=1000, chat_rate=1000, chat_burst=10, max_retries=2)
+    calls = []
+
+    def send(method, url, **kwargs):
+        calls.append(url)
+        return Response(429, retry_after=0)
+
+    assert queue.request_sender(send)('post', 'https://api/bot1:a/sendPhoto', params={'chat_id': 1}).status_code == 429
+    assert len(calls) == 3
+
+
+def test_methods_outside_lanes_bypass_queue():
+    queue = SendQueue(global_rate=1000)
+    sender = queue.request_sender(lambda method, url, **kwargs: Response(200))
+    assert sender('get', 'https://api/bot1:a/getUpdates', params={}).status_code == 200
+    assert queue._thread is None
+
+
+def test_chat_limit_applies_only_to_sends():
+    queue = SendQueue(global_rate=1000, chat_rate=5, chat_burst=1)
+    queue.acquire('sendPhoto', 1)
+    # лимит чата исчерпан фото, но правка сообщения и индикатор "печатает" его не ждут
+    assert elapsed(queue.acquire, 'editMessageText', 1) < 0.1
+    assert elapsed(queue.acquire, 'sendChatAction', 1) < 0.1
+    assert elapsed(queue.acquire, 'sendMessage', 1) >= 0.1
+    # другой чат лимит первого не задерживает
+    assert elapsed(queue.acquire, 'sendMessage', 2) < 0.1
+
+
+def test_429_blocks_every_method_in_chat():
+    queue = SendQueue(global_rate=1000, chat_rate=1000, chat_burst=10)
+    queue.throttle('sendMessage', 1, 0.2)
+    assert elapsed(queue.acquire, 'editMessageText', 1) >= 0.15
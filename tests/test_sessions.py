@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+import sessions
+from sessions import Session, SessionStore, SqliteSessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions.time, 'time', clock)
+    return clock
+
+
+def full_session(chat_id=42):
+    photo = (('small', 'unique', 90, 60), ('big', 'unique', 1280, 853))
+    return Session(chat_id, sizes=photo, charset='@#.', ascii_width=80, mirror_horizontal=False,
+                   pipeline=('resize', 'negative'), album=(photo, (('doc', 'doc-unique', 0, 0),)),
+                   colormap='viridis', decks={'jokes': [123, 4, 50], 'compliments': [7, 0, 10]})
+
+
+def fields(session):
+    return {name: getattr(session, name) for name in Session.__slots__}
+
+
+def test_sqlite_round_trip_keeps_every_field(tmp_path):
+    store = SqliteSessionStore(str(tmp_path / 'sessions.db'))
+    session = full_session()
+    store.save(session)
+    loaded = store.get(42)
+    assert fields(loaded) == fields(session)
+    assert isinstance(loaded.sizes[0], tuple) and isinstance(loaded.album[1][0], tuple)
+
+
+def test_sqlite_missing_and_expired_sessions_are_empty(tmp_path, clock):
+    store = SqliteSessionStore(str(tmp_path / 'sessions.db'), ttl=60)
+    assert store.get(1).sizes == ()
+    store.save(full_session(1))
+    clock.now += 61
+    assert store.get(1).sizes == ()
+
+
+def test_two_stores_share_one_file(tmp_path):
+    """ Так работают воркеры супервизора с общим SESSION_DB: чат, перешедший к другому воркеру, не теряет сессию. """
+
+    path = str(tmp_path / 'sessions.db')
+    first, second = SqliteSessionStore(path), SqliteSessionStore(path)
+    first.save(full_session(7))
+    assert fields(second.get(7)) == fields(first.get(7))
+    session = second.get(7)
+    session.pipeline = ('pixelate',)
+    second.save(session)
+    assert first.get(7).pipeline == ('pixelate',)
+    assert len(first) == len(second) == 1
+    with sqlite3.connect(path) as connection:
+        assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_sqlite_cleanup_drops_oldest_over_limit(tmp_path, clock):
+    store = SqliteSessionStore(str(tmp_path / 'sessions.db'), max_sessions=3, cleanup_every=5)
+    for chat_id in range(5):
+        clock.now += 1
+        store.save(Session(chat_id))
+    assert sorted(chat_id for chat_id in range(5) if store.get(chat_id).touched) == [2, 3, 4]
+
+
+def test_memory_store_evicts_least_recently_used(clock):
+    store = SessionStore(max_sessions=2)
+    store.save(Session(1))
+    store.save(Session(2))
+    store.get(1)
+    store.save(Session(3))
+    assert len(store) == 2
+    assert store.get(2).touched == 0.0
+    assert store.get(1).touched and store.get(3).touched
+
+
+def test_memory_store_respects_byte_budget(clock):
+    size = full_session().size()
+    store = SessionStore(max_bytes=size * 2 + size // 2)
+    for chat_id in range(5):
+        store.save(full_session(chat_id))
+    assert len(store) == 2
+    assert [chat_id for chat_id in range(5) if store.get(chat_id).touched] == [3, 4]
+
+
+def test_memory_store_ttl(clock):
+    store = SessionStore(ttl=60)
+    store.save(full_session(1))
+    clock.now += 60
+    assert store.get(1).sizes
+    clock.now += 1
+    assert store.get(1).sizes == ()
+    assert len(store) == 0
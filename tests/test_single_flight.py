@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+import metrics
+import single_flight
+from single_flight import SingleFlight
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(single_flight.time, 'monotonic', clock)
+    return clock
+
+
+def coalesced(operation):
+    return metrics.COALESCED._values.get((operation,), 0)
+
+
+def test_duplicate_is_coalesced_while_running_and_during_debounce(clock):
+    flight = SingleFlight(debounce=2.0)
+    before = coalesced('test_running')
+    assert flight.begin('key', 'test_running')
+    assert not flight.begin('key', 'test_running')
+    flight.finish('key')
+    clock.now += 1.9
+    assert not flight.begin('key', 'test_running')
+    assert coalesced('test_running') == before + 2
+    clock.now += 0.2
+    assert flight.begin('key', 'test_running')
+
+
+def test_different_keys_do_not_coalesce(clock):
+    flight = SingleFlight()
+    assert flight.begin(('chat', 1))
+    assert flight.begin(('chat', 2))
+    assert flight.begin(('other', 1))
+
+
+def test_zero_debounce_allows_repeat_right_after_finish(clock):
+    flight = SingleFlight(debounce=0)
+    assert flight.begin('key')
+    assert not flight.begin('key')
+    flight.finish('key')
+    assert flight.begin('key')
+
+
+def test_failed_job_propagates_error_and_releases_key(clock):
+    """ Так задачу оборачивают бот и планировщик: ключ снимается в finally, исключение уходит дальше. """
+
+    flight = SingleFlight(debounce=2.0)
+
+    def job():
+        try:
+            raise RuntimeError('boom')
+        finally:
+            flight.finish('key')
+
+    assert flight.begin('key')
+    with pytest.raises(RuntimeError, match='boom'):
+        job()
+    # повтор сразу после ошибки склеивается, а после debounce обработку можно запустить снова
+    assert not flight.begin('key')
+    clock.now += 2.0
+    assert flight.begin('key')
+
+
+def test_expired_entries_are_dropped_in_finish_order(clock):
+    flight = SingleFlight(debounce=1.0)
+    for key in ('a', 'b', 'c'):
+        assert flight.begin(key)
+        flight.finish(key)
+        clock.now += 0.4
+    # a завершилась 1.2 с назад, b - 0.8 с, c - 0.4 с
+    assert flight.begin('a')
+    assert list(flight._finished) == ['b', 'c']
+    assert not flight.begin('b')
+
+
+def test_concurrent_presses_start_one_job():
+    flight = SingleFlight()
+    barrier = threading.Barrier(16)
+    results = []
+
+    def press():
+        barrier.wait()
+        results.append(flight.begin('key'))
+
+    threads = [threading.Thread(target=press) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+
+os.environ.setdefault('TOKEN', '1:test')
+
+from supervisor import HashRing, move_updates, stable_hash, update_chat_id
+
+
+CHATS = range(-5000, 5000)
+
+
+def owners(ring):
+    return {chat_id: ring.node(chat_id) for chat_id in CHATS}
+
+
+def test_stable_hash_is_deterministic():
+    assert stable_hash('chat-42') == stable_hash('chat-42')
+    assert stable_hash('chat-42') != stable_hash('chat-43')
+    assert HashRing([0, 1, 2]).node(123) == HashRing([2, 1, 0]).node(123)
+
+
+def test_keys_are_spread_evenly():
+    counts = {}
+    for node in owners(HashRing(range(4))).values():
+        counts[node] = counts.get(node, 0) + 1
+    assert set(counts) == {0, 1, 2, 3}
+    # при 100 точках на узел доли отличаются от 1/4 не больше чем на несколько процентов
+    assert all(abs(count / len(CHATS) - 0.25) < 0.07 for count in counts.values())
+
+
+def test_adding_node_moves_only_its_share():
+    before = owners(HashRing(range(4)))
+    after = owners(HashRing(range(5)))
+    moved = [chat_id for chat_id in CHATS if before[chat_id] != after[chat_id]]
+    # чаты переходят только к новому узлу, и их около 1/5
+    assert all(after[chat_id] == 4 for chat_id in moved)
+    assert abs(len(moved) / len(CHATS) - 0.2) < 0.07
+
+
+def test_removing_node_moves_only_its_chats():
+    before = owners(HashRing(range(5)))
+    after = owners(HashRing(range(4)))
+    for chat_id in CHATS:
+        if before[chat_id] != 4:
+            assert after[chat_id] == before[chat_id]
+
+
+def test_update_chat_id():
+    assert update_chat_id({'update_id': 1, 'message': {'chat': {'id': 7}}}) == 7
+    assert update_chat_id({'update_id': 2, 'callback_query': {'from': {'id': 3}, 'message': {'chat': {'id': 8}}}}) == 8
+    assert update_chat_id({'update_id': 3, 'inline_query': {'from': {'id': 9}}}) == 9
+    assert update_chat_id({'update_id': 4}) == 0
+
+
+def test_move_updates_keeps_order():
+    context = multiprocessing.get_context('spawn')
+    source, target = context.Queue(), context.Queue()
+    messages = [('update', {'update_id': index}) for index in range(5)] + [('rate', 10.0)]
+    for message in messages:
+        source.put(message)
+    assert move_updates(source, target, timeout=1.0) == len(messages)
+    assert [target.get(timeout=1.0) for _ in messages] == messages
+    assert move_updates(source, target) == 0
+
+
+def test_move_updates_stops_when_read_lock_is_held():
+    """ Так выглядит очередь, чей читатель умер внутри get(): блокировка чтения не отпущена. """
+
+    context = multiprocessing.get_context('spawn')
+    source, target = context.Queue(), context.Queue()
+    source.put(('update', {'update_id': 1}))
+    source._rlock.acquire()
+    assert move_updates(source, target) == 0
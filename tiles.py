@@ -0,0 +1,64 @@
+""" Обработка изображений горизонтальными полосами, чтобы дополнительная память не зависела от размера изображения.
+
+Полоса - это TILE_PIXELS пикселей (целое число строк). Поточечные операции (негатив, тепловая карта) вырезают
+полосу, преобразуют ее и вставляют в результат; если режим не меняется и исходник больше не нужен (in_place),
+результат пишется прямо в исходное изображение, и кроме него в памяти одновременно держатся только две полосы.
+Пикселизация строит маленькую сетку блоков и увеличивает ее по полосам из целого числа рядов блоков, так что
+полноразмерная промежуточная копия не создается. Результат совпадает с обработкой изображения целиком.
+"""
+import os
+
+from PIL import Image
+
+from point_ops import DEFAULT_COLORMAP, apply_point_ops, compile_point_ops, prepare
+
+
+TILE_PIXELS = int(os.environ.get('TILE_PIXELS', 1024 * 1024))  # сколько пикселей в одной полосе
+
+
+def band_rows(width, multiple=1):
+    """ Высота полосы в строках для изображения шириной width: кратна multiple и не меньше его. """
+
+    rows = max(1, TILE_PIXELS // max(1, width))
+    return max(multiple, rows - rows % multiple)
+
+
+def tiled_point_ops(image, operations, colormap=DEFAULT_COLORMAP, in_place=False):
+    """ То же, что point_ops.apply_point_ops, но по полосам. При in_place=True исходное изображение может быть
+    изменено и возвращено как результат. """
+
+    plan = compile_point_ops(tuple(operations), colormap)
+    image = prepare(image)
+    if image.mode == 'P' and not plan.gray:
+        # у палитрового изображения меняется только палитра, пиксели не обрабатываются
+        return apply_point_ops(image, operations, colormap)
+
+    rows = band_rows(image.width)
+    if rows >= image.height:
+        return apply_point_ops(image, operations, colormap)
+    output = None
+    for top in range(0, image.height, rows):
+        box = (0, top, image.width, min(image.height, top + rows))
+        band = apply_point_ops(image.crop(box), operations, colormap)
+        if output is None:
+            output = image if in_place and band.mode == image.mode else Image.new(band.mode, image.size)
+        output.paste(band, box)
+    return output
+
+
+def tiled_pixelate(image, pixel_size, output_size=None, colors=None):
+    """ То же, что transforms.pixelate_image, но увеличение сетки блоков идет по полосам. """
+
+    width, height = output_size or image.size
+    grid = image.resize((width // pixel_size, height // pixel_size), Image.Resampling.NEAREST)
+    if colors:
+        grid = grid.convert('RGB').quantize(colors, dither=Image.Dither.NONE)
+    output = Image.new(grid.mode, (grid.width * pixel_size, grid.height * pixel_size))
+    if grid.mode == 'P':
+        output.putpalette(grid.getpalette())
+    rows = band_rows(output.width, pixel_size) // pixel_size  # рядов блоков в одной полосе
+    for top in range(0, grid.height, rows):
+        strip = grid.crop((0, top, grid.width, min(grid.height, top + rows)))
+        strip = strip.resize((strip.width * pixel_size, strip.height * pixel_size), Image.Resampling.NEAREST)
+        output.paste(strip, (0, top * pixel_size))
+    return output
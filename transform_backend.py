@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from multiprocessing import get_context
+
+import metrics
+from transforms import run_transform, timed_transform
+
+
+class BackendBusy(Exception):
+    """ Очередь исполнителя заполнена, новую задачу принять нельзя. """
+
+
+class TransformTimeout(Exception):
+    """ Задача не завершилась за отведенное время. """
+
+
+class TransformBackend:
+    """ Исполнитель преобразований изображений. Режимы:
+    - 'inline' - в потоке обработчика, как раньше;
+    - 'thread' - в пуле потоков (Pillow отпускает GIL на время большинства операций);
+    - 'process' - в пуле процессов, чтобы обработка масштабировалась по ядрам.
+    В пул передаются байты изображения, обратно возвращаются закодированные байты (или строка ASCII-арта).
+    Одновременно принимается не больше workers + max_queue задач, остальные получают BackendBusy."""
+
+    def __init__(self, mode='inline', workers=None, max_queue=None, timeout=30):
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 2 if max_queue is None else max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._accepted = 0  # принятые и еще не завершенные задачи
+        self._accepted_lock = threading.Lock()
+        if mode == 'inline':
+            self._executor = None
+        elif mode == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transform')
+        elif mode == 'process':
+            # spawn, а не fork: процесс бота многопоточный, и fork мог бы унаследовать захваченные блокировки
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'))
+        else:
+            raise ValueError(f'Unknown transform backend: {mode}')
+
+    def run(self, operation, data, params):
+        """ Выполняет run_transform(operation, data, params) и возвращает результат. Бросает BackendBusy, если
+        очередь заполнена, и TransformTimeout, если результат не получен за timeout секунд. В режиме 'inline'
+        ограничение по времени не действует. Длительности стадий записываются в metrics.STAGE_SECONDS."""
+
+        if not self._slots.acquire(blocking=False):
+            raise BackendBusy()
+        self._change_accepted(1)
+        if self._executor is None:
+            try:
+                timings = {}
+                result = run_transform(operation, data, params, timings)
+                metrics.observe_stages(operation, timings)
+                return result
+            finally:
+                self._release()
+
+        try:
+            future = self._executor.submit(timed_transform, operation, data, params, time.time())
+        except BaseException:
+            self._release()
+            raise
+        # место в очереди освобождается, только когда задача действительно завершилась, а не по таймауту
+        future.add_done_callback(lambda _: self._release())
+        try:
+            result, timings = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise TransformTimeout() from None
+        metrics.observe_stages(operation, timings)
+        return result
+
+    def queue_depth(self):
+        """ Число принятых задач, которые ждут свободного воркера. """
+
+        return max(0, self._accepted - self.workers) if self._executor is not None else 0
+
+    def _change_accepted(self, delta):
+        with self._accepted_lock:
+            self._accepted += delta
+
+    def _release(self):
+        self._change_accepted(-1)
+        self._slots.release()
+
+    def shutdown(self):
+        """ Останавливает пул, дожидаясь завершения уже начатых задач. """
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,187 @@
+""" Преобразования изображений: функции операций бота и полный цикл run_transform (байты -> байты).
+
+Модуль не имеет побочных эффектов при импорте и не импортирует Pillow и модули обработки (tiles, point_ops,
+ascii_image и т. д.) до первого вызова преобразования, поэтому его дешево импортировать в инструментах,
+процессах пула (transform_backend.py, batch.py) и тестах. Токен бота и сам бот ему не нужны.
+"""
+import time
+
+from photo_sizes import ASCII_OPERATIONS, required_size, size_params
+
+
+def resize_image(image, new_width=100):
+    """ Изменяет размер изображения с сохранением пропорций."""
+
+    width, height = image.size
+    ratio = height / width
+    new_height = int(new_width * ratio)
+    return image.resize((new_width, new_height))
+
+def resize_for_sticker(image, new_max_size=512):
+    """ Изменяет, в случае необходимости,  размеры изображения, ограничивая максимальный из них определенной величиной
+    (512 пикселей), сохраняя при этом исходную пропорцию."""
+
+    width, height = image.size
+    # print(f'Размеры изображения исходного: {width, height}')
+    if width < new_max_size and height < new_max_size:
+        return image
+    else:
+        ratio = height / width
+        if height > width:
+            new_height = new_max_size
+            new_width = int(new_height / ratio)
+        else:
+            new_width = new_max_size
+            new_height = int(new_width * ratio)
+        # print(f'Размеры изображения трансформированного: {new_width, new_height}')
+        image_for_sticker = image.resize((new_width, new_height))
+        return image_for_sticker
+
+def invert_colors(image, in_place=False):
+    """ Преобразует изображение в инверсионное (эффект негатива). Работает с любым режимом изображения,
+    прозрачность сохраняется (см. point_ops.py). Большие изображения обрабатываются полосами (см. tiles.py),
+    при in_place=True - прямо в исходном изображении."""
+    from tiles import tiled_point_ops
+
+    return tiled_point_ops(image, ['negative'], in_place=in_place)
+
+
+def mirror_image(image, horizontal=True):
+    """ Преобразует изображение в зеркальное: при horizontal=True отражает слева направо, иначе сверху вниз """
+    from PIL import Image
+
+    if horizontal:
+        im_flipped = image.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
+    else:
+        im_flipped = image.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
+    return im_flipped
+
+
+def convert_to_heatmap(image, colormap=None, in_place=False):
+    """ Преобразует изображение так, чтобы его цвета отображались в виде тепловой карты: по умолчанию
+    (point_ops.DEFAULT_COLORMAP) от синего (холодные области) до красного (теплые области), другие цветовые
+    карты - см. point_ops.COLORMAPS. Палитра карты строится один раз и накладывается на изображение в оттенках
+    серого. Большие изображения обрабатываются полосами, как в invert_colors."""
+    from point_ops import DEFAULT_COLORMAP
+    from tiles import tiled_point_ops
+
+    return tiled_point_ops(image, ['heatmap'], colormap or DEFAULT_COLORMAP, in_place)
+
+
+def grayify(image):
+    """ Преобразует цветное изображение в оттенки серого. """
+    from point_ops import apply_point_ops
+
+    return apply_point_ops(image, ['grayscale'])
+
+
+def image_to_ascii(image, charset, new_width=40):
+    """ Основная функция для преобразования изображения в ASCII-арт. Изменяет размер, преобразует в градации серого
+    и затем в строку символов из набора charset. Если арт шириной new_width не помещается в одно сообщение,
+    ширина уменьшается (см. ascii_art.image_to_ascii)."""
+    import ascii_art
+
+    return ascii_art.image_to_ascii(image, charset, new_width)
+
+
+def ascii_to_image(image, charset, columns=200, color=False):
+    """ Рисует ASCII-арт шириной columns символов картинкой (см. ascii_image.py): черным по белому или, при
+    color=True, цветами исходника на черном фоне. Ширина не ограничена длиной сообщения Telegram."""
+    from ascii_image import render_ascii
+
+    return render_ascii(image, charset, columns, color)
+
+
+def pixels_to_ascii(image, charset):
+    """ Конвертирует пиксели изображения в градациях серого в строку символов из набора charset """
+    import ascii_art
+
+    return ascii_art.pixels_to_ascii(image, charset)
+
+
+# Огрубляем изображение
+def pixelate_image(image, pixel_size, output_size=None, colors=None):
+    """ Принимает изображение и размер пикселя. Уменьшает изображение до размера, где один пиксель представляет большую
+     область, затем увеличивает обратно, создавая пиксельный эффект. Если задан output_size, размер пикселя
+     отсчитывается от него, а не от размеров image: так уменьшенная копия фотографии дает тот же результат,
+     что и оригинал. Если задано colors, сетка блоков переводится в палитру из colors цветов до увеличения
+     (для кодирования в PNG с палитрой, см. encoders.py). Увеличение идет полосами (см. tiles.py)."""
+    from tiles import tiled_pixelate
+
+    return tiled_pixelate(image, pixel_size, output_size, colors)
+
+
+def apply_operation(image, operation, params, in_place=False):
+    """ Применяет к изображению операцию operation (значение callback_data кнопки) с параметрами params.
+    При in_place=True поточечные операции могут записать результат прямо в image. """
+
+    if operation == 'pixelate':
+        return pixelate_image(image, params['pixel_size'], params.get('output_size'), params.get('colors'))
+    if operation == 'negative':
+        return invert_colors(image, in_place)
+    if operation == 'mirror':
+        return mirror_image(image, params.get('horizontal', True))
+    if operation == 'heatmap':
+        return convert_to_heatmap(image, params.get('colormap'), in_place)
+    if operation in ('ascii_image', 'ascii_color'):
+        return ascii_to_image(image, params.get('charset', ''), params.get('new_width', 200),
+                              operation == 'ascii_color')
+    if operation == 'resize':
+        return resize_for_sticker(image, params.get('new_max_size', 512))
+    if operation == 'pipeline':
+        from pipeline import run_pipeline
+        from point_ops import DEFAULT_COLORMAP
+
+        return run_pipeline(image, params['steps'], params.get('pixel_size', 20), params.get('output_size'),
+                            params.get('colormap', DEFAULT_COLORMAP))
+    raise ValueError(f'Unknown operation: {operation}')
+
+
+def run_transform(operation, data, params, timings=None):
+    """ Полный цикл обработки для исполнителя задач: декодирует байты изображения, применяет операцию и возвращает
+    закодированные байты (формат выбирается по операции, см. encoders.py), а для операции 'ascii' - строку
+    ASCII-арта (ASCII-арт картинкой - 'ascii_image' и 'ascii_color'). Принимает и возвращает только байты и простые типы, поэтому может выполняться в отдельном процессе.
+    Изображение декодируется не крупнее, чем нужно операции (см. decoding.decode_reduced), ASCII-арт - сразу
+    в оттенках серого (кроме цветного 'ascii_color'). Изображения больше decoding.IMAGE_MAX_PIXELS отвергаются (ImageTooLarge) до декодирования,
+    а стороной больше IMAGE_MAX_SIDE (документы) обрабатываются как уменьшенная копия. Если передан словарь
+    timings, в него записываются длительности стадий decode, transform и encode в секундах."""
+    from decoding import decode_reduced, fit_size, open_image
+    from encoders import encode_result, encoder_policy
+
+    started = time.perf_counter()
+    image = open_image(data)
+    full_size = fit_size(tuple(params.get('output_size') or image.size))
+    min_size = required_size(operation, *full_size, **size_params(operation, params))
+    image = decode_reduced(image, min_size, 'L' if operation in ('ascii', 'ascii_image') else None)
+    image.load()
+    if operation not in ASCII_OPERATIONS + ('pixelate', 'resize') and (image.width > full_size[0] or
+                                                             image.height > full_size[1]):
+        # документ больше IMAGE_MAX_SIDE: масштабирование при декодировании уменьшает его лишь до ближайшей доли
+        image = image.resize(full_size, reducing_gap=2.0)
+    decoded = time.perf_counter()
+    if operation in ('pixelate', 'pipeline'):
+        # размер блоков пикселизации и стикера считается от исходного, а не уменьшенного при декодировании размера
+        params = dict(params, output_size=full_size)
+    if operation == 'pixelate':
+        params = dict(params, colors=encoder_policy(operation).get('colors'))
+    stages = {'decode': decoded - started}
+    if operation == 'ascii':
+        result = image_to_ascii(image, params.get('charset', ''), params.get('new_width', 40))
+        stages['transform'] = time.perf_counter() - decoded
+    else:
+        # декодированное изображение больше нигде не нужно, поэтому результат можно писать прямо в него
+        image = apply_operation(image, operation, params, in_place=True)
+        transformed = time.perf_counter()
+        result = encode_result(image, operation)
+        stages.update(transform=transformed - decoded, encode=time.perf_counter() - transformed)
+    if timings is not None:
+        timings.update(stages)
+    return result
+
+
+def timed_transform(operation, data, params, submitted):
+    """ run_transform для пула исполнителя: возвращает (результат, длительности стадий), добавляя к стадиям
+    ожидание в очереди (queue) от момента submitted (time.time() при постановке задачи)."""
+
+    timings = {'queue': max(0.0, time.time() - submitted)}
+    return run_transform(operation, data, params, timings), timings